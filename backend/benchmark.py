@@ -1,7 +1,34 @@
+"""
+Search latency against a running server (python manage.py runserver).
+
+    python benchmark.py                 # one request at a time, by query length, as a table
+    python benchmark.py load [--concurrency 8 | --rate 50] [--duration 30] [--mix basic/occurrences=2 ...]
+                             [--output load.json] [--csv requests.csv]
+
+The load mode measures throughput under concurrent users:
+- closed loop (default): --concurrency users, each sending its next request as soon
+  as the previous one answered;
+- open loop (--rate): requests arrive at random (Poisson) times, --rate per second
+  on average, whether or not earlier ones answered, with at most --concurrency in
+  flight. Latency counts from the planned arrival, so time spent queued behind a
+  slow server counts too.
+Queries are drawn from WORD_BANK, the type/ranking of each from --mix (the four
+configs of the table by default). The first --warmup seconds are sent but not
+counted. It reports throughput, errors and p50/p95/p99/max latency overall, per
+config and per --interval seconds (latency over time); --output writes that as
+JSON, --csv writes one row per request.
+"""
+import argparse
+import csv
+import json
+import threading
 import time
 import random
 import requests
 import statistics
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+from typing import Dict, List, Optional, Tuple
 
 API_URL = "http://localhost:8000/api/search"
 
@@ -91,6 +118,211 @@ def run_benchmark():
         print("mean-std,\t" + "\t".join(f"{a-s:.6f}" for a, s in zip(averages, stds)))
 
 
+# LOAD TEST
+
+DEFAULT_MIX = ["basic/occurrences=1", "basic/closeness=1", "regex/occurrences=1", "regex/closeness=1"]
+REQUEST_TIMEOUT = 30 # seconds
+
+Config = Tuple[str, str] # (type, ranking)
+
+
+@dataclass
+class Sample:
+    at: float # seconds since the start of the test, when the request was due
+    config: str # type/ranking
+    query: str
+    status: int # HTTP status, 0 if the request failed
+    latency: float # seconds
+    error: str = ""
+
+
+def parse_mix(mix: List[str]) -> Tuple[List[Config], List[float]]:
+    """`type/ranking=weight` entries (weight 1 if omitted) => configs and their weights."""
+    configs, weights = [], []
+    for entry in mix:
+        config, _, weight = entry.partition("=")
+        type_, _, ranking = config.partition("/")
+        configs.append((type_, ranking or "occurrences"))
+        weights.append(float(weight or 1))
+    return configs, weights
+
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    """Nearest-rank percentile of an increasing list."""
+    if not sorted_values:
+        return float("nan")
+    rank = max(0, min(len(sorted_values) - 1, int(round(p / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[rank]
+
+
+def summarize(samples: List[Sample], seconds: float) -> dict:
+    latencies = sorted(sample.latency for sample in samples if sample.status == 200)
+    errors = sum(1 for sample in samples if sample.status != 200)
+    return {
+        "requests": len(samples),
+        "errors": errors,
+        "error_rate": round(errors / len(samples), 4) if samples else 0.0,
+        "throughput": round(len(latencies) / seconds, 2) if seconds > 0 else 0.0, # successful requests/s
+        **{f"p{p}_ms": round(percentile(latencies, p) * 1000, 2) for p in (50, 95, 99)},
+        "max_ms": round(latencies[-1] * 1000, 2) if latencies else float("nan"),
+    }
+
+
+class LoadTest:
+    def __init__(self, url: str, configs: List[Config], weights: List[float], seed: Optional[int]):
+        self.url = url
+        self.configs = configs
+        self.weights = weights
+        self.random = random.Random(seed)
+        self.random_lock = threading.Lock()
+        self.local = threading.local()
+        self.samples: List[Sample] = []
+        self.samples_lock = threading.Lock()
+        self.start = 0.0
+
+    def session(self) -> requests.Session:
+        # One keep-alive connection per thread
+        if not hasattr(self.local, "session"):
+            self.local.session = requests.Session()
+        return self.local.session
+
+    def next_request(self) -> Tuple[Config, str]:
+        with self.random_lock:
+            config = self.random.choices(self.configs, self.weights)[0]
+            query = self.random.choice(WORD_BANK[self.random.randint(1, 10)])
+        return config, query
+
+    def send(self, due: float):
+        """One request, due at `due` (perf_counter time)."""
+        (type_, ranking), query = self.next_request()
+        status, error = 0, ""
+        try:
+            r = self.session().post(self.url, json={"query": query, "type": type_, "ranking": ranking}, timeout=REQUEST_TIMEOUT)
+            status = r.status_code
+        except requests.RequestException as e:
+            error = type(e).__name__
+        sample = Sample(due - self.start, f"{type_}/{ranking}", query, status, time.perf_counter() - due, error)
+        with self.samples_lock:
+            self.samples.append(sample)
+
+    def closed_loop(self, concurrency: int, seconds: float):
+        def user():
+            while time.perf_counter() < self.start + seconds:
+                self.send(time.perf_counter())
+
+        threads = [threading.Thread(target=user) for _ in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def open_loop(self, rate: float, concurrency: int, seconds: float):
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            due = self.start
+            while True:
+                with self.random_lock:
+                    due += self.random.expovariate(rate)
+                if due >= self.start + seconds:
+                    break
+                time.sleep(max(0.0, due - time.perf_counter()))
+                executor.submit(self.send, due)
+
+    def run(self, concurrency: int, rate: Optional[float], seconds: float) -> List[Sample]:
+        self.start = time.perf_counter()
+        if rate:
+            self.open_loop(rate, concurrency, seconds)
+        else:
+            self.closed_loop(concurrency, seconds)
+        return sorted(self.samples, key=lambda sample: sample.at)
+
+
+def load_report(samples: List[Sample], args: argparse.Namespace) -> dict:
+    measured = [sample for sample in samples if sample.at >= args.warmup]
+    seconds = args.duration - args.warmup
+    timeline = []
+    for bucket_start in range(int(args.warmup), int(args.duration), args.interval):
+        bucket = [sample for sample in measured if bucket_start <= sample.at < bucket_start + args.interval]
+        bucket_seconds = min(args.interval, args.duration - bucket_start)
+        timeline.append({"t": bucket_start, **summarize(bucket, bucket_seconds)})
+    return {
+        "settings": {
+            "url": args.url,
+            "mode": "open" if args.rate else "closed",
+            "concurrency": args.concurrency,
+            "rate": args.rate,
+            "duration": args.duration,
+            "warmup": args.warmup,
+            "mix": args.mix,
+        },
+        "summary": summarize(measured, seconds),
+        "configs": {
+            config: summarize([sample for sample in measured if sample.config == config], seconds)
+            for config in sorted({sample.config for sample in measured})
+        },
+        "errors": {error: sum(1 for sample in measured if (sample.error or str(sample.status)) == error)
+                   for error in sorted({sample.error or str(sample.status) for sample in measured if sample.status != 200})},
+        "timeline": timeline,
+    }
+
+
+def print_row(label: str, stats: dict):
+    print(f"{label:<22}{stats['requests']:>9}{stats['errors']:>8}{stats['throughput']:>10.1f}"
+          f"{stats['p50_ms']:>10.1f}{stats['p95_ms']:>10.1f}{stats['p99_ms']:>10.1f}{stats['max_ms']:>10.1f}")
+
+
+def run_load_test(args: argparse.Namespace):
+    configs, weights = parse_mix(args.mix)
+    mode = f"{args.rate}/s open loop, at most {args.concurrency} in flight" if args.rate else f"{args.concurrency} users"
+    print(f"--- LOAD TEST: {mode}, {args.duration}s ({args.warmup}s warm-up) against {args.url} ---")
+
+    samples = LoadTest(args.url, configs, weights, args.seed).run(args.concurrency, args.rate, args.duration)
+    report = load_report(samples, args)
+
+    print(f"\n{'':<22}{'requests':>9}{'errors':>8}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    print_row("all", report["summary"])
+    for config, stats in report["configs"].items():
+        print_row(config, stats)
+    if report["errors"]:
+        print("\nerrors:", ", ".join(f"{error} ×{count}" for error, count in report["errors"].items()))
+    print("\nover time:")
+    for stats in report["timeline"]:
+        print_row(f"{stats['t']}s", stats)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print("\nReport written to", args.output)
+    if args.csv:
+        with open(args.csv, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=list(Sample.__dataclass_fields__))
+            writer.writeheader()
+            for sample in samples:
+                writer.writerow({**asdict(sample), "at": round(sample.at, 4), "latency": round(sample.latency, 6)})
+        print("Requests written to", args.csv)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("mode", nargs="?", choices=["table", "load"], default="table")
+    parser.add_argument("--url", default=API_URL)
+    parser.add_argument("--concurrency", type=int, default=8, help="users (closed loop), or requests in flight (open loop)")
+    parser.add_argument("--rate", type=float, help="requests per second, open loop")
+    parser.add_argument("--duration", type=int, default=30, help="seconds")
+    parser.add_argument("--warmup", type=int, default=2, help="seconds not counted")
+    parser.add_argument("--interval", type=int, default=5, help="seconds per point of latency over time")
+    parser.add_argument("--mix", nargs="+", default=DEFAULT_MIX, metavar="TYPE/RANKING=WEIGHT")
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--output", help="JSON report")
+    parser.add_argument("--csv", help="one row per request")
+    args = parser.parse_args()
+
+    if args.mode == "load":
+        if args.warmup >= args.duration:
+            parser.error("--warmup must be shorter than --duration")
+        run_load_test(args)
+    else:
+        run_benchmark()
+
 
 if __name__ == "__main__":
-    run_benchmark()
+    main()
@@ -0,0 +1,94 @@
+"""
+Throughput of POST /api/search/batch against the same number of searches sent one by
+one to POST /api/search, on a running server (python manage.py runserver, gunicorn).
+
+    python -m benchmarks.batch [--url http://localhost:8000] [--queries 100] [--rounds 5]
+                               [--ranking occurrences tfidf pagerank closeness bm25] [--output batch.json]
+
+Queries of 1 to 3 terms are drawn from the saved index as in suite.py, so this must run
+on the server's corpus. Every round draws new queries for the separate calls and for
+the batch, so that neither is answered from the result cache. Separate calls are sent
+one after the other (--concurrency to send several at once).
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+import numpy as np
+import requests
+
+from .suite import draw_queries
+
+RANKINGS = ["occurrences", "tfidf", "pagerank", "closeness", "bm25"]
+REQUEST_TIMEOUT = 120 # seconds
+
+
+def unique_queries(count: int, seed: int) -> List[str]:
+    """`count` distinct queries, drawn from the saved index."""
+    from search.business_logic import current_index
+    with contextlib.redirect_stdout(io.StringIO()):
+        search_index = current_index()
+    rng = np.random.default_rng(seed)
+    queries: Dict[str, None] = {}
+    while len(queries) < count:
+        queries.update(dict.fromkeys(" ".join(terms) for terms in draw_queries(search_index, count, rng)))
+    return list(queries)[:count]
+
+
+def separate_calls(session: requests.Session, url: str, searches: List[dict], concurrency: int) -> float:
+    def send(search: dict):
+        session.post(f"{url}/api/search", json=search, timeout=REQUEST_TIMEOUT).raise_for_status()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(send, searches))
+    return time.perf_counter() - start
+
+
+def batch_call(session: requests.Session, url: str, searches: List[dict]) -> float:
+    start = time.perf_counter()
+    session.post(f"{url}/api/search/batch", json=searches, timeout=REQUEST_TIMEOUT).raise_for_status()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--queries", type=int, default=100, help="searches per batch")
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--ranking", nargs="+", default=RANKINGS, choices=RANKINGS)
+    parser.add_argument("--concurrency", type=int, default=1, help="separate calls in flight")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="JSON report")
+    args = parser.parse_args()
+
+    os.chdir(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))) # the index paths are relative to backend/
+    queries = unique_queries(2 * args.queries * args.rounds * len(args.ranking), args.seed)
+    session = requests.Session()
+    results = []
+    print("ranking,separate_searches_per_s,batch_searches_per_s,speedup")
+    for r, ranking in enumerate(args.ranking):
+        separate_seconds, batch_seconds = [], []
+        for round_ in range(args.rounds):
+            offset = 2 * args.queries * (r * args.rounds + round_)
+            searches = [{"query": query, "type": "basic", "ranking": ranking} for query in queries[offset:offset + 2 * args.queries]]
+            separate_seconds.append(separate_calls(session, args.url, searches[:args.queries], args.concurrency))
+            batch_seconds.append(batch_call(session, args.url, searches[args.queries:]))
+        # Medians, as the first round also pays for loading whatever the ranking needs
+        separate = args.queries / float(np.median(separate_seconds))
+        batch = args.queries / float(np.median(batch_seconds))
+        results.append({"ranking": ranking, "separate_searches_per_s": round(separate, 1), "batch_searches_per_s": round(batch, 1), "speedup": round(batch / separate, 2)})
+        print(f"{ranking},{separate:.1f},{batch:.1f},{batch / separate:.2f}", flush=True)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"queries": args.queries, "rounds": args.rounds, "concurrency": args.concurrency, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Microbenchmark of closeness_centrality_ranking: the original pairwise pandas
+implementation against the current sparse one, on random TF-IDF-like hits.
+
+    python -m benchmarks.closeness [--sizes 50 500 5000] [--terms 20000] [--old-max 500]
+
+The old implementation is quadratic in Python calls, so it is only run up to
+--old-max hits. Zero hits are always checked too.
+"""
+import argparse
+import time
+from typing import Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from sklearn.preprocessing import normalize
+
+from search.business_logic import SearchHits, SearchIndex, closeness_centrality_ranking
+
+
+def old_cosine_similarity(vec1: pd.Series, vec2: pd.Series) -> np.float64:
+    dot_product = np.dot(vec1, vec2)
+    magnitude1 = np.linalg.norm(vec1)
+    magnitude2 = np.linalg.norm(vec2)
+    return dot_product / (magnitude1 * magnitude2)
+
+
+def old_closeness_centrality_ranking(hits: pd.DataFrame) -> List[Tuple[float, str]]:
+    """closeness_centrality_ranking as it was on the dense DataFrame index."""
+    distance_matrix: Dict[str, List[float]] = dict()
+    for doc_id_1, series_1 in hits.iterrows():
+        distance_matrix[doc_id_1] = []
+        for _doc_id_2, series_2 in hits.iterrows():
+            distance_matrix[doc_id_1].append(old_cosine_similarity(series_1, series_2))
+    distance_df = pd.DataFrame.from_dict(data=distance_matrix, orient="index")
+    return sorted([(-np.sum(distance_series), doc_id) for doc_id, distance_series in distance_df.iterrows()])
+
+
+def random_hits(n_hits: int, n_terms: int, density: float, rng: np.random.Generator) -> sparse.csr_matrix:
+    return normalize(sparse.random(n_hits, n_terms, density=density, format="csr", random_state=rng))
+
+
+def timed(fn, *args) -> Tuple[float, object]:
+    start = time.perf_counter()
+    result = fn(*args)
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[50, 500, 5000])
+    parser.add_argument("--terms", type=int, default=20_000)
+    parser.add_argument("--density", type=float, default=0.02)
+    parser.add_argument("--old-max", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    print("hits,old_seconds,new_seconds,speedup,identical")
+    # No hits (a query without indexed terms): both rank nothing
+    empty_index = SearchIndex.from_matrix(sparse.csr_matrix((0, 1)), [], np.array(["t0"]), np.ones(1), "benchmark")
+    empty_ranking = closeness_centrality_ranking(SearchHits(empty_index, np.arange(0)))
+    print(f"0,,,,{empty_ranking == old_closeness_centrality_ranking(pd.DataFrame())}")
+    for n_hits in args.sizes:
+        matrix = random_hits(n_hits, args.terms, args.density, rng)
+        doc_ids = [str(i) for i in range(n_hits)]
+        terms = np.array([f"t{i}" for i in range(args.terms)])
+        index = SearchIndex.from_matrix(matrix, doc_ids, terms, np.ones(args.terms), "benchmark")
+        hits = SearchHits(index, np.arange(n_hits))
+
+        new_time, new_ranking = timed(closeness_centrality_ranking, hits)
+
+        if n_hits <= args.old_max:
+            dense = pd.DataFrame(matrix.toarray(), index=doc_ids, columns=terms)
+            old_time, old_ranking = timed(old_closeness_centrality_ranking, dense)
+            identical = [doc_id for _, doc_id in old_ranking] == [doc_id for _, doc_id in new_ranking]
+            print(f"{n_hits},{old_time:.6f},{new_time:.6f},{old_time / new_time:.0f}x,{identical}")
+        else:
+            print(f"{n_hits},,{new_time:.6f},,")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Deterministic synthetic corpus: text documents whose words follow Zipf's law,
+laid out like webscraper/ (one `<id>.txt` per document and a documents_meta.json),
+so that the whole indexing and search path can run on it.
+
+    python -m benchmarks.corpus /tmp/corpus [--docs 1000] [--words 2000] [--vocabulary 50000] [--zipf 1.1] [--seed 0]
+
+IDEA:
+- The vocabulary is made of random lowercase words (no English stop words, so
+  every word is indexed), ranked: the word of rank k has a frequency ∝ 1/k^zipf.
+- Document lengths are log-normal around --words, as books are.
+- Document i only depends on the seed and i, so the corpus of n documents is a
+  prefix of every larger corpus with the same seed: points of a scaling curve
+  differ by the added documents only.
+"""
+import argparse
+import json
+import os
+from typing import List
+
+import numpy as np
+from sklearn.feature_extraction.text import ENGLISH_STOP_WORDS
+
+LETTERS = np.array(list("abcdefghijklmnopqrstuvwxyz"))
+WORD_LENGTHS = (3, 10) # shortest and longest words (exclusive)
+WORDS_PER_LINE = 12
+LENGTH_SIGMA = 0.5 # of the log of document lengths
+
+
+def make_vocabulary(size: int, seed: int) -> np.ndarray:
+    """`size` distinct words, by rank."""
+    rng = np.random.default_rng(seed)
+    words: List[str] = []
+    seen = set(ENGLISH_STOP_WORDS)
+    while len(words) < size:
+        for length in rng.integers(*WORD_LENGTHS, size=size - len(words)).tolist():
+            word = "".join(rng.choice(LETTERS, size=length).tolist())
+            if word not in seen:
+                seen.add(word)
+                words.append(word)
+    return np.array(words)
+
+
+def zipf_cdf(size: int, exponent: float) -> np.ndarray:
+    weights = 1 / np.arange(1, size + 1) ** exponent
+    return np.cumsum(weights) / weights.sum()
+
+
+def make_document(vocabulary: np.ndarray, cdf: np.ndarray, words: int, seed: int, number: int) -> str:
+    rng = np.random.default_rng([seed, number])
+    length = max(1, int(rng.lognormal(np.log(words), LENGTH_SIGMA)))
+    ranks = np.minimum(np.searchsorted(cdf, rng.random(length)), len(cdf) - 1)
+    tokens = vocabulary[ranks].tolist()
+    lines = [" ".join(tokens[i:i + WORDS_PER_LINE]) for i in range(0, length, WORDS_PER_LINE)]
+    return "\n".join(lines) + "\n"
+
+
+def generate(output_dir: str, docs: int, words: int, vocabulary_size: int, zipf: float = 1.1, seed: int = 0) -> str:
+    """
+    Write the corpus to `output_dir`/documents/ and `output_dir`/documents_meta.json.
+    Returns the documents directory.
+    """
+    documents_dir = os.path.join(output_dir, "documents")
+    os.makedirs(documents_dir, exist_ok=True)
+    vocabulary = make_vocabulary(vocabulary_size, seed)
+    cdf = zipf_cdf(vocabulary_size, zipf)
+
+    meta = []
+    for number in range(docs):
+        doc_id = str(number + 1)
+        with open(os.path.join(documents_dir, f"{doc_id}.txt"), "w", encoding="utf-8") as f:
+            f.write(make_document(vocabulary, cdf, words, seed, number))
+        meta.append({"id": doc_id, "title": f"Synthetic {doc_id}", "cover": "", "text_path": f"documents/{doc_id}.txt"})
+    with open(os.path.join(output_dir, "documents_meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    return documents_dir
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("output_dir")
+    parser.add_argument("--docs", type=int, default=1000)
+    parser.add_argument("--words", type=int, default=2000, help="median words per document")
+    parser.add_argument("--vocabulary", type=int, default=50_000)
+    parser.add_argument("--zipf", type=float, default=1.1)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    documents_dir = generate(args.output_dir, args.docs, args.words, args.vocabulary, args.zipf, args.seed)
+    print(f"{args.docs} documents written to {documents_dir}")
+
+
+if __name__ == "__main__":
+    main()
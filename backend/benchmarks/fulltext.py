@@ -0,0 +1,48 @@
+"""
+Per-core scaling of the full-text regex search.
+
+    python -m benchmarks.fulltext [--pattern REGEX] [--workers 1 2 4 8] [--repeat 3]
+
+The default pattern has no literal to prefilter on, and no result limit is
+applied, so each run is a full regex pass over the corpus. Each pool is warmed
+up before it is timed.
+"""
+import argparse
+import glob
+import os
+import statistics
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from search.fulltext import fulltext_search
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--documents", default="webscraper/documents/")
+    parser.add_argument("--pattern", default=r"[qxz]{4}")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    paths = sorted(glob.glob(os.path.join(args.documents, "*.txt")))
+    size_mb = sum(os.path.getsize(path) for path in paths) / 1e6
+    print(f"{len(paths)} documents, {size_mb:.1f} MB, pattern {args.pattern!r}")
+    print("workers,median_seconds,mb_per_second,speedup,matches")
+
+    baseline = None
+    for workers in args.workers:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(abs, range(workers)))  # start the workers
+            times = []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                matches, _truncated = fulltext_search(paths, args.pattern, limit=len(paths), pool=pool, seconds=600)
+                times.append(time.perf_counter() - start)
+        median = statistics.median(times)
+        baseline = baseline or median
+        print(f"{workers},{median:.4f},{size_mb / median:.1f},{baseline / median:.2f}x,{len(matches)}")
+
+
+if __name__ == "__main__":
+    main()
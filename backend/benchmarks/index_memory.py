@@ -0,0 +1,63 @@
+"""
+Compare the resident memory of the old dense TF-IDF DataFrame with the sparse
+CSR/CSC SearchIndex on the same corpus.
+
+Each layout is built in its own subprocess so that peak RSS is not shared:
+
+    python -m benchmarks.index_memory [documents_dir]
+"""
+import glob
+import subprocess
+import sys
+
+
+def status_mb(field: str) -> float:
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(f"{field}:"):
+                return int(line.split()[1]) / 1024
+    return float("nan")
+
+
+def rss_mb() -> float:
+    return status_mb("VmRSS")
+
+
+def peak_rss_mb() -> float:
+    # VmHWM, not ru_maxrss: the kernel updates the latter lazily, so it can read a little
+    # below the current RSS
+    return status_mb("VmHWM")
+
+
+def build(layout: str, documents_dir: str):
+    from pathlib import Path
+    from scipy import sparse
+    from sklearn.feature_extraction.text import TfidfVectorizer
+
+    text_files = glob.glob(f"{documents_dir}/*.txt")
+    text_titles = [Path(text).stem for text in text_files]
+    before = rss_mb()
+
+    tfidf_vectorizer = TfidfVectorizer(input='filename', stop_words='english', max_features=100_000)
+    tfidf_vector = tfidf_vectorizer.fit_transform(text_files)
+    terms = tfidf_vectorizer.get_feature_names_out()
+
+    if layout == "dense":
+        import pandas as pd
+        index = pd.DataFrame(tfidf_vector.toarray(), index=text_titles, columns=terms)
+    else:
+        index = (sparse.csr_matrix(tfidf_vector), sparse.csc_matrix(tfidf_vector), {term: col for col, term in enumerate(terms)})
+    del tfidf_vectorizer, tfidf_vector
+
+    print(f"{layout:>6}: docs={len(text_files)} terms={len(terms)} "
+          f"rss_before={before:.1f}MB rss_after={rss_mb():.1f}MB peak={peak_rss_mb():.1f}MB")
+    return index
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 2:
+        build(sys.argv[1], sys.argv[2])
+    else:
+        documents_dir = sys.argv[1] if len(sys.argv) > 1 else "webscraper/documents/"
+        for layout in ("dense", "sparse"):
+            subprocess.run([sys.executable, "-m", "benchmarks.index_memory", layout, documents_dir], check=True)
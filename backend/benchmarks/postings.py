@@ -0,0 +1,95 @@
+"""
+On-disk size and decode throughput of the compressed PostingsIndex, against the
+JSON postings (term => {doc_id: count}) and the CSC matrix of the SearchIndex.
+
+    python -m benchmarks.postings [documents_dir] [--terms-per-bucket 200]
+
+Decode throughput is measured per term, from the memory-mapped files, for terms
+bucketed by document frequency.
+"""
+import os
+import json
+import glob
+import time
+import argparse
+import tempfile
+from pathlib import Path
+
+import numpy as np
+from scipy import sparse
+from sklearn.feature_extraction.text import CountVectorizer, TfidfTransformer
+
+from search.postings import PostingsIndex
+
+DF_BUCKETS = [(1, 10), (11, 100), (101, 1000), (1001, None)]
+
+
+def directory_size(directory: str) -> int:
+    return sum(os.path.getsize(path) for path in glob.glob(os.path.join(directory, "*")))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("documents_dir", nargs="?", default="webscraper/documents")
+    parser.add_argument("--terms-per-bucket", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    text_files = sorted(glob.glob(f"{args.documents_dir}/*.txt"))
+    doc_ids = [Path(path).stem for path in text_files]
+    vectorizer = CountVectorizer(input="filename", stop_words="english", dtype=np.int32)
+    counts = vectorizer.fit_transform(text_files)
+    terms = vectorizer.get_feature_names_out()
+    idf = TfidfTransformer().fit(counts).idf_
+    by_term = sparse.csc_matrix(counts)
+    print(f"{len(doc_ids)} documents, {len(terms)} terms, {counts.nnz} postings")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        json_path = os.path.join(tmp, "search_index.json")
+        start = time.perf_counter()
+        with open(json_path, "w", encoding="utf-8") as f:
+            json.dump({
+                term: {doc_ids[row]: int(count) for row, count in zip(
+                    by_term.indices[by_term.indptr[col]:by_term.indptr[col + 1]].tolist(),
+                    by_term.data[by_term.indptr[col]:by_term.indptr[col + 1]].tolist(),
+                )}
+                for col, term in enumerate(terms.tolist())
+            }, f)
+        json_write = time.perf_counter() - start
+        start = time.perf_counter()
+        with open(json_path, encoding="utf-8") as f:
+            json.load(f)
+        json_load = time.perf_counter() - start
+
+        start = time.perf_counter()
+        PostingsIndex.from_counts(counts, doc_ids, terms, idf, "benchmark").save(os.path.join(tmp, "postings"))
+        postings_write = time.perf_counter() - start
+        start = time.perf_counter()
+        postings = PostingsIndex.load(os.path.join(tmp, "postings"))
+        postings_load = time.perf_counter() - start
+
+        csc_bytes = by_term.indices.astype(np.int32).nbytes + by_term.indptr.nbytes + by_term.nnz * np.dtype(np.float64).itemsize
+        print()
+        print("format,bytes,bytes_per_posting,write_seconds,load_seconds")
+        print(f"json,{os.path.getsize(json_path)},{os.path.getsize(json_path) / counts.nnz:.2f},{json_write:.3f},{json_load:.3f}")
+        print(f"csc (SearchIndex by_term),{csc_bytes},{csc_bytes / counts.nnz:.2f},,")
+        print(f"postings (all files),{directory_size(os.path.join(tmp, 'postings'))},{directory_size(os.path.join(tmp, 'postings')) / counts.nnz:.2f},{postings_write:.3f},{postings_load:.3f}")
+        print(f"postings (encoded blocks),{postings.data.nbytes},{postings.data.nbytes / counts.nnz:.2f},,")
+
+        rng = np.random.default_rng(args.seed)
+        df = np.asarray(postings.df)
+        print()
+        print("df,terms,microseconds_per_term,million_postings_per_second")
+        for low, high in DF_BUCKETS:
+            in_bucket = np.flatnonzero((df >= low) & (df <= (high or df.max())))
+            if not len(in_bucket):
+                continue
+            sample = rng.choice(in_bucket, size=min(args.terms_per_bucket, len(in_bucket)), replace=False).tolist()
+            start = time.perf_counter()
+            decoded = sum(len(postings.postings(term_id)[0]) for term_id in sample)
+            elapsed = time.perf_counter() - start
+            print(f"{low}-{high or ''},{len(sample)},{elapsed / len(sample) * 1e6:.1f},{decoded / elapsed / 1e6:.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Latency of the BM25 / TF-IDF top-k scorer (block-max MaxScore over the compressed
+postings) against the current occurrences path (lexicographic ranking of the
+query's CSC columns), for queries of 1 to 10 terms as in benchmark.py.
+
+    python -m benchmarks.scoring [documents_dir] [--queries-per-length 20]
+    python -m benchmarks.scoring --synthetic-docs 100000
+
+--synthetic-docs skips tokenizing: documents are drawn as bags of Zipf-distributed
+terms, to see how latency grows with the corpus.
+
+Query terms are drawn from the vocabulary in proportion to their document
+frequency, so common terms (long postings) come up as often as in real queries.
+The exhaustive BM25 (no pruning) is checked to return the same top k.
+"""
+import glob
+import time
+import argparse
+from pathlib import Path
+
+import numpy as np
+from scipy import sparse
+from sklearn.feature_extraction.text import CountVectorizer
+
+from search.business_logic import MAX_RESULTS, SearchIndex, rank_lexicographically
+from search.postings import PostingsIndex
+from search.scoring import BM25Scorer, ScoringStats, TfidfScorer, top_k
+
+
+def synthetic_counts(n_docs: int, n_terms: int, tokens_per_doc: int, rng: np.random.Generator) -> sparse.csr_matrix:
+    """Bags of `tokens_per_doc` (on average) terms, term ranks following Zipf's law."""
+    lengths = rng.poisson(tokens_per_doc, n_docs)
+    rows = np.repeat(np.arange(n_docs), lengths)
+    columns = np.minimum(rng.zipf(1.1, size=len(rows)) - 1, n_terms - 1)
+    counts = sparse.csr_matrix((np.ones(len(rows), dtype=np.int32), (rows, columns)), shape=(n_docs, n_terms))
+    counts.sum_duplicates()
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("documents_dir", nargs="?", default="webscraper/documents")
+    parser.add_argument("--queries-per-length", type=int, default=20)
+    parser.add_argument("--synthetic-docs", type=int)
+    parser.add_argument("--synthetic-terms", type=int, default=50_000)
+    parser.add_argument("--tokens-per-doc", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    if args.synthetic_docs:
+        counts = synthetic_counts(args.synthetic_docs, args.synthetic_terms, args.tokens_per_doc, rng)
+        keep = np.flatnonzero(np.diff(counts.tocsc().indptr)) # as CountVectorizer, only terms that occur
+        counts = counts[:, keep].tocsr()
+        doc_ids = [str(i) for i in range(args.synthetic_docs)]
+        terms = np.array([f"t{i:06d}" for i in keep])
+    else:
+        text_files = sorted(glob.glob(f"{args.documents_dir}/*.txt"))
+        doc_ids = [Path(path).stem for path in text_files]
+        vectorizer = CountVectorizer(input="filename", stop_words="english", dtype=np.int32)
+        counts = vectorizer.fit_transform(text_files)
+        terms = vectorizer.get_feature_names_out()
+    index = SearchIndex.from_counts(counts, np.asarray(doc_ids), np.asarray(terms, dtype=str), "benchmark")
+    postings = PostingsIndex.from_counts(counts, doc_ids, terms, index.idf, "benchmark")
+    print(f"{len(doc_ids)} documents, {len(terms)} terms, top {MAX_RESULTS}")
+
+    df = np.asarray(postings.df, dtype=np.float64)
+    print("terms,current_ms,bm25_exhaustive_ms,bm25_ms,tfidf_ms,blocks_exhaustive,blocks_bm25,blocks_tfidf,identical")
+    for length in range(1, 11):
+        timings = np.zeros(4)
+        blocks = np.zeros(3)
+        identical = True
+        for _ in range(args.queries_per_length):
+            query = rng.choice(len(df), size=length, replace=False, p=df / df.sum()).tolist()
+
+            start = time.perf_counter()
+            rank_lexicographically(index.term_columns(query), np.arange(len(index)), limit=MAX_RESULTS)
+            timings[0] += time.perf_counter() - start
+
+            results = []
+            for i, (scorer, prune) in enumerate([(BM25Scorer(), False), (BM25Scorer(), True), (TfidfScorer(), True)]):
+                stats = ScoringStats()
+                start = time.perf_counter()
+                results.append(top_k(postings, query, scorer, MAX_RESULTS, prune=prune, stats=stats))
+                timings[i + 1] += time.perf_counter() - start
+                blocks[i] += stats.blocks_decoded
+            identical &= all(np.array_equal(a, b) for a, b in zip(results[0], results[1]))
+
+        ms = timings / args.queries_per_length * 1000
+        blocks /= args.queries_per_length
+        print(f"{length},{ms[0]:.3f},{ms[1]:.3f},{ms[2]:.3f},{ms[3]:.3f},{blocks[0]:.0f},{blocks[1]:.0f},{blocks[2]:.0f},{identical}")
+
+
+if __name__ == "__main__":
+    main()
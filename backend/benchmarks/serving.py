@@ -0,0 +1,139 @@
+"""
+Throughput and memory of the production server (gunicorn.conf.py) for 1, 2, 4 and
+8 workers, with and without preloading the index in the master.
+
+    python -m benchmarks.serving [--workers 1 2 4 8] [--duration 15] [--concurrency 16] [--output serving.json]
+
+Every configuration starts its own server on --port, is warmed up, then loaded by
+benchmark.py's closed-loop load test. Memory is that of the master and all of its
+workers once loaded:
+- RSS counts shared pages once per process, so it overstates what preloading
+  shares;
+- PSS (proportional set size) splits every shared page between the processes
+  mapping it: summed over the processes, it is the memory they really use.
+"""
+import argparse
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+from typing import Dict, List
+
+import requests
+
+from benchmark import DEFAULT_MIX, LoadTest, parse_mix, summarize
+
+READY_TIMEOUT = 300 # seconds, to load or build the index
+
+
+def children(pid: int) -> List[int]:
+    found = []
+    for entry in os.listdir("/proc"):
+        if entry.isdigit():
+            try:
+                with open(f"/proc/{entry}/stat") as f:
+                    # The parent pid is the second field after the parenthesized command
+                    ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+            except (OSError, IndexError, ValueError):
+                continue
+            if ppid == pid:
+                found.append(int(entry))
+    return found
+
+
+def memory_kb(pid: int) -> Dict[str, int]:
+    """{"rss", "pss"} of a process, in kB."""
+    memory = {"rss": 0, "pss": 0}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if key in ("Rss", "Pss"):
+                    memory[key.lower()] = int(value.split()[0])
+    except OSError:
+        pass
+    return memory
+
+
+def wait_ready(url: str, workers: int):
+    """
+    Until GET /api/health/ready has answered 200 4 × `workers` times in a row, so
+    that every worker is likely to have warmed up (each one warms up itself
+    without preloading).
+    """
+    deadline = time.monotonic() + READY_TIMEOUT
+    answered = 0
+    while answered < 4 * workers:
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"server not ready after {READY_TIMEOUT}s")
+        try:
+            ready = requests.get(url, timeout=READY_TIMEOUT).status_code == 200
+        except requests.RequestException:
+            ready = False
+        answered = answered + 1 if ready else 0
+        if not ready:
+            time.sleep(0.1)
+
+
+def run_server(workers: int, preload: bool, args: argparse.Namespace) -> dict:
+    env = {**os.environ, "WEB_CONCURRENCY": str(workers), "BIND": f"127.0.0.1:{args.port}", "PRELOAD": "1" if preload else "0"}
+    server = subprocess.Popen([sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py"], env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f"http://127.0.0.1:{args.port}/api/search"
+    try:
+        start = time.perf_counter()
+        wait_ready(f"http://127.0.0.1:{args.port}/api/health/ready", workers)
+        ready_seconds = time.perf_counter() - start
+
+        configs, weights = parse_mix(args.mix)
+        samples = LoadTest(url, configs, weights, args.seed).run(args.concurrency, None, args.duration)
+        measured = [sample for sample in samples if sample.at >= args.warmup]
+        stats = summarize(measured, args.duration - args.warmup)
+
+        processes = [server.pid] + children(server.pid)
+        memory = [memory_kb(pid) for pid in processes]
+        return {
+            "workers": workers,
+            "preload": preload,
+            "ready_seconds": round(ready_seconds, 2),
+            **stats,
+            "rss_mb": round(sum(m["rss"] for m in memory) / 1024, 1),
+            "pss_mb": round(sum(m["pss"] for m in memory) / 1024, 1),
+            "processes": len(processes),
+        }
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait(timeout=30)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--duration", type=int, default=15, help="seconds of load per configuration")
+    parser.add_argument("--warmup", type=int, default=3, help="seconds not counted")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--mix", nargs="+", default=DEFAULT_MIX)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--no-baseline", action="store_true", help="skip the runs without preloading")
+    parser.add_argument("--output", help="JSON report")
+    args = parser.parse_args()
+
+    print(f"{os.cpu_count()} CPUs, {args.concurrency} users, {args.duration}s per configuration")
+    print("workers,preload,ready_s,requests_per_s,p50_ms,p99_ms,errors,rss_mb,pss_mb")
+    results = []
+    for workers in args.workers:
+        for preload in ([True] if args.no_baseline else [True, False]):
+            result = run_server(workers, preload, args)
+            results.append(result)
+            print(f"{workers},{preload},{result['ready_seconds']},{result['throughput']},{result['p50_ms']},{result['p99_ms']},"
+                  f"{result['errors']},{result['rss_mb']},{result['pss_mb']}", flush=True)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"cpus": os.cpu_count(), "concurrency": args.concurrency, "duration": args.duration, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,272 @@
+"""
+In-process benchmark suite of the search path: index(), basic_search,
+regex_search, to_result, closeness_centrality_ranking and
+get_recommendations_for_query, on synthetic corpora of growing size (see
+corpus.py). Latency percentiles go to a JSON file; two such files can be compared
+to flag regressions.
+
+    python -m benchmarks.suite [--docs 250 500 1000] [--words 2000] [--vocabulary 50000] [--seed 0] [--output bench.json]
+    python -m benchmarks.suite --compare base.json new.json [--threshold 0.2] [--min-ms 0.1]
+
+IDEA:
+- Each synthetic corpus is swapped in by pointing the paths of business_logic at
+  it and at a scratch directory and clearing its caches, so the functions are
+  timed exactly as the views call them.
+- index() is timed cold (empty index directories), --index-repeat times.
+- Queries of 1 to 3 terms are drawn with the seed from the corpus vocabulary, in
+  proportion to document frequency as in scoring.py; regexes are the two-letter
+  prefixes of such terms. Every query is run --repeat times, after a warm-up run.
+- Each benchmark reports count, mean, p50, p90, p95, p99 and max in
+  milliseconds. With several corpus sizes, the scaling exponent of a benchmark
+  is the slope of log(p50) over log(documents) between the smallest and the
+  largest corpus: 1 is linear in the corpus, 0 is independent of it.
+- --compare matches benchmarks by corpus size and name, and flags those whose
+  p50 or p95 grew by more than --threshold, and by more than --min-ms (below
+  which timer noise dominates). It exits with status 1 if any did, for CI.
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional
+
+import numpy as np
+import scipy
+
+from .corpus import generate
+
+if TYPE_CHECKING:
+    from search.business_logic import SearchIndex
+
+SUITE_FORMAT = 1
+PERCENTILES = (50, 90, 95, 99)
+QUERY_LENGTHS = (1, 2, 3)
+REGEX_PREFIX = 2 # letters of a term kept as a regex prefix
+WORK_PATHS = ("INDEX_DIR", "SEGMENTS_DIR", "TOKENS_DIR", "GRAPH_DIR", "POSTINGS_DIR", "POSITIONS_DIR")
+CACHED_LOADERS = ("index", "read_search_db", "load_doc_tokens", "load_similarity_graph", "load_postings_index", "load_positional_index")
+
+Stats = Dict[str, float] # count, mean, p50, ... in milliseconds
+
+
+@contextlib.contextmanager
+def quiet():
+    """business_logic reports its progress with print: keep it off the results."""
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+def use_corpus(corpus_dir: str, work_dir: str):
+    """Point business_logic at the corpus in `corpus_dir`, with its indexes in `work_dir`."""
+    from search import business_logic
+    business_logic.DOCUMENTS_ROOT = os.path.join(corpus_dir, "documents", "")
+    business_logic.DOCUMENT_DB_PATH = os.path.join(corpus_dir, "documents_meta.json")
+    business_logic.DOCUMENT_DB_LOG_PATH = os.path.join(corpus_dir, "documents_meta.jsonl")
+    for name in WORK_PATHS:
+        setattr(business_logic, name, os.path.join(work_dir, name.lower().removesuffix("_dir"), ""))
+    for name in CACHED_LOADERS:
+        getattr(business_logic, name).cache_clear()
+
+
+def summarize(samples: List[float]) -> Stats:
+    """Percentiles of `samples` (seconds), in milliseconds."""
+    ms = np.asarray(samples) * 1000
+    stats = {"count": len(ms), "mean": round(float(ms.mean()), 4)}
+    for percentile, value in zip(PERCENTILES, np.percentile(ms, PERCENTILES)):
+        stats[f"p{percentile}"] = round(float(value), 4)
+    stats["max"] = round(float(ms.max()), 4)
+    return stats
+
+
+def measure(fn: Callable, calls: List[tuple], repeat: int) -> Stats:
+    """Time `fn` on each of `calls` (argument tuples) `repeat` times, after one warm-up call each."""
+    samples = []
+    with quiet():
+        for args in calls:
+            fn(*args)
+        for _ in range(repeat):
+            for args in calls:
+                start = time.perf_counter()
+                fn(*args)
+                samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+
+def draw_queries(index: "SearchIndex", count: int, rng: np.random.Generator) -> List[List[str]]:
+    """`count` lists of terms of the index, drawn by document frequency."""
+    df = np.diff(index.by_term.indptr).astype(np.float64)
+    return [
+        index.terms[rng.choice(len(df), size=QUERY_LENGTHS[i % len(QUERY_LENGTHS)], replace=False, p=df / df.sum())].tolist()
+        for i in range(count)
+    ]
+
+
+def run_corpus(corpus_dir: str, work_dir: str, args: argparse.Namespace) -> dict:
+    # Imported here, as it imports numpy and scipy: --compare does without
+    from search import business_logic as bl
+    from search.business_logic import SearchRanking
+
+    documents_dir = os.path.join(corpus_dir, "documents", "")
+    samples = []
+    for attempt in range(args.index_repeat):
+        use_corpus(corpus_dir, os.path.join(work_dir, f"index-{attempt}"))
+        with quiet():
+            start = time.perf_counter()
+            search_index = bl.index(documents_dir)
+            samples.append(time.perf_counter() - start)
+    benchmarks = {"index": summarize(samples)}
+
+    with quiet():
+        db = bl.read_search_db()
+        bl.load_doc_tokens()
+        bl.load_similarity_graph()
+
+    rng = np.random.default_rng(args.seed)
+    queries = [" ".join(terms) for terms in draw_queries(search_index, args.queries, rng)]
+    regexes = [f"{query.split()[0][:REGEX_PREFIX]}.*" for query in queries]
+    with quiet():
+        hits = [bl.basic_search(search_index, query) for query in queries]
+
+    benchmarks["basic_search"] = measure(bl.basic_search, [(search_index, query) for query in queries], args.repeat)
+    benchmarks["regex_search"] = measure(bl.regex_search, [(search_index, regex) for regex in regexes], args.repeat)
+    for ranking in (SearchRanking.OCCURRENCES, SearchRanking.PAGERANK):
+        benchmarks[f"to_result[{ranking.value}]"] = measure(bl.to_result, [(db, query_hits, ranking) for query_hits in hits], args.repeat)
+    benchmarks["closeness_centrality_ranking"] = measure(bl.closeness_centrality_ranking, [(query_hits,) for query_hits in hits], args.repeat)
+    benchmarks["get_recommendations_for_query"] = measure(bl.get_recommendations_for_query, [(query,) for query in queries], args.repeat)
+
+    return {
+        "docs": len(search_index),
+        "terms": len(search_index.terms),
+        "nnz": int(search_index.by_doc.nnz),
+        "bytes": sum(entry.stat().st_size for entry in os.scandir(documents_dir)),
+        "benchmarks": benchmarks,
+    }
+
+
+def scaling(runs: List[dict]) -> Dict[str, float]:
+    """Slope of log(p50) over log(documents), smallest to largest corpus, per benchmark."""
+    if len(runs) < 2:
+        return {}
+    first, last = min(runs, key=lambda run: run["docs"]), max(runs, key=lambda run: run["docs"])
+    if first["docs"] == last["docs"]:
+        return {}
+    exponents = {}
+    for name, stats in last["benchmarks"].items():
+        base = first["benchmarks"].get(name)
+        if base and base["p50"] > 0 and stats["p50"] > 0:
+            exponents[name] = round(float(np.log(stats["p50"] / base["p50"]) / np.log(last["docs"] / first["docs"])), 3)
+    return exponents
+
+
+def run(args: argparse.Namespace) -> dict:
+    report = {
+        "format": SUITE_FORMAT,
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "environment": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "scipy": scipy.__version__,
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+        },
+        "corpus": {"words": args.words, "vocabulary": args.vocabulary, "zipf": args.zipf, "seed": args.seed},
+        "settings": {"queries": args.queries, "repeat": args.repeat, "index_repeat": args.index_repeat},
+        "runs": [],
+    }
+    with tempfile.TemporaryDirectory(prefix="search-bench-") as scratch:
+        work_root = args.workdir or scratch
+        for docs in args.docs:
+            corpus_dir = os.path.join(work_root, f"corpus-{docs}")
+            print(f"{docs} documents: generating...", file=sys.stderr)
+            generate(corpus_dir, docs, args.words, args.vocabulary, args.zipf, args.seed)
+            print(f"{docs} documents: benchmarking...", file=sys.stderr)
+            report["runs"].append(run_corpus(corpus_dir, os.path.join(work_root, f"work-{docs}"), args))
+    report["scaling"] = scaling(report["runs"])
+    return report
+
+
+def print_report(report: dict):
+    runs = report["runs"]
+    names = list(runs[0]["benchmarks"]) if runs else []
+    print("benchmark," + ",".join(f"p50_ms@{run['docs']}" for run in runs) + ",p95_ms@largest,scaling")
+    for name in names:
+        p50s = ",".join(f"{run['benchmarks'][name]['p50']:.3f}" for run in runs)
+        exponent = report["scaling"].get(name)
+        print(f"{name},{p50s},{runs[-1]['benchmarks'][name]['p95']:.3f},{'' if exponent is None else exponent}")
+
+
+def compare(base: dict, new: dict, threshold: float, min_ms: float) -> List[str]:
+    """Print the change of every benchmark in both reports; returns the regressions."""
+    base_runs = {run["docs"]: run for run in base["runs"]}
+    regressions = []
+    print("docs,benchmark,base_p50_ms,new_p50_ms,p50_change,base_p95_ms,new_p95_ms,p95_change,status")
+    for run in new["runs"]:
+        base_run: Optional[dict] = base_runs.get(run["docs"])
+        if base_run is None:
+            print(f"{run['docs']},*,,,,,,,no baseline")
+            continue
+        for name, stats in run["benchmarks"].items():
+            base_stats = base_run["benchmarks"].get(name)
+            if base_stats is None:
+                print(f"{run['docs']},{name},,,,,,,no baseline")
+                continue
+            changes = {}
+            status = "ok"
+            for key in ("p50", "p95"):
+                changes[key] = stats[key] / base_stats[key] - 1 if base_stats[key] > 0 else 0.0
+                if changes[key] > threshold and stats[key] - base_stats[key] > min_ms:
+                    status = "REGRESSION"
+            if status == "ok" and all(change < -threshold for change in changes.values()):
+                status = "faster"
+            if status == "REGRESSION":
+                regressions.append(f"{name}@{run['docs']}")
+            print(f"{run['docs']},{name},{base_stats['p50']:.3f},{stats['p50']:.3f},{changes['p50']:+.1%},"
+                  f"{base_stats['p95']:.3f},{stats['p95']:.3f},{changes['p95']:+.1%},{status}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--docs", type=int, nargs="+", default=[250, 500, 1000])
+    parser.add_argument("--words", type=int, default=2000, help="median words per document")
+    parser.add_argument("--vocabulary", type=int, default=50_000)
+    parser.add_argument("--zipf", type=float, default=1.1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--queries", type=int, default=30)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--index-repeat", type=int, default=3)
+    parser.add_argument("--workdir", help="keep the corpora and indexes there instead of a temporary directory")
+    parser.add_argument("--output", help="write the JSON report there (default: stdout)")
+    parser.add_argument("--compare", nargs=2, metavar=("BASE", "NEW"))
+    parser.add_argument("--threshold", type=float, default=0.2, help="relative slowdown flagged as a regression")
+    parser.add_argument("--min-ms", type=float, default=0.1, help="absolute slowdown below which nothing is flagged")
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare[0]) as f:
+            base = json.load(f)
+        with open(args.compare[1]) as f:
+            new = json.load(f)
+        regressions = compare(base, new, args.threshold, args.min_ms)
+        if regressions:
+            print("❌ Regressions:", ", ".join(regressions), file=sys.stderr)
+            sys.exit(1)
+        print("✅ No regressions", file=sys.stderr)
+        return
+
+    report = run(args)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print_report(report)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+"""
+Production serving: several worker processes sharing one loaded index.
+
+    gunicorn -c gunicorn.conf.py                     # from backend/, one worker per CPU
+    WEB_CONCURRENCY=4 BIND=0.0.0.0:8000 gunicorn -c gunicorn.conf.py
+
+IDEA:
+- preload_app: the master loads the application, which starts the warm-up (see
+  start_warm_up in business_logic.py), and waits for it to have loaded (or built)
+  the index, the document tokens, the document DB and the similarity graph (and,
+  after building the index, for the segment merge) before forking. The workers
+  share those pages copy-on-write instead of each loading its own, and are ready
+  as soon as they start.
+- The index arrays are memory-mapped .npy files (see storage.py): their pages are
+  shared through the page cache, whichever process maps them.
+- gc.freeze() before the fork moves the preloaded objects out of the collector's
+  generations, so that collections in the workers do not write to their headers
+  and copy their pages.
+- Workers are uvicorn's ASGI workers. The search views are async and run searches
+  in a thread pool (SEARCH_THREADS per worker, see urls.py), so a worker keeps
+  accepting requests while searches run.
+- Caches stay per worker: use FileCache for RESULT_CACHE and SEARCH_SNAPSHOTS to
+  share them (see business_logic.py).
+
+PRELOAD=0 turns preloading off (every worker warms up itself), for comparison.
+"""
+import gc
+import multiprocessing
+import os
+
+bind = os.environ.get("BIND", "0.0.0.0:8000")
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+worker_class = "uvicorn.workers.UvicornWorker"
+wsgi_app = "search.asgi:application"
+preload_app = os.environ.get("PRELOAD", "1") != "0"
+timeout = 120
+
+
+def when_ready(server):
+    if not preload_app:
+        return
+    from search.business_logic import warm_up
+    status = warm_up() # joins the warm-up and segment-merge threads: no thread may be running at the fork
+    if not status["ready"]:
+        server.log.error("Warm-up failed in stage %s (%s): workers load lazily", status["stage"], status["error"])
+    gc.freeze()
+    server.log.info("Search index loaded in %ss, forking %d workers", status["seconds"], server.cfg.workers)
@@ -14,3 +14,10 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'search.settings')
 
 application = get_asgi_application()
+
+# Load the index in the background while the server starts accepting requests:
+# GET /api/health/ready answers 200 once it is loaded. Imported only once Django is set
+# up, like any application code
+from search.business_logic import start_warm_up
+
+start_warm_up()
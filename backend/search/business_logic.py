@@ -1,25 +1,139 @@
 import os
 import re
 import json
+import base64
+import hashlib
+import threading
 
+from bisect import bisect_left
 from enum import Enum
-from dataclasses import dataclass
-from functools import cache
-from typing import Dict, List, Tuple
+from dataclasses import dataclass, field
+from functools import cache, cached_property, wraps
+from typing import Callable, Dict, List, Optional, Set, Tuple
 import time
 
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.feature_extraction.text import CountVectorizer
-import pandas as pd
+from scipy import sparse
 import numpy as np
 from pathlib import Path
 import glob
 
+from .cache import InProcessCache, QueryCache
+from .fulltext import check_pattern, fulltext_search
+from .graph import SimilarityGraph
+from .metrics import BatchedLogWriter, Histogram
+from .phrases import parse_query, phrase_matches, query_terms
+from .positions import PositionalIndex
+from .postings import PostingsIndex
+from .scoring import BM25Scorer, TfidfScorer, top_k
+from .segments import IngestReport, SegmentStore
+from .snippets import Snippet, snippets as document_snippets
+from .storage import load_arrays, save_arrays
+from .vocabulary import VocabularyIndex
+
 Term = str # normalized: [a-zA-Z]
 DocumentId = int
 
 # SearchIndex = Dict[Term, Dict[DocumentId, int]] # term => document id => occurrence count
-SearchIndex = pd.DataFrame # row = document id, col = term
+@dataclass
+class SearchIndex:
+    """
+    TF-IDF weights of every document, kept sparse so that memory scales with the
+    number of non-zero entries instead of documents × vocabulary.
+
+    The same matrix is stored twice: row-major for per-document vectors, and
+    column-major for per-term lookups.
+    """
+    doc_ids: np.ndarray # row => document id (file stem, as stored in the DocumentDB)
+    terms: np.ndarray # col => term, sorted
+    vocabulary: Dict[Term, int] # term => col
+    idf: np.ndarray # col => inverse document frequency
+    by_doc: sparse.csr_matrix # row = document, col = term
+    by_term: sparse.csc_matrix # row = document, col = term
+    version: str # fingerprint of the corpus the index was built from
+
+    @classmethod
+    def from_matrix(cls, matrix: sparse.spmatrix, doc_ids: List[str], terms: np.ndarray, idf: np.ndarray, version: str) -> "SearchIndex":
+        return cls(
+            # fixed-width strings rather than objects, so that they can be memory-mapped
+            doc_ids=np.asarray(doc_ids, dtype=str),
+            terms=np.asarray(terms, dtype=str),
+            vocabulary={term: col for col, term in enumerate(terms)},
+            idf=np.asarray(idf),
+            by_doc=sparse.csr_matrix(matrix),
+            by_term=sparse.csc_matrix(matrix),
+            version=version,
+        )
+
+    @classmethod
+    def from_counts(cls, counts: sparse.csr_matrix, doc_ids: np.ndarray, terms: np.ndarray, version: str) -> "SearchIndex":
+        """
+        TF-IDF index from raw term counts, weighted exactly as
+        TfidfVectorizer(max_features=MAX_FEATURES) would weight the same corpus.
+        """
+        if len(terms) > MAX_FEATURES:
+            # Keep the most frequent terms, as TfidfVectorizer's max_features does
+            term_frequencies = np.asarray(counts.sum(axis=0)).ravel()
+            keep = np.sort((-term_frequencies).argsort()[:MAX_FEATURES])
+            counts, terms = counts[:, keep], terms[keep]
+
+        from sklearn.feature_extraction.text import TfidfTransformer # slow to import: only when (re)building
+
+        transformer = TfidfTransformer()
+        tfidf_vector = transformer.fit_transform(counts)
+        return cls.from_matrix(tfidf_vector, doc_ids, terms, transformer.idf_, version)
+
+    def save(self, index_dir: str):
+        save_arrays(index_dir, {
+            "doc_ids": self.doc_ids,
+            "terms": self.terms,
+            "idf": self.idf,
+            "by_doc.data": self.by_doc.data,
+            "by_doc.indices": self.by_doc.indices,
+            "by_doc.indptr": self.by_doc.indptr,
+            "by_term.data": self.by_term.data,
+            "by_term.indices": self.by_term.indices,
+            "by_term.indptr": self.by_term.indptr,
+        }, {
+            "format": INDEX_FORMAT,
+            "fingerprint": self.version,
+            "shape": list(self.by_doc.shape),
+            "nnz": int(self.by_doc.nnz),
+        })
+
+    @classmethod
+    def load(cls, index_dir: str) -> Optional["SearchIndex"]:
+        """Map a saved index into memory, or None if there is no usable one."""
+        saved = load_arrays(index_dir, INDEX_FORMAT)
+        if saved is None:
+            return None
+        manifest, load_array = saved
+
+        shape = tuple(manifest["shape"])
+        terms = load_array("terms")
+        return cls(
+            doc_ids=load_array("doc_ids"),
+            terms=terms,
+            vocabulary={term: col for col, term in enumerate(terms.tolist())},
+            idf=load_array("idf"),
+            by_doc=sparse.csr_matrix((load_array("by_doc.data"), load_array("by_doc.indices"), load_array("by_doc.indptr")), shape=shape, copy=False),
+            by_term=sparse.csc_matrix((load_array("by_term.data"), load_array("by_term.indices"), load_array("by_term.indptr")), shape=shape, copy=False),
+            version=manifest["fingerprint"],
+        )
+
+    @cached_property
+    def vocabulary_index(self) -> VocabularyIndex:
+        """Regex expansion over `terms`."""
+        return VocabularyIndex(self.terms)
+
+    def term_columns(self, term_columns: List[int]) -> sparse.csc_matrix:
+        """TF-IDF of every document (row) for each of `term_columns` (col)."""
+        return self.by_term[:, term_columns]
+
+    def __contains__(self, term: Term) -> bool:
+        return term in self.vocabulary
+
+    def __len__(self) -> int:
+        return self.by_doc.shape[0]
 
 @dataclass
 class DocumentMeta:
@@ -30,68 +144,428 @@ class DocumentMeta:
 DocumentDB = Dict[str, DocumentMeta] # should be DocumentId => DocumentMeta, but documents_meta.json stores ids as strings by accident
 SearchScore = np.float64
 # SearchHits = Dict[DocumentId, SearchScore]
-SearchHits = pd.DataFrame # row = document id, col = term, limited rows
+@dataclass
+class SearchHits:
+    index: SearchIndex # or a PostingsIndex, which has no per-document vectors
+    rows: np.ndarray # index rows in ranked order, limited to MAX_RESULTS
+    columns: np.ndarray = field(default_factory=lambda: np.empty(0, dtype=np.int64)) # index columns of the query terms, if any
+    truncated: bool = False # cut short by a time budget or cap (see vocabulary.py, fulltext.py): not to be cached
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def scores(self) -> np.ndarray:
+        """Summed TF-IDF of the query terms in every hit."""
+        return np.asarray(self.index.term_columns(self.columns.tolist())[self.rows].sum(axis=1)).ravel()
+
+    def doc_ids(self) -> List[str]:
+        return self.index.doc_ids[self.rows].tolist()
+
+    def vectors(self) -> sparse.csr_matrix:
+        """TF-IDF vector of every hit (row = hit, col = term)."""
+        return self.index.by_doc[self.rows]
+
 SearchResult = List[DocumentMeta]
 
+
+@dataclass
+class DocumentTokens:
+    """
+    The set of distinct tokens of every document, as integer postings: for each
+    token, the sorted rows of the documents containing it. Unlike the SearchIndex,
+    the vocabulary is not capped at MAX_FEATURES, so the tokens are stored one
+    after the other with their offsets: a fixed-width array would give every token
+    the length of the longest one in the corpus.
+    """
+    doc_ids: np.ndarray # row => document id
+    tokens: np.ndarray # the tokens, UTF-8 encoded and sorted, one after the other (uint8)
+    token_offsets: np.ndarray # token id => start of the token in `tokens`; the last entry is len(tokens)
+    indptr: np.ndarray # token id => start of its postings in `rows`
+    rows: np.ndarray # rows of the documents containing each token, token after token
+    token_counts: np.ndarray # row => number of distinct tokens
+    version: str # fingerprint of the corpus, as for SearchIndex
+
+    @classmethod
+    def from_counts(cls, counts: sparse.csr_matrix, doc_ids: np.ndarray, terms: np.ndarray, version: str) -> "DocumentTokens":
+        by_token = sparse.csc_matrix(counts)
+        by_token.sort_indices()
+        encoded = [term.encode("utf-8") for term in np.asarray(terms).tolist()] # UTF-8 keeps the order of the sorted terms
+        return cls(
+            doc_ids=np.asarray(doc_ids, dtype=str),
+            tokens=np.frombuffer(b"".join(encoded), dtype=np.uint8),
+            token_offsets=np.r_[0, np.cumsum([len(token) for token in encoded], dtype=np.int64)].astype(np.int64),
+            indptr=by_token.indptr.astype(np.int64),
+            rows=by_token.indices.astype(np.int32),
+            token_counts=np.diff(counts.indptr).astype(np.int32),
+            version=version,
+        )
+
+    def save(self, tokens_dir: str):
+        save_arrays(tokens_dir, {
+            "doc_ids": self.doc_ids,
+            "tokens": self.tokens,
+            "token_offsets": self.token_offsets,
+            "indptr": self.indptr,
+            "rows": self.rows,
+            "token_counts": self.token_counts,
+        }, {"format": TOKENS_FORMAT, "fingerprint": self.version})
+
+    @classmethod
+    def load(cls, tokens_dir: str) -> Optional["DocumentTokens"]:
+        saved = load_arrays(tokens_dir, TOKENS_FORMAT)
+        if saved is None:
+            return None
+        manifest, load_array = saved
+        return cls(*(np.asarray(load_array(name)) for name in ("doc_ids", "tokens", "token_offsets", "indptr", "rows", "token_counts")), version=manifest["fingerprint"])
+
+    def token(self, token_id: int) -> bytes:
+        return self.tokens[self.token_offsets[token_id]:self.token_offsets[token_id + 1]].tobytes()
+
+    def token_ids(self, tokens: List[Term]) -> np.ndarray:
+        """Ids of those of `tokens` that occur in some document (binary searches over the sorted tokens)."""
+        n_tokens = len(self.token_offsets) - 1
+        ids: List[int] = []
+        for token in tokens:
+            encoded = token.encode("utf-8")
+            token_id = bisect_left(range(n_tokens), encoded, key=self.token)
+            if token_id < n_tokens and self.token(token_id) == encoded:
+                ids.append(token_id)
+        return np.asarray(ids, dtype=np.int64)
+
+    def jaccard(self, query_tokens: Set[Term]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Rows of the documents sharing at least one token with `query_tokens`, in
+        increasing order, and the Jaccard similarity of their token sets to it.
+
+        |A ∩ B| is counted from the postings of the query tokens only, and
+        |A ∪ B| = |A| + |B| - |A ∩ B|, so no other document is looked at.
+        """
+        token_ids = self.token_ids(sorted(query_tokens))
+        if not len(token_ids):
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        postings = np.concatenate([self.rows[self.indptr[token_id]:self.indptr[token_id + 1]] for token_id in token_ids.tolist()])
+        rows, intersections = np.unique(postings, return_counts=True)
+        unions = len(query_tokens) + self.token_counts[rows] - intersections
+        return rows, intersections / unions
+
 SEARCH_INDEX_PATH = "search/search_index.json"
-DATAFRAME_PATH = "search/tfidf_df.csv"
+INDEX_DIR = "search/index/"
+INDEX_FORMAT = 1
+TOKENS_FORMAT = 2 # tokens stored with offsets, not fixed-width
+SEGMENTS_DIR = "search/segments/"
+TOKENS_DIR = "search/tokens/"
+GRAPH_DIR = "search/graph/"
+POSTINGS_DIR = "search/postings/"
+POSITIONS_DIR = "search/positions/"
 DOCUMENT_DB_PATH = "webscraper/documents_meta.json"
+# Appended to by the scraper, one JSON object per line; its records replace those of DOCUMENT_DB_PATH
+DOCUMENT_DB_LOG_PATH = "webscraper/documents_meta.jsonl"
 DOCUMENTS_ROOT = "webscraper/documents/"
 
 MAX_RESULTS = 50
-
-DOC_TOKENS = {}
+# Closeness ranking is run over this many hits, of which the MAX_RESULTS most central are returned
+CLOSENESS_MAX_HITS = MAX_RESULTS
+# Share of PageRank (vs the query's TF-IDF score) in the pagerank ranking
+PAGERANK_WEIGHT = 0.5
+MAX_FEATURES = 100_000
+# Index that basic and regex searches look terms up in: "matrix" (the SearchIndex, in memory)
+# or "postings" (the compressed PostingsIndex, decoded from disk a term at a time)
+SEARCH_BACKEND = "matrix"
+# Build the positional index (for snippets and phrase queries) with the others in
+# update_index, and load it in the warm-up. The results page asks for snippets on every
+# search, so this is on; off, it is built by the first search that needs it.
+POSITIONAL_INDEX = True
+
+# Results of recent searches, emptied whenever the index version changes.
+# Use FileCache("search/cache/") instead to share the results between worker processes.
+RESULT_CACHE = QueryCache(InProcessCache())
+
+# Paginated searches (search_page) rank this many hits, and keep their ids for SNAPSHOT_TTL seconds.
+# Use FileCache("search/snapshots/", ttl=SNAPSHOT_TTL) instead if pages may be served by different workers.
+SNAPSHOT_RESULTS = 1000
+SNAPSHOT_TTL = 300
+MAX_PAGE_SIZE = 100
+SEARCH_SNAPSHOTS = QueryCache(InProcessCache(ttl=SNAPSHOT_TTL))
 
 # BENCHMARK config
+# Searches are logged by a background thread, in batches (see metrics.py)
 BENCHMARK_LOGGING = True
 BENCHMARK_LOGFILE = "logs/bench_log.txt"
+SEARCH_LOG = BatchedLogWriter(os.path.join(os.path.dirname(os.path.abspath(__file__)), BENCHMARK_LOGFILE))
+
+# Latency histograms, served by GET /api/metrics
+STAGE_SECONDS = Histogram("search_stage_seconds", "Time spent in each stage of a search.", ["stage"])
+SEARCH_SECONDS = Histogram("search_seconds", "Time to compute a search, serialization excluded.", ["type", "ranking", "cached"])
+REQUEST_SECONDS = Histogram("search_request_seconds", "Time to answer POST /api/search, serialization included.", ["type", "ranking"])
+BATCH_SECONDS = Histogram("search_batch_seconds", "Time to compute all the searches of a batch, serialization excluded.")
+BATCH_REQUEST_SECONDS = Histogram("search_batch_request_seconds", "Time to answer POST /api/search/batch, serialization included.")
 
 
 class SearchType(Enum):
     BASIC = "basic"
     REGEX = "regex"
+    FULLTEXT_REGEX = "fulltext_regex"
+    PHRASE = "phrase"
+
+
+class InvalidQuery(ValueError):
+    pass
+
+
+def check_query(query: str, type: SearchType):
+    """Raise InvalidQuery if `query` cannot be searched as `type`: a regex that does not compile."""
+    try:
+        if type is SearchType.REGEX:
+            re.compile(query)
+        elif type is SearchType.FULLTEXT_REGEX:
+            check_pattern(query)
+    except re.error as e:
+        raise InvalidQuery(f"Invalid regex: {e}")
 
 
 class SearchRanking(Enum):
     OCCURRENCES = "occurrences"
     CLOSENESS = "closeness"
+    PAGERANK = "pagerank"
+    BM25 = "bm25"
+    TFIDF = "tfidf"
 
 
-@cache
+# Rankings that select their hits by a summed per-term score, over the compressed postings
+SCORERS = {
+    SearchRanking.BM25: BM25Scorer(),
+    SearchRanking.TFIDF: TfidfScorer(),
+}
+
+# Rankings of the basic searches that execute_batch scores together, from the SearchIndex
+# (BM25 needs the raw counts of the postings: those run one by one)
+BATCH_RANKINGS = (SearchRanking.OCCURRENCES, SearchRanking.TFIDF, SearchRanking.PAGERANK, SearchRanking.CLOSENESS)
+BATCH_MAX_SEARCHES = 1000 # per POST /api/search/batch
+
+
+def corpus_fingerprint(documents_dir: str) -> str:
+    """
+    Cheap fingerprint of the documents directory: name, size and modification
+    time of every document, without reading any contents.
+    """
+    digest = hashlib.sha1()
+    for entry in sorted(os.scandir(documents_dir), key=lambda e: e.name):
+        if entry.name.endswith(".txt"):
+            stat = entry.stat()
+            digest.update(f"{entry.name}\0{stat.st_size}\0{stat.st_mtime_ns}\n".encode())
+    return digest.hexdigest()
+
+
+def load_once(loader):
+    """
+    `loader`, cached like functools.cache, except that concurrent first calls (the
+    warm-up and early requests) wait for a single load instead of each loading.
+    """
+    results = {}
+    lock = threading.Lock()
+
+    @wraps(loader)
+    def wrapper(*args):
+        try:
+            return results[args]
+        except KeyError:
+            pass
+        with lock:
+            if args not in results:
+                results[args] = loader(*args)
+            return results[args]
+
+    wrapper.cache_clear = results.clear
+    return wrapper
+
+
+@load_once
 def index(documents_dir: str) -> SearchIndex:
+    """
+    Load the saved index if it was built from the current documents, otherwise
+    rebuild it and save it for the next process.
+    """
+    fingerprint = corpus_fingerprint(documents_dir)
+    saved = SearchIndex.load(INDEX_DIR)
+    if saved is not None and saved.version == fingerprint:
+        print("Loaded saved index", fingerprint)
+        return saved
+
+    result, _report = update_index(documents_dir)
+    return result
+
+
+_segment_merge: Optional[threading.Thread] = None # the last one update_index started, see warm_up
+
+
+def update_index(documents_dir: str) -> Tuple[SearchIndex, IngestReport]:
+    """
+    Bring the saved index up to date with `documents_dir`.
+
+    Only documents added or changed since the last update are tokenized (into a
+    new segment). The TF-IDF weights are then recomputed from the counts of all
+    segments, so IDF stays that of the whole corpus, and so is everything derived
+    from them (tokens, graph, postings, positions): only the tokenizing is
+    incremental (see PERFORMANCE.md). Segments are merged in the background once
+    there are too many of them.
+    """
     print("Indexing...")
-    text_files = glob.glob(f"{documents_dir}/*.txt")
-    text_titles = [Path(text).stem for text in text_files]
+    fingerprint = corpus_fingerprint(documents_dir)
+    store = SegmentStore(SEGMENTS_DIR)
+    report = store.ingest(documents_dir)
+    print("Ingested documents:", report)
+
+    if not report.added and not report.removed:
+        saved = SearchIndex.load(INDEX_DIR)
+        if saved is not None and saved.version == fingerprint:
+            return saved, report
 
     print("Building TF-IDF matrix...")
-    tfidf_vectorizer = TfidfVectorizer(input='filename', stop_words='english', max_features=100_000)
-    tfidf_vector = tfidf_vectorizer.fit_transform(text_files)
-    tfidf_df = pd.DataFrame(tfidf_vector.toarray(), index=text_titles, columns=tfidf_vectorizer.get_feature_names_out())
-    return tfidf_df
+    counts, doc_ids, terms = store.counts()
+    result = SearchIndex.from_counts(counts, doc_ids, terms, fingerprint)
+
+    print("Saving index to", INDEX_DIR)
+    result.save(INDEX_DIR)
+    DocumentTokens.from_counts(counts, doc_ids, terms, fingerprint).save(TOKENS_DIR)
+    print("Building document similarity graph...")
+    SimilarityGraph.build(result.by_doc, result.doc_ids, fingerprint).save(GRAPH_DIR)
+    # Whatever SEARCH_BACKEND is, the bm25 and tfidf rankings score from the postings
+    build_postings_index(counts, doc_ids, terms, result).save(POSTINGS_DIR)
+    if POSITIONAL_INDEX:
+        print("Building positional index...")
+        build_positional_index(result).save(POSITIONS_DIR)
+    global _segment_merge
+    _segment_merge = store.merge_in_background()
+    return result, report
+
+
+def current_index() -> SearchIndex:
+    """The index of DOCUMENTS_ROOT, loaded (or built) by the first call."""
+    return index(DOCUMENTS_ROOT)
+
+
+@cache
+def query_analyzer() -> Callable[[str], List[Term]]:
+    """CountVectorizer's analyzer, which tokenized the documents, for queries."""
+    from sklearn.feature_extraction.text import CountVectorizer # slow to import: only once needed
+
+    return CountVectorizer(stop_words="english").build_analyzer()
+
+
+def rank_lexicographically(columns: sparse.csc_matrix, rows: np.ndarray, limit: Optional[int] = None, keep_empty: bool = False) -> np.ndarray:
+    """
+    Order `rows` by their values in `columns`, largest first, comparing the first
+    column, then the second on ties, and so on (the order of DataFrame.nlargest).
+    Rows that tie on every column keep their original order.
+
+    Only the non-zero entries of each column are visited, and we stop as soon as
+    `limit` rows are ranked. Rows that are zero in every column come last, and
+    are dropped unless `keep_empty` is set.
+    """
+    available = np.zeros(columns.shape[0], dtype=bool)
+    available[rows] = True
+    ranked: List[np.ndarray] = []
+    ranked_count = 0
+
+    for col in range(columns.shape[1]):
+        if limit is not None and ranked_count >= limit:
+            break
+        start, end = columns.indptr[col], columns.indptr[col + 1]
+        col_rows, col_values = columns.indices[start:end], columns.data[start:end]
+        mask = available[col_rows] & (col_values != 0)
+        group, values = col_rows[mask], col_values[mask]
+        if not len(group):
+            continue
+
+        order = np.lexsort((group, -values))
+        group, values = group[order], values[order]
+
+        # Exact ties on this column are broken by the columns after it
+        if col + 1 < columns.shape[1]:
+            run_starts = np.flatnonzero(np.r_[True, values[1:] != values[:-1]])
+            run_ends = np.r_[run_starts[1:], len(values)]
+            for run_start, run_end in zip(run_starts, run_ends):
+                if run_end - run_start > 1:
+                    tied = np.sort(group[run_start:run_end])
+                    group[run_start:run_end] = rank_lexicographically(columns[:, col + 1:], tied, keep_empty=True)
 
-tfidf_df = index(DOCUMENTS_ROOT)
+        ranked.append(group)
+        ranked_count += len(group)
+        available[group] = False
 
+    if keep_empty:
+        ranked.append(np.flatnonzero(available))
 
-def term_search(index: SearchIndex, terms: List[Term]) -> SearchHits:
+    result = np.concatenate(ranked) if ranked else np.empty(0, dtype=np.int64)
+    return result if limit is None else result[:limit]
+
+
+def term_search(index: SearchIndex, terms: List[Term], limit: int = MAX_RESULTS, ranking: SearchRanking = SearchRanking.OCCURRENCES) -> SearchHits:
     print("Doing term search with terms", terms)
-    # Cap results
-    hits = index.nlargest(MAX_RESULTS, terms)
-    # Only return rows for which there was actually a hit
-    return hits[hits[terms].T.any()]
+    return column_search(index, [index.vocabulary[term] for term in terms], limit, ranking)
+
+
+def column_search(index: SearchIndex, term_columns: List[int], limit: int = MAX_RESULTS, ranking: SearchRanking = SearchRanking.OCCURRENCES) -> SearchHits:
+    if ranking in SCORERS:
+        # The postings share the columns and rows of the SearchIndex
+        with STAGE_SECONDS.time("score"):
+            rows, _scores = top_k(load_postings_index(), term_columns, SCORERS[ranking], limit)
+        return SearchHits(index, rows, np.asarray(term_columns, dtype=np.int64))
+
+    with STAGE_SECONDS.time("score"):
+        columns = index.term_columns(term_columns)
+        # Cap results, and only return rows for which there was actually a hit
+        rows = rank_lexicographically(columns, np.arange(len(index)), limit=limit)
+    return SearchHits(index, rows, np.asarray(term_columns, dtype=np.int64))
 
 
-def basic_search(index: SearchIndex, query: str) -> SearchHits:
+def basic_search(index: SearchIndex, query: str, limit: int = MAX_RESULTS, ranking: SearchRanking = SearchRanking.OCCURRENCES) -> SearchHits:
     print("Starting basic search")
-    vectorizer = CountVectorizer(stop_words="english")
-    analyze = vectorizer.build_analyzer()
-    query_terms = [term for term in analyze(query) if term in index]
-    return term_search(index, query_terms)
+    with STAGE_SECONDS.time("analyze"):
+        query_terms = [term for term in query_analyzer()(query) if term in index]
+    return term_search(index, query_terms, limit, ranking)
 
 
-def regex_search(index: SearchIndex, regex: str) -> SearchHits:
-    r = re.compile(regex)
-    matching_terms = [term for term in index.columns if r.match(term)]
-    return term_search(index, matching_terms)
+def regex_search(index: SearchIndex, regex: str, limit: int = MAX_RESULTS, ranking: SearchRanking = SearchRanking.OCCURRENCES) -> SearchHits:
+    with STAGE_SECONDS.time("expand"):
+        matching_columns, truncated = index.vocabulary_index.match(regex)
+    print("Doing regex search with", len(matching_columns), "matching terms")
+    hits = column_search(index, matching_columns.tolist(), limit, ranking)
+    hits.truncated = truncated
+    return hits
+
+
+def phrase_search(index: SearchIndex, query: str, limit: int = MAX_RESULTS, ranking: SearchRanking = SearchRanking.OCCURRENCES) -> SearchHits:
+    """
+    Documents matching the phrases and NEAR/k operators of `query` (see phrases.py),
+    from the positional index. They are ordered by their number of matches, or by
+    the summed score of the query terms for the rankings of SCORERS.
+    """
+    with STAGE_SECONDS.time("analyze"):
+        clauses = parse_query(query, current_index().vocabulary)
+        columns = np.asarray(query_terms(clauses), dtype=np.int64)
+    with STAGE_SECONDS.time("score"):
+        rows, matches = phrase_matches(load_positional_index(), clauses)
+        print("Phrase search matched", len(rows), "documents")
+
+        if ranking in SCORERS:
+            postings = load_postings_index()
+            scores = np.zeros(len(rows))
+            for term_id in columns.tolist():
+                scores += SCORERS[ranking].scores(postings, term_id, rows, postings.lookup(term_id, rows))
+            order = np.lexsort((rows, -scores))
+        else:
+            order = np.lexsort((rows, -matches))
+    return SearchHits(index, rows[order][:limit], columns)
+
+
+def fulltext_regex_search(index: SearchIndex, regex: str, limit: int = MAX_RESULTS) -> SearchHits:
+    """Documents whose full text matches `regex` (not just one of their terms), in index order."""
+    paths = [os.path.join(DOCUMENTS_ROOT, f"{doc_id}.txt") for doc_id in index.doc_ids.tolist()]
+    with STAGE_SECONDS.time("score"):
+        rows, truncated = fulltext_search(paths, regex, limit)
+    print("Full-text regex search matched", len(rows), "documents")
+    return SearchHits(index, np.array(rows, dtype=np.int64), truncated=truncated)
 
 
 def to_result(db: DocumentDB, hits: SearchHits, ranking: SearchRanking) -> SearchResult:
@@ -100,136 +574,424 @@ def to_result(db: DocumentDB, hits: SearchHits, ranking: SearchRanking) -> Searc
     # - End up with the term vector for each of those hits
     # - Run ranking algorithm on those hits
     #   * IF occurrences: rank by TFIDF total for query terms
+    #   * IF bm25 / tfidf: hits are already the best scoring ones, in order
     #   * IF closeness: run closeness algorithm on remaining term vectors
+    #   * IF pagerank: blend the precomputed PageRank of the hits with their TFIDF total
     # - Get metadata for sorted results and return
-    result: SearchResult = []
+    with STAGE_SECONDS.time("rank"):
+        doc_ids = ranked_doc_ids(hits, ranking)
+    with STAGE_SECONDS.time("metadata"):
+        return [db[doc_id] for doc_id in doc_ids]
+
 
+def ranked_doc_ids(hits: SearchHits, ranking: SearchRanking) -> List[str]:
+    """Document ids of `hits`, in the order of `ranking` (see to_result)."""
     #print("Converting to result with ranking", ranking, "and hits", hits)
-    if ranking == SearchRanking.OCCURRENCES:
-        for doc_id, _series in hits.iterrows():
-            result.append(db[doc_id])
+    if ranking == SearchRanking.OCCURRENCES or ranking in SCORERS:
+        return hits.doc_ids()
     elif ranking == SearchRanking.CLOSENESS:
         sorted_hits: List[Tuple[float, DocumentId]] = closeness_centrality_ranking(hits)
-        for _, doc_id in sorted_hits:
-            result.append(db[doc_id])
-
-    # print("Final result", result)
-    return result
+        return [doc_id for _, doc_id in sorted_hits[:MAX_RESULTS]]
+    elif ranking == SearchRanking.PAGERANK:
+        return [doc_id for _, doc_id in pagerank_ranking(hits)]
+    return []
 
 
-@cache
+@load_once
 def read_search_db() -> DocumentDB:
     print("Reading search db...")
-    with open(DOCUMENT_DB_PATH, encoding="utf-8") as fp:
-        documents_meta = json.load(fp)
+    documents_meta = []
+    if os.path.exists(DOCUMENT_DB_PATH) or not os.path.exists(DOCUMENT_DB_LOG_PATH):
+        with open(DOCUMENT_DB_PATH, encoding="utf-8") as fp:
+            documents_meta = json.load(fp)
+    if os.path.exists(DOCUMENT_DB_LOG_PATH):
+        with open(DOCUMENT_DB_LOG_PATH, encoding="utf-8") as fp:
+            for line in fp:
+                try:
+                    documents_meta.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue # torn last line of an interrupted write
 
     print("Converting to dict...")
     db: DocumentDB = dict()
     for meta in documents_meta:
         doc_id = meta.pop("id")
+        meta["document_id"] = int(doc_id)
         db[doc_id] = meta
     print("finished reading search db")
     return db
-read_search_db()
 
-@cache
-def load_doc_tokens():
+
+@load_once
+def load_doc_tokens() -> DocumentTokens:
     """
-    Preload and cache token-sets for all document .txt files.
+    Load the token sets of all documents, as saved by update_index.
 
     IDEA:
-    - Use CountVectorizer's analyzer to create a consistent tokenizer
-      shared by both indexing and query-recommendation logic.
-    - For each document in DOCUMENTS_ROOT:
-        * Read the raw text
-        * Tokenize it into a set of unique tokens
-        * Store it in global DOC_TOKENS under its document ID
-    - Cache the whole mapping so that repeated calls are effectively free.
-
-    Notes:
-    - Token data is stable unless the documents change on disk.
-    - Using @cache ensures the expensive I/O + tokenization only runs once.
+    - Tokens are those of CountVectorizer's analyzer, shared by both indexing and
+      query-recommendation logic.
+    - Instead of one Python set of strings per document, keep integer postings
+      (token => rows of the documents containing it) and the number of distinct
+      tokens per document: that is all Jaccard similarity needs.
+    - The arrays are memory-mapped from TOKENS_DIR. If they are missing or from
+      another version of the corpus, rebuild them from the index segments.
     """
-    global DOC_TOKENS
-
     print("Loading document tokens...")
-    vectorizer = CountVectorizer(stop_words="english")
-    analyze = vectorizer.build_analyzer()
-
-    print("Analyzing documents...")
-    txt_files = glob.glob(f"{DOCUMENTS_ROOT}/*.txt")
-    for path in txt_files:
-        doc_id = Path(path).stem
-        with open(path, encoding="utf-8") as f:
-            text = f.read()
-        DOC_TOKENS[doc_id] = set(analyze(text))
+    saved = DocumentTokens.load(TOKENS_DIR)
+    if saved is not None and saved.version == current_index().version:
+        return saved
+
+    print("Building document token postings...")
+    counts, doc_ids, terms = SegmentStore(SEGMENTS_DIR).counts()
+    doc_tokens = DocumentTokens.from_counts(counts, doc_ids, terms, current_index().version)
+    doc_tokens.save(TOKENS_DIR)
     print("Done loading document tokens")
-    return DOC_TOKENS
+    return doc_tokens
 
 
-# initialize cache of doc tokens for later use by calling method directly during module import
-# otherwise, we would have to call it every time hence using @cahce is important
-load_doc_tokens()
+def normalize_query(query: str, type: SearchType) -> str:
+    """Queries that are guaranteed to give the same results normalize to the same string."""
+    if type == SearchType.BASIC:
+        return " ".join(query_analyzer()(query))
+    return query
 
 
+@load_once
+def load_similarity_graph() -> SimilarityGraph:
+    """
+    Load the k-nearest-neighbor graph of the documents saved by update_index,
+    rebuilding it if it is missing or from another version of the corpus.
+    """
+    saved = SimilarityGraph.load(GRAPH_DIR)
+    if saved is not None and saved.version == current_index().version:
+        return saved
 
-def execute_search(query: str, type: SearchType, ranking: SearchRanking) -> SearchResult:
+    print("Building document similarity graph...")
+    search_index = current_index()
+    graph = SimilarityGraph.build(search_index.by_doc, search_index.doc_ids, search_index.version)
+    graph.save(GRAPH_DIR)
+    return graph
+
+
+def build_postings_index(counts: sparse.csr_matrix, doc_ids: np.ndarray, terms: np.ndarray, search_index: SearchIndex) -> PostingsIndex:
+    """
+    Postings of the raw `counts`, over the same rows (documents may have been
+    reordered by a segment merge since) and (capped) columns as `search_index`.
+    """
+    rows = {doc_id: row for row, doc_id in enumerate(np.asarray(doc_ids).tolist())}
+    keep_rows = np.array([rows[doc_id] for doc_id in search_index.doc_ids.tolist()], dtype=np.int64)
+    keep_columns = np.searchsorted(terms, search_index.terms)
+    return PostingsIndex.from_counts(counts[keep_rows][:, keep_columns], search_index.doc_ids, search_index.terms, search_index.idf, search_index.version)
+
+
+@load_once
+def load_postings_index() -> PostingsIndex:
+    """
+    Map the compressed postings saved by update_index, rebuilding them if they
+    are missing or from another version of the corpus.
+    """
+    saved = PostingsIndex.load(POSTINGS_DIR)
+    if saved is not None and saved.version == current_index().version:
+        return saved
+
+    print("Building compressed postings...")
+    counts, doc_ids, terms = SegmentStore(SEGMENTS_DIR).counts()
+    postings = build_postings_index(counts, doc_ids, terms, current_index())
+    postings.save(POSTINGS_DIR)
+    return postings
+
+
+def build_positional_index(search_index: SearchIndex) -> PositionalIndex:
+    """Positions of the terms of `search_index` in its documents, over the same rows and columns."""
+    paths = [document_path(doc_id) for doc_id in search_index.doc_ids.tolist()]
+    return PositionalIndex.build(paths, search_index.doc_ids, search_index.vocabulary, search_index.version)
+
+
+@load_once
+def load_positional_index() -> PositionalIndex:
+    """
+    Map the positional index saved by update_index, rebuilding it if it is
+    missing or from another version of the corpus.
+    """
+    saved = PositionalIndex.load(POSITIONS_DIR)
+    if saved is not None and saved.version == current_index().version:
+        return saved
+
+    print("Building positional index...")
+    positional_index = build_positional_index(current_index())
+    positional_index.save(POSITIONS_DIR)
+    return positional_index
+
+
+def with_snippets(result: SearchResult, columns: np.ndarray) -> SearchResult:
+    """
+    `result` with the snippets of every hit around its query terms (index
+    `columns`), rarest terms first. Hits of queries without terms get none.
+    """
+    positional_index = load_positional_index()
+    search_index = current_index()
+    columns = np.unique(columns)
+    highlighted = set(search_index.terms[columns].tolist())
+    by_doc = search_index.by_doc
+    output: SearchResult = []
+    for meta in result:
+        row = positional_index.rows[str(meta["document_id"])]
+        # The query terms in the document (its columns are sorted, as the segment counts are)
+        row_columns = by_doc.indices[by_doc.indptr[row]:by_doc.indptr[row + 1]]
+        found = np.minimum(np.searchsorted(row_columns, columns), len(row_columns) - 1)
+        present = columns[row_columns[found] == columns] if len(row_columns) else columns[:0]
+        present = present[np.argsort(-search_index.idf[present], kind="stable")]
+        hit_snippets: List[Snippet] = document_snippets(positional_index, document_path(meta["document_id"]), row, present.tolist(), highlighted)
+        output.append({**meta, "snippets": hit_snippets})
+    return output
+
+
+def get_similar_documents(doc_id: DocumentId) -> SearchResult:
+    """The documents most similar to `doc_id` (by cosine similarity of TF-IDF vectors), most similar first."""
+    db = read_search_db()
+    return [db[similar_id] for similar_id, _similarity in load_similarity_graph().similar(str(doc_id)) if similar_id in db]
+
+
+def execute_search(query: str, type: SearchType, ranking: SearchRanking, snippets: bool = False) -> SearchResult:
     db = read_search_db()
 
     # Start measuring internal algorithm time
-    start_time = time.time()
+    start_time = time.perf_counter()
+
+    with STAGE_SECONDS.time("normalize"):
+        cache_key = (normalize_query(query, type), type.value, ranking.value, snippets)
+    result = RESULT_CACHE.get(current_index().version, cache_key)
+    cached = result is not None
 
     # --- Core logic ---
+    if not cached:
+        hits = search_hits(query, type, ranking, CLOSENESS_MAX_HITS if ranking == SearchRanking.CLOSENESS else MAX_RESULTS)
+        result = to_result(db, hits, ranking)
+        if snippets:
+            with STAGE_SECONDS.time("snippets"):
+                result = with_snippets(result, hits.columns)
+        # A truncated result is only what this request had time for: the next one tries again
+        if not hits.truncated:
+            RESULT_CACHE.set(current_index().version, cache_key, result)
+    # ------------------
+
+    log_search(query, type, ranking, cached, time.perf_counter() - start_time)
+    return result
+
+
+def search_hits(query: str, type: SearchType, ranking: SearchRanking, limit: int) -> SearchHits:
+    # Closeness needs whole document vectors, which only the SearchIndex has
+    search_index = load_postings_index() if SEARCH_BACKEND == "postings" and ranking != SearchRanking.CLOSENESS else current_index()
     if type == SearchType.BASIC:
-        hits = basic_search(tfidf_df, query)
+        return basic_search(search_index, query, limit, ranking)
     elif type == SearchType.REGEX:
-        hits = regex_search(tfidf_df, query)
+        return regex_search(search_index, query, limit, ranking)
+    elif type == SearchType.PHRASE:
+        return phrase_search(search_index, query, limit, ranking)
+    elif type == SearchType.FULLTEXT_REGEX:
+        return fulltext_regex_search(current_index(), query, limit)
 
-    result = to_result(db, hits, ranking)
-    # ------------------
 
-    elapsed = time.time() - start_time
+@dataclass
+class SearchSnapshot:
+    doc_ids: List[str] # ranked
+    columns: np.ndarray # index columns of the query terms, for snippets
+
 
-    # ------------------ INTERNAL LOGGING ------------------
-    if BENCHMARK_LOGGING:
-        try:
-            # build absolute path relative to business_logic.py
-            current_dir = os.path.dirname(os.path.abspath(__file__))
-            log_path = os.path.join(current_dir, BENCHMARK_LOGFILE)
-
-            # ensure folder exists
-            os.makedirs(os.path.dirname(log_path), exist_ok=True)
-
-            # write benchmark-style log line
-            with open(log_path, "a", encoding="utf-8") as f:
-                f.write(
-                    f"[{time.strftime('%Y-%m-%d %H:%M:%S')}]  "
-                    f"query='{query}'  "
-                    f"type='{type.value}'  "
-                    f"ranking='{ranking.value}'  "
-                    f"internal_time={elapsed:.6f}s\n"
-                )
-
-        except Exception as e:
-            print("INTERNAL_LOGGING ERROR:", e)
-    # ------------------------------------------------------
+class InvalidCursor(ValueError):
+    pass
 
-    return result
 
+def snapshot_digest(key: tuple) -> str:
+    return hashlib.sha1(repr(key).encode()).hexdigest()[:16]
+
+
+def encode_cursor(key: tuple, offset: int) -> str:
+    return base64.urlsafe_b64encode(json.dumps({"q": snapshot_digest(key), "o": offset}).encode()).decode()
+
+
+def decode_cursor(key: tuple, cursor: str) -> int:
+    """The offset of `cursor`, which must come from a page of the same search."""
+    try:
+        decoded = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        digest, offset = decoded["q"], int(decoded["o"])
+    except (ValueError, TypeError, KeyError) as e:
+        raise InvalidCursor(f"Malformed cursor: {e}")
+    if digest != snapshot_digest(key) or offset < 0:
+        raise InvalidCursor("Cursor of another search")
+    return offset
 
-def fetch_document(doc_id: DocumentId) -> str:
-    with open(os.path.join(DOCUMENTS_ROOT, f"{doc_id}.txt"), encoding="utf-8") as f:
-        return f.read()
 
+def search_page(query: str, type: SearchType, ranking: SearchRanking, limit: int = MAX_RESULTS, cursor: Optional[str] = None, snippets: bool = False) -> dict:
+    """
+    One page of the results of a search: {"results", "next_cursor" (None on the
+    last page), "total"}.
 
-def cosine_similarity(vec1: pd.Series, vec2: pd.Series) -> np.float64:
+    IDEA:
+    - The first page ranks up to SNAPSHOT_RESULTS hits and keeps their ids (a
+      snapshot), for SNAPSHOT_TTL and the current index version.
+    - A page is a slice of the snapshot: later pages never recompute scores or
+      closeness, and cost their size (metadata and snippets of their hits only).
+    - The cursor holds the offset of the next page and a digest of the search, so
+      it cannot be used for another one. If its snapshot has expired, the search
+      is run again and the cursor continues in the new ranking.
     """
-    https://medium.com/@whyamit404/what-is-cosine-similarity-and-why-use-numpy-62d409f0661f
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        raise ValueError(f"limit must be between 1 and {MAX_PAGE_SIZE}")
+    db = read_search_db()
+    start_time = time.perf_counter()
+
+    with STAGE_SECONDS.time("normalize"):
+        key = (normalize_query(query, type), type.value, ranking.value)
+    offset = decode_cursor(key, cursor) if cursor else 0
+    snapshot = SEARCH_SNAPSHOTS.get(current_index().version, key)
+    cached = snapshot is not None
+    if not cached:
+        hits = search_hits(query, type, ranking, CLOSENESS_MAX_HITS if ranking == SearchRanking.CLOSENESS else SNAPSHOT_RESULTS)
+        with STAGE_SECONDS.time("rank"):
+            snapshot = SearchSnapshot(ranked_doc_ids(hits, ranking), hits.columns)
+        if not hits.truncated:
+            SEARCH_SNAPSHOTS.set(current_index().version, key, snapshot)
+
+    with STAGE_SECONDS.time("metadata"):
+        result = [db[doc_id] for doc_id in snapshot.doc_ids[offset:offset + limit]]
+    if snippets:
+        with STAGE_SECONDS.time("snippets"):
+            result = with_snippets(result, snapshot.columns)
+    next_offset = offset + limit
+    log_search(query, type, ranking, cached, time.perf_counter() - start_time)
+    return {
+        "results": result,
+        "next_cursor": encode_cursor(key, next_offset) if next_offset < len(snapshot.doc_ids) else None,
+        "total": len(snapshot.doc_ids),
+    }
+
+
+BatchSearch = Tuple[str, SearchType, SearchRanking] # query, type, ranking
+
+
+def batched_basic_hits(index: SearchIndex, searches: List[Tuple[List[int], SearchRanking]]) -> List[SearchHits]:
     """
-    dot_product = np.dot(vec1, vec2)
-    magnitude1 = np.linalg.norm(vec1)
-    magnitude2 = np.linalg.norm(vec2)
-    return dot_product / (magnitude1 * magnitude2)
+    Hits of many basic searches (query term columns, ranking) at once.
+
+    IDEA:
+    - One sparse query-term matrix times the index (term × document) gives the
+      TF-IDF of every query term in every document, for every search, in a single
+      sparse product. Row `position × searches + i` of the query matrix holds the
+      term at that position of search i, so the product keeps the terms apart.
+    - The documents with a non-zero entry for a search are its candidates: the
+      others match none of its terms.
+    - TFIDF ranks the candidates by their summed TF-IDF (counting a repeated query
+      term once, like top_k); occurrences, PageRank and closeness take the hits
+      ranked by the first term, then the next on ties, and so on (the order of
+      rank_lexicographically). Both are one sort of all the candidates of all the
+      searches, by search first, so each search keeps a contiguous range.
+    """
+    if not searches:
+        return []
+    with STAGE_SECONDS.time("batch_score"):
+        columns = [np.unique(np.asarray(term_columns, dtype=np.int64)) if ranking in SCORERS else np.asarray(term_columns, dtype=np.int64) for term_columns, ranking in searches]
+        lengths = np.array([len(term_columns) for term_columns in columns], dtype=np.int64)
+        n_searches, n_docs, depth = len(searches), len(index), int(lengths.max(initial=0))
+        search_of = np.repeat(np.arange(n_searches), lengths)
+        position = np.arange(len(search_of)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        term_columns = np.concatenate(columns) if len(search_of) else np.empty(0, dtype=np.int64)
+        queries = sparse.csr_matrix((np.ones(len(search_of)), (position * n_searches + search_of, term_columns)), shape=(depth * n_searches, len(index.terms)))
+        product = sparse.coo_matrix(queries @ index.by_term.T)
+
+        # One candidate per (search, document), sorted by search then document
+        candidates, entry = np.unique((product.row % n_searches).astype(np.int64) * n_docs + product.col, return_inverse=True)
+        candidate_search, candidate_row = candidates // n_docs, candidates % n_docs
+        weights = np.zeros((depth, len(candidates)))
+        weights[product.row // n_searches, entry] = product.data
+        bounds = np.searchsorted(candidate_search, np.arange(n_searches + 1))
+
+        rankings = {ranking for _, ranking in searches}
+        orders = {}
+        if SearchRanking.TFIDF in rankings:
+            orders[True] = np.lexsort((candidate_row, -weights.sum(axis=0), candidate_search))
+        if rankings - {SearchRanking.TFIDF}:
+            orders[False] = np.lexsort((candidate_row, *-weights[::-1], candidate_search))
+
+    hits = []
+    for i, (term_columns, ranking) in enumerate(searches):
+        limit = CLOSENESS_MAX_HITS if ranking == SearchRanking.CLOSENESS else MAX_RESULTS
+        order = orders[ranking == SearchRanking.TFIDF][bounds[i]:bounds[i + 1]][:limit]
+        hits.append(SearchHits(index, candidate_row[order], np.asarray(term_columns, dtype=np.int64)))
+    return hits
+
+
+def execute_batch(searches: List[BatchSearch]) -> List[SearchResult]:
+    """
+    The results of every search, in order, as execute_search would return them.
+
+    Basic searches ranked by occurrences, TF-IDF, PageRank or closeness are
+    scored together (see batched_basic_hits); the others run one by one through
+    execute_search. Searches in the result cache are not scored again, and
+    repeated searches are scored once.
+    """
+    db = read_search_db()
+    start_time = time.perf_counter()
+    search_index = current_index()
+
+    results: List[Optional[SearchResult]] = [None] * len(searches)
+    pending: Dict[tuple, List[int]] = {} # cache key => positions in `searches`
+    for i, (query, type, ranking) in enumerate(searches):
+        if type != SearchType.BASIC or ranking not in BATCH_RANKINGS:
+            results[i] = execute_search(query, type, ranking)
+            continue
+        with STAGE_SECONDS.time("normalize"):
+            cache_key = (normalize_query(query, type), type.value, ranking.value, False)
+        if cache_key in pending:
+            pending[cache_key].append(i)
+            continue
+        results[i] = RESULT_CACHE.get(search_index.version, cache_key)
+        if results[i] is not None:
+            log_search(query, type, ranking, True, 0.0)
+        else:
+            pending[cache_key] = [i]
+
+    batch_start = time.perf_counter()
+    with STAGE_SECONDS.time("analyze"):
+        # The normalized query of a basic search is its analyzed terms
+        basic = [([search_index.vocabulary[term] for term in cache_key[0].split() if term in search_index], SearchRanking(cache_key[2])) for cache_key in pending]
+    for (cache_key, positions), hits in zip(pending.items(), batched_basic_hits(search_index, basic)):
+        query, type, ranking = searches[positions[0]]
+        result = to_result(db, hits, ranking)
+        RESULT_CACHE.set(search_index.version, cache_key, result)
+        for i in positions:
+            results[i] = result
+    # Scored together, every search is logged with its share of the batch's time
+    share = (time.perf_counter() - batch_start) / max(len(pending), 1)
+    for positions in pending.values():
+        query, type, ranking = searches[positions[0]]
+        log_search(query, type, ranking, False, share)
+
+    BATCH_SECONDS.observe(time.perf_counter() - start_time)
+    return results
+
+
+def log_search(query: str, type: SearchType, ranking: SearchRanking, cached: bool, elapsed: float):
+    SEARCH_SECONDS.observe(elapsed, type.value, ranking.value, str(cached).lower())
+    if BENCHMARK_LOGGING:
+        # Queued: the file is appended in the background, in batches
+        SEARCH_LOG.write(
+            f"[{time.strftime('%Y-%m-%d %H:%M:%S')}]  "
+            f"query='{query}'  "
+            f"type='{type.value}'  "
+            f"ranking='{ranking.value}'  "
+            f"cached={cached}  "
+            f"internal_time={elapsed:.6f}s\n"
+        )
+
+
+def document_path(doc_id: DocumentId) -> str:
+    return os.path.join(DOCUMENTS_ROOT, f"{doc_id}.txt")
+
+
+def fetch_document(doc_id: DocumentId) -> str:
+    with open(document_path(doc_id), encoding="utf-8") as f:
+        return f.read()
 
 
 def closeness_centrality_ranking(hits: SearchHits) ->  List[Tuple[float, DocumentId]]:
@@ -242,31 +1004,51 @@ def closeness_centrality_ranking(hits: SearchHits) ->  List[Tuple[float, Documen
     - term vector is term index => TFIDF for each term
       * means we need a central authority mapping term to vector index
       * seems we can do this with TFIDFVectorizor
-    - Compute distance between each pair of vectors (pandas should let us do this easy)
-    - Return ordered by min average distance
+    - Normalize the vectors, so that the cosine similarity of two hits is their dot product
+    - The total similarity of each hit to all others is a row sum of hits × hitsᵀ,
+      which is hits × (hitsᵀ × 1): one sparse matrix-vector product, no pairs
+    - Return ordered by min average distance (max total similarity), ties by document id
 
     Note: This doesn't actually take the query into account, funny enough.
 
     https://melaniewalsh.github.io/Intro-Cultural-Analytics/05-Text-Analysis/03-TF-IDF-Scikit-Learn.html
     """
-    print("Running closeness centrality ranking on", len(hits), f"hits ({len(hits)**2} combinations)")
+    print("Running closeness centrality ranking on", len(hits), "hits")
+    if not len(hits):
+        return [] # normalize rejects an empty matrix: no hits, nothing to rank
 
-    distance_matrix: Dict[DocumentId, List[float]] = dict()
-    for doc_id_1, series_1 in hits.iterrows():
-        distance_matrix[doc_id_1] = []
+    from sklearn.preprocessing import normalize # slow to import: only once needed
 
-        for _doc_id_2, series_2 in hits.iterrows():
-            distance_matrix[doc_id_1].append(cosine_similarity(series_1, series_2))
+    vectors = normalize(hits.vectors())
+    doc_ids = np.asarray(hits.doc_ids(), dtype=str)
 
-    print("Got distance matrix")
-    distance_df = pd.DataFrame.from_dict(data=distance_matrix, orient="index")
-    print("Got distance df")
-    ranking = sorted([(-np.sum(distance_series), doc_id) for doc_id, distance_series in distance_df.iterrows()])
+    similarity_sums = vectors @ np.asarray(vectors.sum(axis=0)).ravel()
+    order = np.lexsort((doc_ids, -similarity_sums))
+    ranking = [(-similarity_sums[i], doc_ids[i]) for i in order.tolist()]
     print("Got ranking (top 10)", ranking[:10])
 
     return ranking
 
 
+def pagerank_ranking(hits: SearchHits) -> List[Tuple[float, DocumentId]]:
+    """
+    Orders the hits by a blend of their PageRank in the document similarity graph
+    and their TF-IDF score for the query, each scaled to [0, 1] over the hits.
+
+    IDEA:
+    - PageRank is computed once, offline, with the similarity graph (see graph.py)
+    - Graph rows are index rows, so ranking is a gather of the hits' scores and a sort
+    - Unlike closeness, this does take the query into account (through TF-IDF)
+    """
+    def scaled(scores: np.ndarray) -> np.ndarray:
+        top = scores.max() if len(scores) else 0
+        return scores / top if top > 0 else scores
+
+    pagerank = np.asarray(load_similarity_graph().pagerank)[hits.rows]
+    blended = (1 - PAGERANK_WEIGHT) * scaled(hits.scores()) + PAGERANK_WEIGHT * scaled(pagerank)
+    doc_ids = hits.doc_ids()
+    return [(-blended[i], doc_ids[i]) for i in np.argsort(-blended, kind="stable").tolist()]
+
 
 def get_recommendations_for_query(query: str):
     """
@@ -274,34 +1056,113 @@ def get_recommendations_for_query(query: str):
 
     IDEA:
     - Tokenize the input query using a standard analyzer (CountVectorizer)
-    - Compare the query token-set with each document's token-set
+    - Compare the query token-set with the token-set of each document sharing a token with it
     - Use Jaccard similarity:  |A ∩ B| / |A ∪ B|
     - Keep only documents with non-zero similarity
-    - Return the top N highest-scoring docs
+    - Return the top N highest-scoring docs (ties in document order)
 
     """
-    load_doc_tokens()  # ensure DOC_TOKENS is populated
-
-    vectorizer = CountVectorizer(stop_words="english")
-    analyze = vectorizer.build_analyzer()
+    doc_tokens = load_doc_tokens()
 
-    query_tokens = set(analyze(query))
+    query_tokens = set(query_analyzer()(query))
 
-    scores = []
-    for doc_id, tokens in DOC_TOKENS.items():
-        inter = len(query_tokens & tokens)
-        union = len(query_tokens | tokens)
-        if union == 0:
-            continue
-
-        j = inter / union
-        if j > 0:
-            scores.append((doc_id, j))
-
-    scores.sort(key=lambda x: x[1], reverse=True)
-    top = [doc_id for doc_id, _ in scores[:8]]
+    rows, scores = doc_tokens.jaccard(query_tokens)
+    top_rows = rows[np.argsort(-scores, kind="stable")[:8]]
+    top = doc_tokens.doc_ids[top_rows].tolist()
 
     db = read_search_db()
     recommendations = [ db[doc_id] for doc_id in top ]
 
     return recommendations
+
+
+@dataclass
+class WarmUp:
+    """Progress of the background warm-up (see start_warm_up)."""
+    stage: str = "not started" # being loaded
+    error: Optional[str] = None # of the stage that failed
+    started: Optional[float] = None # perf_counter
+    seconds: Optional[float] = None # taken to get ready
+    done: threading.Event = field(default_factory=threading.Event) # ready, or failed
+    thread: Optional[threading.Thread] = None
+
+
+WARM_UP = WarmUp()
+_warm_up_lock = threading.Lock()
+
+
+def warm_up_stages() -> List[Tuple[str, Callable]]:
+    stages = [
+        ("index", current_index),
+        ("documents", read_search_db),
+        ("tokens", load_doc_tokens),
+        ("graph", load_similarity_graph),
+        ("analyzer", query_analyzer),
+        ("postings", load_postings_index), # the bm25 and tfidf rankings need them, whatever SEARCH_BACKEND is
+    ]
+    if POSITIONAL_INDEX:
+        stages.append(("positions", load_positional_index))
+    return stages
+
+
+def run_warm_up():
+    WARM_UP.started = time.perf_counter()
+    try:
+        for stage, load in warm_up_stages():
+            WARM_UP.stage = stage
+            with STAGE_SECONDS.time(f"warm_up_{stage}"):
+                load()
+        WARM_UP.stage = "ready"
+        WARM_UP.seconds = time.perf_counter() - WARM_UP.started
+        print(f"Search ready in {WARM_UP.seconds:.2f}s")
+    except Exception as e:
+        WARM_UP.error = f"{type(e).__name__}: {e}"
+        print("Warm-up failed in stage", WARM_UP.stage, WARM_UP.error)
+    finally:
+        WARM_UP.done.set()
+
+
+def start_warm_up() -> threading.Thread:
+    """
+    Load everything searches need in a background thread, once per process.
+
+    IDEA:
+    - Importing this module does no I/O and does not import sklearn, so that
+      management commands (which import the URLconf for their checks) and tests
+      start as fast as Django itself; the servers (wsgi.py, asgi.py) call this.
+    - A search arriving before the warm-up is done waits for the stage it needs
+      (see load_once) rather than loading it a second time.
+    - readiness() reports the progress, for GET /api/health/ready.
+    """
+    with _warm_up_lock:
+        if WARM_UP.thread is None:
+            WARM_UP.stage = "starting"
+            WARM_UP.thread = threading.Thread(target=run_warm_up, name="search-warm-up", daemon=True)
+            WARM_UP.thread.start()
+    return WARM_UP.thread
+
+
+def warm_up() -> dict:
+    """
+    Run the warm-up (or wait for the one started) and return readiness().
+
+    When it returns, no thread of this module is left running: a cold start builds
+    the index with update_index, whose segment merge is waited for too, so that a
+    process forking next (gunicorn's preloading master) does not copy its locks held.
+    """
+    start_warm_up().join()
+    if _segment_merge is not None:
+        _segment_merge.join()
+    return readiness()
+
+
+def readiness() -> dict:
+    """{"ready", "stage", "error", "seconds"}: seconds taken to get ready, or spent so far."""
+    ready = WARM_UP.done.is_set() and WARM_UP.error is None
+    if WARM_UP.seconds is not None:
+        seconds = WARM_UP.seconds
+    elif WARM_UP.started is not None:
+        seconds = time.perf_counter() - WARM_UP.started
+    else:
+        seconds = None
+    return {"ready": ready, "stage": WARM_UP.stage, "error": WARM_UP.error, "seconds": None if seconds is None else round(seconds, 3)}
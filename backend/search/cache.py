@@ -0,0 +1,184 @@
+"""
+Result cache in front of execute_search.
+
+IDEA:
+- Popular queries repeat a lot, and their results only change when the index does.
+- Entries are keyed by (normalized query, search type, ranking) and tagged with the
+  index version they were computed on; a new index version empties the cache.
+- Size is bounded (least recently used entries go first) and entries expire after
+  a TTL, so a long-lived worker does not hold on to stale or unpopular results.
+- The storage is pluggable: InProcessCache is a plain dict per worker, FileCache is
+  a directory that every worker on the machine reads and writes.
+"""
+import os
+import time
+import pickle
+import hashlib
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, asdict
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+CACHE_SIZE = 1024 # entries
+CACHE_TTL = 600 # seconds
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0 # dropped to stay under the size bound
+    expirations: int = 0 # dropped because older than the TTL
+    invalidations: int = 0 # times the cache was emptied for a new index version
+
+
+class InProcessCache:
+    """LRU + TTL cache in this process' memory."""
+
+    def __init__(self, max_entries: int = CACHE_SIZE, ttl: float = CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.stats = CacheStats()
+        self._entries: OrderedDict[Hashable, Tuple[float, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.stats.misses += 1
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                self.stats.expirations += 1
+                self.stats.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class FileCache:
+    """
+    LRU + TTL cache stored as one pickle per entry in `cache_dir`, shared by all
+    processes on the machine. Recency is the file's mtime, refreshed on every hit.
+    Counters are those of this process.
+    """
+
+    # Check the size bound every so many writes rather than listing the directory each time
+    TRIM_EVERY = 32
+
+    def __init__(self, cache_dir: str, max_entries: int = CACHE_SIZE, ttl: float = CACHE_TTL):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.stats = CacheStats()
+        self._writes = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, key: Hashable) -> str:
+        return os.path.join(self.cache_dir, hashlib.sha1(repr(key).encode()).hexdigest() + ".pickle")
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                stored_key, expires, value = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            self.stats.misses += 1
+            return None
+        if stored_key != key:
+            self.stats.misses += 1
+            return None
+        if expires < time.time():
+            self._remove(path)
+            self.stats.expirations += 1
+            self.stats.misses += 1
+            return None
+        os.utime(path)
+        self.stats.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any):
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump((key, time.time() + self.ttl, value), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+        self._writes += 1
+        if self._writes % self.TRIM_EVERY == 0:
+            self.trim()
+
+    def trim(self):
+        """Remove the least recently used entries above `max_entries`."""
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith(".pickle"):
+                try:
+                    entries.append((entry.stat().st_mtime, entry.path))
+                except OSError:
+                    continue
+        entries.sort()
+        for _mtime, path in entries[:max(len(entries) - self.max_entries, 0)]:
+            self._remove(path)
+            self.stats.evictions += 1
+
+    def clear(self):
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith(".pickle"):
+                self._remove(entry.path)
+
+    def _remove(self, path: str):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def __len__(self) -> int:
+        return sum(1 for entry in os.scandir(self.cache_dir) if entry.name.endswith(".pickle"))
+
+
+class QueryCache:
+    """Versioned cache of search results over any of the backends above."""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.version: Optional[str] = None
+        self._lock = threading.Lock()
+
+    def _check_version(self, version: str):
+        if version != self.version:
+            with self._lock:
+                if version != self.version:
+                    if self.version is not None:
+                        self.backend.clear()
+                        self.backend.stats.invalidations += 1
+                    self.version = version
+
+    def get(self, version: str, key: Hashable) -> Optional[Any]:
+        self._check_version(version)
+        return self.backend.get((version, key))
+
+    def set(self, version: str, key: Hashable, value: Any):
+        self._check_version(version)
+        self.backend.set((version, key), value)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": type(self.backend).__name__, "entries": len(self.backend), **asdict(self.backend.stats)}
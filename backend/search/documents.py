@@ -0,0 +1,121 @@
+"""
+Document text served in parts, streamed from the file.
+
+IDEA:
+- A reader only needs the first screenful of a book to start, so the text is
+  requested by byte range, either with an HTTP `Range: bytes=a-b` header (206
+  Partial Content) or with `?offset=&length=` / `?page=` query parameters.
+- Ranges are streamed from the file in STREAM_CHUNK_BYTES chunks: a request
+  costs a seek and the bytes asked for, never the whole book in memory.
+- Query parameter slices are widened to whole UTF-8 characters, so they always
+  decode; `Range` requests get exactly the bytes asked for, as HTTP expects.
+- The file's size and modification time make its ETag and Last-Modified, so a
+  reader revalidating an unchanged document gets a 304 without a body.
+"""
+import os
+import re
+from dataclasses import dataclass
+from typing import Iterator, Optional
+
+DOCUMENT_PAGE_BYTES = 16 * 1024 # a screenful or two of text
+STREAM_CHUNK_BYTES = 64 * 1024
+
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+UTF8_MAX_CONTINUATION = 3 # bytes after the first of a UTF-8 character
+
+
+class RangeNotSatisfiable(ValueError):
+    pass
+
+
+@dataclass
+class DocumentSlice:
+    start: int
+    end: int # exclusive
+    size: int # of the whole document
+
+    @property
+    def length(self) -> int:
+        return self.end - self.start
+
+    @property
+    def complete(self) -> bool:
+        return self.start == 0 and self.end == self.size
+
+    def content_range(self) -> str:
+        return f"bytes {self.start}-{self.end - 1}/{self.size}"
+
+
+def etag(stat: os.stat_result) -> str:
+    return f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+
+
+def parse_range(header: str, size: int) -> Optional[DocumentSlice]:
+    """
+    The slice of a single `bytes=start-end` (or `bytes=-suffix`) range. Other
+    units and multiple ranges are ignored (None): the whole document is sent.
+    Raises RangeNotSatisfiable if the range starts past the end.
+    """
+    match = RANGE_RE.match(header.strip())
+    if match is None or match.group(1) == match.group(2) == "":
+        return None
+    first, last = match.groups()
+    if first == "":
+        # Suffix range: the last `last` bytes
+        if int(last) == 0:
+            raise RangeNotSatisfiable(header)
+        return DocumentSlice(max(0, size - int(last)), size, size)
+    start = int(first)
+    end = size if last == "" else min(size, int(last) + 1)
+    if start >= size or end <= start:
+        raise RangeNotSatisfiable(header)
+    return DocumentSlice(start, end, size)
+
+
+def parse_offset(offset: Optional[str], length: Optional[str], page: Optional[str], size: int) -> DocumentSlice:
+    """
+    The slice of `?offset=&length=` (length defaults to DOCUMENT_PAGE_BYTES), or
+    of `?page=` (pages of DOCUMENT_PAGE_BYTES from 0). Raises ValueError on
+    negative or non-integer values; past the end, the slice is empty.
+    """
+    length = DOCUMENT_PAGE_BYTES if length is None else int(length)
+    start = int(page) * DOCUMENT_PAGE_BYTES if page is not None else int(offset or 0)
+    if start < 0 or length < 0:
+        raise ValueError("offset, length and page must be non-negative")
+    start = min(start, size)
+    return DocumentSlice(start, min(size, start + length), size)
+
+
+def is_continuation(byte: int) -> bool:
+    return byte & 0b1100_0000 == 0b1000_0000
+
+
+def align_to_characters(path: str, part: DocumentSlice) -> DocumentSlice:
+    """`part` widened so that it neither starts nor ends inside a UTF-8 character."""
+    start, end = part.start, part.end
+    with open(path, "rb") as f:
+        if 0 < start < part.size:
+            # Back to the first byte of the character holding `start`
+            window_start = max(0, start - UTF8_MAX_CONTINUATION)
+            f.seek(window_start)
+            window = f.read(start + 1 - window_start)
+            while start > window_start and is_continuation(window[start - window_start]):
+                start -= 1
+        if start < end < part.size:
+            f.seek(end)
+            after = f.read(UTF8_MAX_CONTINUATION)
+            end += next((i for i, byte in enumerate(after) if not is_continuation(byte)), len(after))
+    return DocumentSlice(start, end, part.size)
+
+
+def iter_file(path: str, part: DocumentSlice, chunk_bytes: int = STREAM_CHUNK_BYTES) -> Iterator[bytes]:
+    """The bytes of `part` of the file, `chunk_bytes` at a time."""
+    with open(path, "rb") as f:
+        f.seek(part.start)
+        remaining = part.length
+        while remaining > 0:
+            chunk = f.read(min(chunk_bytes, remaining))
+            if not chunk:
+                return
+            remaining -= len(chunk)
+            yield chunk
@@ -0,0 +1,112 @@
+"""
+Regex search over the full text of the documents, for patterns that span
+several words or punctuation and so cannot be matched against index terms.
+
+IDEA:
+- Split the documents into small chunks and scan them in a process pool.
+- Each document is memory-mapped rather than read into a string, and the
+  pattern is compiled as a bytes regex so that it runs directly on the map.
+- Before running the regex engine, check that the document contains the
+  literals the pattern requires (a plain memory search, much cheaper).
+- Stop handing out chunks once the first `limit` matching documents are known
+  (no chunk before them is still being scanned), or once the query's time budget
+  is spent. A search stopped by the budget is reported as truncated: which
+  documents it found depends on how busy the machine was, so it must not be
+  cached.
+
+Note: as a bytes regex, classes like \\w and (?i) only cover ASCII.
+"""
+import os
+import re
+import mmap
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from typing import Dict, List, Optional, Tuple
+
+from .vocabulary import regex_literals
+
+FULLTEXT_WORKERS = os.cpu_count() or 1
+FULLTEXT_CHUNK_SIZE = 8 # documents per task
+FULLTEXT_SECONDS = 5.0 # time budget per query
+
+_executor: Optional[ProcessPoolExecutor] = None
+
+
+def executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=FULLTEXT_WORKERS)
+    return _executor
+
+
+def check_pattern(regex: str):
+    """Raise re.error if `regex` is not a valid pattern, as str (for its literals) and as the bytes regex scanned with."""
+    re.compile(regex)
+    re.compile(regex.encode("utf-8"))
+
+
+def scan_documents(paths: List[str], offset: int, pattern: bytes, literals: List[bytes], deadline: float) -> Tuple[List[int], bool]:
+    """(positions (offset + i) of the documents in `paths` that `pattern` matches, truncated by the deadline)."""
+    r = re.compile(pattern)
+    matched: List[int] = []
+    for i, path in enumerate(paths):
+        if time.time() > deadline:
+            return matched, True
+        try:
+            with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as text:
+                if all(text.find(literal) != -1 for literal in literals) and r.search(text):
+                    matched.append(offset + i)
+        except (OSError, ValueError): # missing or empty file
+            continue
+    return matched, False
+
+
+def fulltext_search(paths: List[str], regex: str, limit: int, pool: Optional[ProcessPoolExecutor] = None, seconds: float = FULLTEXT_SECONDS) -> Tuple[List[int], bool]:
+    """
+    (positions in `paths` of the first `limit` documents whose text matches
+    `regex`, in increasing order, truncated): truncated if the time budget ran out
+    before they were all known. Scans in the shared pool unless given another `pool`.
+    """
+    pattern = regex.encode("utf-8")
+    prefix, required = regex_literals(regex)
+    literals = sorted({literal.encode("utf-8") for literal in [prefix, *required] if literal}, key=len, reverse=True)
+    deadline = time.time() + seconds
+
+    pool = pool or executor()
+    chunks = [(paths[start:start + FULLTEXT_CHUNK_SIZE], start) for start in range(0, len(paths), FULLTEXT_CHUNK_SIZE)]
+    pending: Dict[Future, int] = {}
+    matched: List[int] = []
+    truncated = False
+    last: Optional[int] = None # position of the limit-th match so far: no later chunk can change the result
+    next_chunk = 0
+    in_flight = 2 * FULLTEXT_WORKERS
+
+    try:
+        while next_chunk < len(chunks) or pending:
+            # Keep every worker busy without queueing work we may not need
+            while next_chunk < len(chunks) and len(pending) < in_flight and (last is None or chunks[next_chunk][1] <= last):
+                chunk_paths, offset = chunks[next_chunk]
+                pending[pool.submit(scan_documents, chunk_paths, offset, pattern, literals, deadline)] = offset
+                next_chunk += 1
+
+            done, _ = wait(pending, timeout=max(deadline - time.time(), 0), return_when=FIRST_COMPLETED)
+            if not done:
+                print(f"Full-text search for {regex!r} ran out of time after {len(matched)} matches")
+                truncated = True
+                break
+            for future in done:
+                del pending[future]
+                chunk_matched, chunk_truncated = future.result()
+                matched.extend(chunk_matched)
+                truncated = truncated or chunk_truncated
+            if truncated:
+                break
+            if len(matched) >= limit:
+                last = sorted(matched)[limit - 1]
+                if all(offset > last for offset in pending.values()):
+                    break
+    finally:
+        for future in pending:
+            future.cancel()
+
+    return sorted(matched)[:limit], truncated
@@ -0,0 +1,153 @@
+"""
+Precomputed k-nearest-neighbor graph of the documents, by cosine similarity of
+their TF-IDF vectors ("more like this").
+
+IDEA:
+- Comparing every pair of documents is quadratic, and the product of full TF-IDF
+  vectors is nearly dense since common words are shared by every book.
+- Instead, keep only the SIGNATURE_TERMS highest weighted terms of each document
+  (its rarest, most telling words). Documents only become candidates of each
+  other if they share one of those, and the sparse product of the signatures is
+  computed a block of rows at a time to bound memory.
+- The best CANDIDATES_PER_NEIGHBOR * k candidates of each document are rescored
+  with their exact cosine similarity, and the k best are kept.
+- The graph is stored as two (documents × k) arrays, so looking up the
+  neighbors of a document is O(k).
+- PageRank over the graph is computed once, by sparse power iteration, and
+  stored with it as one score per document.
+"""
+from dataclasses import dataclass
+from functools import cached_property
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from scipy import sparse
+
+from .storage import load_arrays, save_arrays
+
+GRAPH_FORMAT = 2
+SIMILAR_K = 10
+SIGNATURE_TERMS = 100
+CANDIDATES_PER_NEIGHBOR = 4
+BLOCK_ROWS = 256
+PAGERANK_DAMPING = 0.85
+PAGERANK_TOLERANCE = 1e-10
+PAGERANK_MAX_ITERATIONS = 100
+
+
+def signatures(vectors: sparse.csr_matrix, size: int) -> sparse.csr_matrix:
+    """`vectors` with all but the `size` largest entries of each row dropped."""
+    keep = np.zeros(vectors.nnz, dtype=bool)
+    for row in range(vectors.shape[0]):
+        start, end = vectors.indptr[row], vectors.indptr[row + 1]
+        if end - start <= size:
+            keep[start:end] = True
+        else:
+            keep[start + np.argpartition(-vectors.data[start:end], size)[:size]] = True
+    result = vectors.copy()
+    result.data = np.where(keep, result.data, 0)
+    result.eliminate_zeros()
+    return result
+
+
+def pagerank(neighbors: np.ndarray, weights: np.ndarray, damping: float = PAGERANK_DAMPING) -> np.ndarray:
+    """
+    PageRank of every document, following each edge in proportion to its weight.
+    Documents without neighbors jump to any document, like the random surfer.
+    """
+    n_docs, k = neighbors.shape
+    if not n_docs:
+        return np.empty(0)
+    edges = neighbors.ravel() >= 0
+    sources = np.repeat(np.arange(n_docs), k)[edges]
+    adjacency = sparse.csr_matrix((weights.ravel()[edges].astype(np.float64), (sources, neighbors.ravel()[edges])), shape=(n_docs, n_docs))
+
+    out_weights = np.asarray(adjacency.sum(axis=1)).ravel()
+    dangling = out_weights == 0
+    # column-stochastic transitions, ready for a matrix-vector product per iteration
+    transitions = (sparse.diags(np.divide(1, out_weights, out=np.zeros(n_docs), where=~dangling)) @ adjacency).T.tocsr()
+
+    scores = np.full(n_docs, 1 / n_docs)
+    for _ in range(PAGERANK_MAX_ITERATIONS):
+        updated = damping * (transitions @ scores + scores[dangling].sum() / n_docs) + (1 - damping) / n_docs
+        converged = np.abs(updated - scores).sum() < PAGERANK_TOLERANCE
+        scores = updated
+        if converged:
+            break
+    return scores
+
+
+@dataclass
+class SimilarityGraph:
+    doc_ids: np.ndarray # row => document id
+    neighbors: np.ndarray # row => rows of its k most similar documents, most similar first, -1 if fewer
+    weights: np.ndarray # row => cosine similarity to each neighbor
+    pagerank: np.ndarray # row => PageRank over the graph
+    version: str # fingerprint of the corpus, as for SearchIndex
+
+    @classmethod
+    def build(cls, vectors: sparse.csr_matrix, doc_ids: np.ndarray, version: str, k: int = SIMILAR_K) -> "SimilarityGraph":
+        from sklearn.preprocessing import normalize # slow to import: only when building
+
+        vectors = normalize(sparse.csr_matrix(vectors, dtype=np.float32))
+        n_docs = vectors.shape[0]
+        neighbors = np.full((n_docs, k), -1, dtype=np.int32)
+        weights = np.zeros((n_docs, k), dtype=np.float32)
+        n_candidates = min(CANDIDATES_PER_NEIGHBOR * k, n_docs - 1)
+        if n_candidates < 1:
+            return cls(np.asarray(doc_ids, dtype=str), neighbors, weights, pagerank(neighbors, weights), version)
+
+        signature = signatures(vectors, SIGNATURE_TERMS)
+        signature_t = signature.T.tocsc()
+        for start in range(0, n_docs, BLOCK_ROWS):
+            block = (signature[start:start + BLOCK_ROWS] @ signature_t).toarray()
+            rows = np.arange(block.shape[0])
+            block[rows, start + rows] = 0 # a document is not its own neighbor
+
+            candidates = np.argpartition(-block, n_candidates - 1, axis=1)[:, :n_candidates]
+            shares_terms = np.take_along_axis(block, candidates, axis=1) > 0
+
+            # Exact cosine similarity of each (document, candidate) pair
+            pair_rows = np.repeat(start + rows, n_candidates)
+            exact = np.asarray(vectors[pair_rows].multiply(vectors[candidates.ravel()]).sum(axis=1)).reshape(candidates.shape)
+            exact[~shares_terms] = -1
+
+            order = np.argsort(-exact, axis=1)[:, :k]
+            best = np.take_along_axis(candidates, order, axis=1)
+            best_weights = np.take_along_axis(exact, order, axis=1)
+            found = best_weights > 0
+            count = min(k, n_candidates)
+            neighbors[start:start + len(rows), :count] = np.where(found, best, -1)
+            weights[start:start + len(rows), :count] = np.where(found, best_weights, 0)
+
+        return cls(np.asarray(doc_ids, dtype=str), neighbors, weights, pagerank(neighbors, weights), version)
+
+    def save(self, graph_dir: str):
+        save_arrays(graph_dir, {
+            "doc_ids": self.doc_ids,
+            "neighbors": self.neighbors,
+            "weights": self.weights,
+            "pagerank": self.pagerank,
+        }, {"format": GRAPH_FORMAT, "fingerprint": self.version, "k": self.neighbors.shape[1]})
+
+    @classmethod
+    def load(cls, graph_dir: str) -> Optional["SimilarityGraph"]:
+        saved = load_arrays(graph_dir, GRAPH_FORMAT)
+        if saved is None:
+            return None
+        manifest, load_array = saved
+        return cls(load_array("doc_ids"), load_array("neighbors"), load_array("weights"), load_array("pagerank"), manifest["fingerprint"])
+
+    @cached_property
+    def rows(self) -> Dict[str, int]:
+        """document id => row"""
+        return {doc_id: row for row, doc_id in enumerate(self.doc_ids.tolist())}
+
+    def similar(self, doc_id: str) -> List[Tuple[str, float]]:
+        """(document id, cosine similarity) of the neighbors of `doc_id`, most similar first."""
+        row = self.rows.get(doc_id)
+        if row is None:
+            return []
+        neighbors, weights = self.neighbors[row], self.weights[row]
+        found = neighbors >= 0
+        return list(zip(self.doc_ids[neighbors[found]].tolist(), weights[found].tolist()))
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from search.business_logic import DOCUMENTS_ROOT, SEGMENTS_DIR, update_index
+from search.segments import MERGE_FACTOR, SegmentStore
+
+
+class Command(BaseCommand):
+    help = "Index the documents added to (or removed from) the documents directory since the last update."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--documents", default=DOCUMENTS_ROOT, help="documents directory (default: %(default)s)")
+        parser.add_argument("--merge", action="store_true", help="merge all segments into one before exiting")
+
+    def handle(self, *args, **options):
+        index, report = update_index(options["documents"])
+        self.stdout.write(f"{report}; index has {len(index)} documents and {len(index.terms)} terms")
+
+        # Waits for the background merge started by update_index, if any
+        merged = SegmentStore(SEGMENTS_DIR).merge(merge_factor=1 if options["merge"] else MERGE_FACTOR)
+        if merged:
+            self.stdout.write(f"Merged segments into {merged}")
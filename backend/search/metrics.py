@@ -0,0 +1,200 @@
+"""
+In-memory latency histograms of the search path, rendered in the Prometheus text
+format for GET /api/metrics, and a batched writer for the search log.
+
+IDEA:
+- A histogram counts observations into fixed buckets (LATENCY_BUCKETS, from 50 µs
+  to 10 s), per combination of label values, with their sum: enough for rates,
+  means and percentile estimates, in constant memory.
+- Every thread counts into its own shard, so observing takes no lock: a bisect,
+  an increment and an addition. A scrape sums the shards; the shards of finished
+  threads are folded into one, so short-lived request threads do not pile up.
+- Timers are plain context managers (no generator), so timing a stage costs
+  about a microsecond.
+- The search log is appended by a background thread every LOG_FLUSH_SECONDS, in
+  one write per batch, instead of an open/append/close in every request.
+- Metrics are per process: with several workers, each one has its own.
+"""
+import atexit
+import os
+import queue
+import threading
+import time
+from bisect import bisect_left
+from typing import Dict, Iterable, List, Optional, Tuple
+
+LATENCY_BUCKETS = (
+    0.00005, 0.0001, 0.00025, 0.0005,
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+) # seconds; observations above the last go to +Inf
+LOG_FLUSH_SECONDS = 1.0
+
+Labels = Tuple[str, ...]
+Series = List[float] # a count per bucket, the +Inf count, then the sum
+
+
+class Timer:
+    __slots__ = ("histogram", "labels", "start")
+
+    def __init__(self, histogram: "Histogram", labels: Labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self) -> "Timer":
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *_exc):
+        self.histogram.observe(time.perf_counter() - self.start, *self.labels)
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, label_names: Iterable[str] = (), buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self.buckets = buckets
+        self._local = threading.local()
+        self._shards: List[Tuple[threading.Thread, Dict[Labels, Series]]] = []
+        self._retired: Dict[Labels, Series] = {} # shards of finished threads, summed
+        self._lock = threading.Lock() # taken once per thread, and by scrapes
+
+    def _shard(self) -> Dict[Labels, Series]:
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = self._local.shard = {}
+            with self._lock:
+                self._retire_finished()
+                self._shards.append((threading.current_thread(), shard))
+        return shard
+
+    def _retire_finished(self):
+        """Fold the shards of finished threads (no longer written) into _retired. Holds _lock."""
+        alive = []
+        for thread, shard in self._shards:
+            if thread.is_alive():
+                alive.append((thread, shard))
+            else:
+                add_series(self._retired, shard)
+        self._shards = alive
+
+    def observe(self, seconds: float, *labels: str):
+        shard = self._shard()
+        series = shard.get(labels)
+        if series is None:
+            series = shard[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect_left(self.buckets, seconds)] += 1
+        series[-1] += seconds
+
+    def time(self, *labels: str) -> Timer:
+        """`with histogram.time(label, ...):` observes the time spent in the block."""
+        return Timer(self, labels)
+
+    def collect(self) -> Dict[Labels, Series]:
+        with self._lock:
+            self._retire_finished()
+            total: Dict[Labels, Series] = {}
+            add_series(total, self._retired)
+            for _thread, shard in self._shards:
+                add_series(total, shard)
+        return total
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, series in sorted(self.collect().items()):
+            pairs = [f'{name}="{escape(value)}"' for name, value in zip(self.label_names, labels)]
+            cumulative = 0
+            for bound, count in zip([*map(format_bound, self.buckets), "+Inf"], series[:-1]):
+                cumulative += count
+                bucket_pairs = ",".join(pairs + [f'le="{bound}"'])
+                lines.append(f"{self.name}_bucket{{{bucket_pairs}}} {cumulative}")
+            label_text = "{" + ",".join(pairs) + "}" if pairs else ""
+            lines.append(f"{self.name}_sum{label_text} {series[-1]:.9g}")
+            lines.append(f"{self.name}_count{label_text} {cumulative}")
+        return lines
+
+
+def add_series(total: Dict[Labels, Series], shard: Dict[Labels, Series]):
+    for labels, series in list(shard.items()):
+        into = total.get(labels)
+        if into is None:
+            total[labels] = list(series)
+        else:
+            for i, value in enumerate(series):
+                into[i] += value
+
+
+def format_bound(bound: float) -> str:
+    return f"{bound:g}"
+
+
+def escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def render_counters(prefix: str, counters: Dict[str, object], help: str) -> List[str]:
+    """Numeric entries of `counters` (e.g. cache stats) as untyped metrics `prefix`_key."""
+    lines = []
+    for key, value in counters.items():
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            lines += [f"# HELP {prefix}_{key} {help}", f"# TYPE {prefix}_{key} untyped", f"{prefix}_{key} {value}"]
+    return lines
+
+
+def render(histograms: Iterable[Histogram], extra: Iterable[str] = ()) -> str:
+    lines: List[str] = []
+    for histogram in histograms:
+        lines += histogram.render()
+    lines += extra
+    return "\n".join(lines) + "\n"
+
+
+class BatchedLogWriter:
+    """
+    Appends lines to `path` from a background thread, started by the first write.
+    A write only queues its line; the lines queued are written every
+    `flush_interval` seconds, and at exit.
+    """
+
+    def __init__(self, path: str, flush_interval: float = LOG_FLUSH_SECONDS):
+        self.path = path
+        self.flush_interval = flush_interval
+        self._queue: "queue.SimpleQueue[str]" = queue.SimpleQueue()
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+
+    def write(self, line: str):
+        self._queue.put(line)
+        if self._thread is None:
+            self._start()
+
+    def _start(self):
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="search-log-writer", daemon=True)
+                self._thread.start()
+                atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def flush(self):
+        with self._write_lock:
+            lines = []
+            while True:
+                try:
+                    lines.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if not lines:
+                return
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.writelines(lines)
+            except OSError as e:
+                print("INTERNAL_LOGGING ERROR:", e)
@@ -0,0 +1,173 @@
+"""
+Phrase ("white whale") and proximity (whale NEAR/5 captain) queries, over the
+positional index.
+
+Syntax: clauses separated by spaces, all of which must match. A clause is a
+quoted phrase or a word, or several of them joined by NEAR/k (within k tokens
+of each other, in any order). A query without quotes or NEAR is one phrase.
+Stop words and words missing from the index match any word at their place.
+
+IDEA:
+- Candidate documents are those holding every query term: the sorted rows of
+  the rarest term, probed with a binary search in the rows of the next rarest,
+  and so on. Each probe only costs the log of the longer list, and the lists
+  of the most common terms are reached last, with the fewest candidates.
+- Positions are then decoded a term at a time, rarest first, and only for the
+  documents still matching, so the long position lists of common terms are
+  decoded for few documents, if any.
+- Every occurrence is a key (candidate << 32 | position), sorted. The starts of
+  a phrase are the keys of its first term minus its offset in the phrase, kept
+  while the keys of every other term, minus theirs, contain them. NEAR/k keeps
+  the keys of one side with a key of the other side within k.
+- A document's number of matches (phrase occurrences, or occurrences near the
+  other side) is its occurrence count for ranking.
+"""
+import re
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .positions import TOKEN_RE, PositionalIndex
+
+QUERY_RE = re.compile(r'"([^"]*)"?|(NEAR/\d+)|(\S+)')
+POSITION_BITS = 32 # positions in a key
+
+
+@dataclass
+class Phrase:
+    terms: List[Tuple[int, int]] # (term id, position in the phrase) of the indexed words
+
+
+@dataclass
+class Clause:
+    phrases: List[Phrase]
+    distances: List[int] = field(default_factory=list) # NEAR/k between consecutive phrases
+
+
+def parse_phrase(text: str, vocabulary: Dict[str, int]) -> Phrase:
+    return Phrase([(vocabulary[token], position) for position, token in enumerate(TOKEN_RE.findall(text.lower())) if token in vocabulary])
+
+
+def parse_query(query: str, vocabulary: Dict[str, int]) -> List[Clause]:
+    """The clauses of `query`, with the words of `vocabulary` (term => term id). Phrases without indexed words are dropped."""
+    if '"' not in query and not re.search(r"\bNEAR/\d+\b", query):
+        query = f'"{query}"'
+
+    clauses: List[Clause] = []
+    near: Optional[int] = None
+    for match in QUERY_RE.finditer(query):
+        quoted, operator, word = match.groups()
+        if operator is not None:
+            near = int(operator.split("/")[1])
+            continue
+        phrase = parse_phrase(quoted if quoted is not None else word, vocabulary)
+        if not phrase.terms:
+            near = None
+            continue
+        if near is not None and clauses:
+            clauses[-1].phrases.append(phrase)
+            clauses[-1].distances.append(near)
+        else:
+            clauses.append(Clause([phrase]))
+        near = None
+    return clauses
+
+
+def query_terms(clauses: List[Clause]) -> List[int]:
+    return sorted({term_id for clause in clauses for phrase in clause.phrases for term_id, _ in phrase.terms})
+
+
+def intersect_rows(index: PositionalIndex, term_ids: List[int]) -> Tuple[np.ndarray, Dict[int, np.ndarray]]:
+    """
+    Rows of the documents containing all of `term_ids` (rarest first), and for
+    every term, its pair with each of those documents.
+    """
+    rows = np.asarray(index.term_rows(term_ids[0]), dtype=np.int64)
+    pairs = {term_ids[0]: int(index.term_pairs[term_ids[0]]) + np.arange(len(rows))}
+    for term_id in term_ids[1:]:
+        term_rows = index.term_rows(term_id)
+        if not len(rows) or not len(term_rows):
+            return np.empty(0, dtype=np.int64), {term_id: np.empty(0, dtype=np.int64) for term_id in term_ids}
+        found = np.minimum(np.searchsorted(term_rows, rows), len(term_rows) - 1)
+        keep = term_rows[found] == rows
+        rows = rows[keep]
+        pairs = {previous: previous_pairs[keep] for previous, previous_pairs in pairs.items()}
+        pairs[term_id] = int(index.term_pairs[term_id]) + found[keep]
+    return rows, pairs
+
+
+def term_keys(index: PositionalIndex, pairs: np.ndarray, candidates: np.ndarray) -> np.ndarray:
+    """Sorted keys of the occurrences of a term (its `pairs`, by candidate) in `candidates`."""
+    positions, which = index.positions_of_pairs(pairs[candidates])
+    return (candidates[which] << POSITION_BITS) + positions
+
+
+def contains(keys: np.ndarray, wanted: np.ndarray) -> np.ndarray:
+    if not len(keys):
+        return np.zeros(len(wanted), dtype=bool)
+    found = np.minimum(np.searchsorted(keys, wanted), len(keys) - 1)
+    return keys[found] == wanted
+
+
+def candidates_of(keys: np.ndarray) -> np.ndarray:
+    return np.unique(keys >> POSITION_BITS)
+
+
+def phrase_starts(index: PositionalIndex, phrase: Phrase, pairs: Dict[int, np.ndarray], candidates: np.ndarray) -> np.ndarray:
+    """Sorted keys of the starts of `phrase` in `candidates`."""
+    terms = sorted(phrase.terms, key=lambda term: len(index.term_rows(term[0])))
+    first, offset = terms[0]
+    keys = term_keys(index, pairs[first], candidates)
+    keys = keys[(keys & ((1 << POSITION_BITS) - 1)) >= offset] - offset
+    for term_id, offset in terms[1:]:
+        if not len(keys):
+            break
+        keys = keys[contains(term_keys(index, pairs[term_id], candidates_of(keys)), keys + offset)]
+    return keys
+
+
+def near(keys: np.ndarray, other: np.ndarray, distance: int) -> np.ndarray:
+    """Those of `keys` with one of `other` within `distance` positions, in the same document."""
+    if not len(other):
+        return keys[:0]
+    found = np.searchsorted(other, keys)
+    after = other[np.minimum(found, len(other) - 1)]
+    before = other[np.maximum(found - 1, 0)]
+    same_after = (after >> POSITION_BITS) == (keys >> POSITION_BITS)
+    same_before = (before >> POSITION_BITS) == (keys >> POSITION_BITS)
+    return keys[(same_after & (np.abs(after - keys) <= distance)) | (same_before & (np.abs(keys - before) <= distance))]
+
+
+def match_clause(index: PositionalIndex, clause: Clause, pairs: Dict[int, np.ndarray], candidates: np.ndarray) -> np.ndarray:
+    """
+    Keys of the matches of `clause` in `candidates`: the starts of its phrase, or
+    of its last phrase near a match of the previous ones.
+    """
+    keys = phrase_starts(index, clause.phrases[0], pairs, candidates)
+    for phrase, distance in zip(clause.phrases[1:], clause.distances):
+        if not len(keys):
+            break
+        keys = near(phrase_starts(index, phrase, pairs, candidates_of(keys)), keys, distance)
+    return keys
+
+
+def phrase_matches(index: PositionalIndex, clauses: List[Clause]) -> Tuple[np.ndarray, np.ndarray]:
+    """(rows, number of matches) of the documents matching every clause, by increasing row."""
+    term_ids = sorted(query_terms(clauses), key=lambda term_id: len(index.term_rows(term_id)))
+    if not term_ids:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    rows, pairs = intersect_rows(index, term_ids)
+
+    # Most selective clauses first, so that the others are decoded for fewer documents
+    rarest = lambda clause: min(len(index.term_rows(term_id)) for term_id in query_terms([clause]))
+    candidates = np.arange(len(rows))
+    matches = np.zeros(len(rows), dtype=np.int64)
+    for clause in sorted(clauses, key=rarest):
+        if not len(candidates):
+            break
+        keys = match_clause(index, clause, pairs, candidates)
+        clause_matches = np.bincount(keys >> POSITION_BITS, minlength=len(rows))
+        candidates = candidates[clause_matches[candidates] > 0]
+        matches += clause_matches
+    return rows[candidates], matches[candidates]
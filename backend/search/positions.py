@@ -0,0 +1,211 @@
+"""
+Positional index: term => documents => positions of the term in each document,
+compressed and memory-mapped, over the rows and columns of the SearchIndex.
+
+IDEA:
+- Every occurrence of a term is kept twice: its position (the number of tokens
+  before it, stop words included, so that consecutive words are consecutive
+  positions) and the byte offset of its first character in the document file.
+- Positions serve phrase matching, offsets let a snippet be read with a seek
+  instead of a scan of the text.
+- Both are delta-encoded per (term, document) pair, as variable-byte integers
+  (see postings.py), in one stream each. A pair costs its row and two offsets
+  into the streams; the pairs of a term are sorted by row, so finding a document
+  in them is a binary search.
+- Reading the first few positions of a pair decodes only their bytes, whatever
+  the number of occurrences in the document.
+"""
+import re
+from dataclasses import dataclass
+from functools import cached_property
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .postings import VARBYTE_MAX_BYTES, decode_varbyte, encode_varbyte
+from .storage import load_arrays, save_arrays
+
+POSITIONS_FORMAT = 1
+# CountVectorizer's default token_pattern, so that the tokens are those of the SearchIndex
+TOKEN_RE = re.compile(r"(?u)\b\w\w+\b")
+
+
+def tokenize_with_offsets(data: bytes) -> Tuple[List[str], np.ndarray]:
+    """The lowercase tokens of a UTF-8 document, and the byte offset of each one."""
+    text = data.decode("utf-8", errors="replace")
+    matches = list(TOKEN_RE.finditer(text))
+    tokens = [match.group().lower() for match in matches]
+    if len(text) == len(data): # ASCII: characters are bytes
+        return tokens, np.fromiter((match.start() for match in matches), dtype=np.int64, count=len(matches))
+
+    offsets = np.empty(len(matches), dtype=np.int64)
+    byte_offset, char_offset = 0, 0
+    for i, match in enumerate(matches):
+        byte_offset += len(text[char_offset:match.start()].encode("utf-8"))
+        char_offset = match.start()
+        offsets[i] = byte_offset
+    return tokens, offsets
+
+
+def ragged_take(data: np.ndarray, starts: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+    """data[starts[0]:starts[0] + lengths[0]], data[starts[1]:...], ... concatenated."""
+    total = int(lengths.sum())
+    if not total:
+        return data[:0]
+    new_starts = np.cumsum(lengths) - lengths
+    return data[np.repeat(starts - new_starts, lengths) + np.arange(total)]
+
+
+@dataclass
+class PositionalIndex:
+    doc_ids: np.ndarray # row => document id
+    term_pairs: np.ndarray # term id => its first pair; the last entry is the number of pairs
+    pair_rows: np.ndarray # pair => row of the document, increasing within a term
+    position_starts: np.ndarray # pair => start of its positions in `positions`; the last entry is len(positions)
+    offset_starts: np.ndarray # pair => start of its offsets in `offsets`; the last entry is len(offsets)
+    positions: np.ndarray # gaps between positions, encoded
+    offsets: np.ndarray # gaps between byte offsets, encoded
+    version: str # fingerprint of the corpus, as for SearchIndex
+
+    @classmethod
+    def build(cls, paths: List[str], doc_ids: np.ndarray, vocabulary: Dict[str, int], version: str) -> "PositionalIndex":
+        """Positions of the terms of `vocabulary` (term => term id) in the documents at `paths` (row order)."""
+        pair_terms: List[np.ndarray] = []
+        pair_rows: List[np.ndarray] = []
+        position_chunks: List[np.ndarray] = []
+        position_lengths: List[np.ndarray] = []
+        offset_chunks: List[np.ndarray] = []
+        offset_lengths: List[np.ndarray] = []
+        for row, path in enumerate(paths):
+            with open(path, "rb") as f:
+                tokens, byte_offsets = tokenize_with_offsets(f.read())
+            if not tokens:
+                continue
+            unique_tokens, inverse = np.unique(np.asarray(tokens), return_inverse=True)
+            token_terms = np.array([vocabulary.get(token, -1) for token in unique_tokens.tolist()], dtype=np.int64)[inverse]
+            positions = np.flatnonzero(token_terms >= 0)
+            order = np.argsort(token_terms[positions], kind="stable") # by term, then position
+            terms, positions = token_terms[positions][order], positions[order]
+            if not len(terms):
+                continue
+
+            first = np.r_[True, terms[1:] != terms[:-1]]
+            pair_starts = np.flatnonzero(first)
+            for values, chunks, lengths in ((positions, position_chunks, position_lengths), (byte_offsets[positions], offset_chunks, offset_lengths)):
+                gaps = np.diff(values, prepend=0)
+                gaps[first] = values[first]
+                encoded, value_starts = encode_varbyte(gaps)
+                chunks.append(encoded)
+                lengths.append(np.diff(np.r_[value_starts[pair_starts], len(encoded)]))
+            pair_terms.append(terms[pair_starts])
+            pair_rows.append(np.full(len(pair_starts), row, dtype=np.int64))
+
+        # Pairs are in row order: a stable sort by term makes them term-major, by row within a term
+        terms = np.concatenate(pair_terms) if pair_terms else np.empty(0, dtype=np.int64)
+        order = np.argsort(terms, kind="stable")
+        term_pairs = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(terms, minlength=len(vocabulary)), out=term_pairs[1:])
+
+        def reorder(chunks: List[np.ndarray], lengths: List[np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+            data = np.concatenate(chunks) if chunks else np.empty(0, dtype=np.uint8)
+            lengths = np.concatenate(lengths).astype(np.int64) if lengths else np.empty(0, dtype=np.int64)
+            starts = np.cumsum(lengths) - lengths
+            data = ragged_take(data, starts[order], lengths[order])
+            # 32-bit starts while the stream is small enough: they are most of the index for short documents
+            starts_type = np.uint32 if len(data) < 2**32 else np.int64
+            return np.r_[0, np.cumsum(lengths[order])].astype(starts_type), data
+
+        position_starts, positions = reorder(position_chunks, position_lengths)
+        offset_starts, offsets = reorder(offset_chunks, offset_lengths)
+        return cls(
+            doc_ids=np.asarray(doc_ids, dtype=str),
+            term_pairs=term_pairs,
+            pair_rows=(np.concatenate(pair_rows)[order] if pair_rows else np.empty(0, dtype=np.int64)).astype(np.int32),
+            position_starts=position_starts,
+            offset_starts=offset_starts,
+            positions=positions,
+            offsets=offsets,
+            version=version,
+        )
+
+    def save(self, positions_dir: str):
+        save_arrays(positions_dir, {
+            "doc_ids": self.doc_ids,
+            "term_pairs": self.term_pairs,
+            "pair_rows": self.pair_rows,
+            "position_starts": self.position_starts,
+            "offset_starts": self.offset_starts,
+            "positions": self.positions,
+            "offsets": self.offsets,
+        }, {"format": POSITIONS_FORMAT, "fingerprint": self.version})
+
+    @classmethod
+    def load(cls, positions_dir: str) -> Optional["PositionalIndex"]:
+        saved = load_arrays(positions_dir, POSITIONS_FORMAT)
+        if saved is None:
+            return None
+        manifest, map_array = saved
+        # Plain ndarray views of the maps, as for the PostingsIndex
+        return cls(
+            *(np.asarray(map_array(name)) for name in ("doc_ids", "term_pairs", "pair_rows", "position_starts", "offset_starts", "positions", "offsets")),
+            version=manifest["fingerprint"],
+        )
+
+    @cached_property
+    def rows(self) -> Dict[str, int]:
+        """document id => row"""
+        return {doc_id: row for row, doc_id in enumerate(self.doc_ids.tolist())}
+
+    def __len__(self) -> int:
+        return len(self.doc_ids)
+
+    def term_rows(self, term_id: int) -> np.ndarray:
+        """Rows of the documents containing `term_id`, increasing."""
+        return self.pair_rows[self.term_pairs[term_id]:self.term_pairs[term_id + 1]]
+
+    def pairs(self, term_id: int, rows: np.ndarray) -> np.ndarray:
+        """The pair of `term_id` and each of `rows`, or -1 where the document does not contain it."""
+        first = int(self.term_pairs[term_id])
+        term_rows = self.term_rows(term_id)
+        found = np.searchsorted(term_rows, rows)
+        found = np.minimum(found, max(len(term_rows) - 1, 0))
+        hit = term_rows[found] == rows if len(term_rows) else np.zeros(len(rows), dtype=bool)
+        return np.where(hit, first + found, -1)
+
+    def decode(self, data: np.ndarray, starts: np.ndarray, pair: int, limit: Optional[int]) -> np.ndarray:
+        start, end = int(starts[pair]), int(starts[pair + 1])
+        if limit is not None:
+            # The first `limit` integers are within their first `limit` × VARBYTE_MAX_BYTES bytes
+            end = min(end, start + limit * VARBYTE_MAX_BYTES)
+        # An integer cut at `end` comes after the first `limit`, and is dropped
+        return np.cumsum(decode_varbyte(data[start:end]).astype(np.int64)[:limit])
+
+    def positions_of(self, pair: int, limit: Optional[int] = None) -> np.ndarray:
+        """Positions (token numbers) of the pair's term in its document, increasing; the first `limit` only."""
+        return self.decode(self.positions, self.position_starts, pair, limit)
+
+    def offsets_of(self, pair: int, limit: Optional[int] = None) -> np.ndarray:
+        """Byte offsets of the pair's term in its document file, increasing; the first `limit` only."""
+        return self.decode(self.offsets, self.offset_starts, pair, limit)
+
+    def positions_of_pairs(self, pairs: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Positions of all of `pairs` at once, pair after pair, and the index in
+        `pairs` of each: one decode for any number of documents.
+        """
+        pairs = np.asarray(pairs, dtype=np.int64)
+        starts = self.position_starts[pairs].astype(np.int64)
+        lengths = self.position_starts[pairs + 1].astype(np.int64) - starts
+        data = ragged_take(self.positions, starts, lengths)
+        gaps = decode_varbyte(data).astype(np.int64)
+        # A pair has as many integers as bytes ending one
+        ends_integer = (data & 0x80) != 0
+        counts = np.bincount(np.repeat(np.arange(len(pairs)), lengths)[ends_integer], minlength=len(pairs))
+
+        # Cumulative sums restarting at every pair (its first gap is its first position)
+        positions = np.cumsum(gaps)
+        firsts = np.cumsum(counts) - counts
+        before = np.zeros(len(pairs), dtype=np.int64)
+        before[firsts > 0] = positions[firsts[firsts > 0] - 1]
+        positions -= np.repeat(before, counts)
+        return positions, np.repeat(np.arange(len(pairs)), counts)
@@ -0,0 +1,304 @@
+"""
+Compressed, memory-mapped postings: an alternative to the CSC matrix of the
+SearchIndex for term lookups.
+
+IDEA:
+- The postings of a term (rows of the documents containing it, and how many
+  times) are cut in blocks of BLOCK_SIZE. A block is the gaps between its rows,
+  then their counts, as variable-byte integers (7 bits per byte, the high bit
+  marks the last byte of an integer). Most gaps and counts fit in one byte.
+- Skip pointers: the last row and byte offset of every block, so that a lookup
+  starting at some row only decodes the blocks that may contain it.
+- The term dictionary is the sorted terms, with the first block of each term.
+- Only raw counts are stored. TF-IDF is count × idf[term] / norm[row], exactly
+  as TfidfTransformer computes it, with one idf per term and one norm per row.
+- Every block also keeps its largest count, largest count / norm and shortest
+  document, from which scorers bound the score of any posting in the block.
+- Everything is one .npy per array (see storage.py), memory-mapped, and decoded
+  on demand, a term at a time, with vectorized numpy operations.
+"""
+from dataclasses import dataclass
+from functools import cached_property
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from scipy import sparse
+
+from .storage import load_arrays, save_arrays
+from .vocabulary import VocabularyIndex
+
+POSTINGS_FORMAT = 2
+BLOCK_SIZE = 128 # postings per block
+VARBYTE_MAX_BYTES = 5 # enough for 32-bit integers
+
+
+def encode_varbyte(values: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Variable-byte encoding of the non-negative `values` (< 2**32).
+    Returns (bytes as uint8, starting byte of every value).
+    """
+    values = np.asarray(values, dtype=np.uint64)
+    n_bytes = np.ones(len(values), dtype=np.int64)
+    for k in range(1, VARBYTE_MAX_BYTES):
+        n_bytes += values >= (1 << (7 * k))
+    starts = np.zeros(len(values) + 1, dtype=np.int64)
+    np.cumsum(n_bytes, out=starts[1:])
+
+    encoded = np.zeros(starts[-1], dtype=np.uint8)
+    for k in range(VARBYTE_MAX_BYTES):
+        has_byte = n_bytes > k
+        if not has_byte.any():
+            break
+        encoded[starts[:-1][has_byte] + k] = (values[has_byte] >> np.uint64(7 * k)) & np.uint64(0x7F)
+    encoded[starts[1:] - 1] |= 0x80
+    return encoded, starts
+
+
+def decode_varbyte(encoded: np.ndarray) -> np.ndarray:
+    """The integers encoded in `encoded` (as written by encode_varbyte)."""
+    encoded = np.asarray(encoded, dtype=np.uint8)
+    last = (encoded & 0x80) != 0
+    payload = (encoded & 0x7F).astype(np.uint64)
+    if last.all(): # every integer in a single byte
+        return payload
+
+    value_ids = np.zeros(len(encoded), dtype=np.int64)
+    np.cumsum(last[:-1], out=value_ids[1:])
+    starts = np.flatnonzero(np.concatenate(([True], last[:-1])))
+    shifts = (np.arange(len(encoded)) - starts[value_ids]) * 7
+    payload <<= shifts.astype(np.uint64)
+    values = payload[starts]
+    for k in range(1, VARBYTE_MAX_BYTES):
+        # at most one byte per integer at each shift, so no index repeats
+        at_shift = shifts == 7 * k
+        if not at_shift.any():
+            break
+        values[value_ids[at_shift]] |= payload[at_shift]
+    return values
+
+
+@dataclass
+class PostingsIndex:
+    """
+    Term => postings, compressed, with the same lookups as the SearchIndex used by
+    basic and regex searches (terms, vocabulary, term_columns).
+    """
+    doc_ids: np.ndarray # row => document id
+    terms: np.ndarray # term id => term, sorted
+    vocabulary: Dict[str, int] # term => term id
+    idf: np.ndarray # term id => inverse document frequency
+    norms: np.ndarray # row => L2 norm of the document's counts × idf
+    lengths: np.ndarray # row => number of tokens of the document (in the vocabulary)
+    df: np.ndarray # term id => number of documents containing it
+    term_blocks: np.ndarray # term id => its first block; the last entry is the number of blocks
+    block_last_rows: np.ndarray # block => last row in the block (skip pointer)
+    block_offsets: np.ndarray # block => offset of the block in `data`; the last entry is len(data)
+    block_max_counts: np.ndarray # block => largest count in the block
+    block_max_weights: np.ndarray # block => largest count / norm in the block (TF-IDF without idf)
+    block_min_lengths: np.ndarray # block => shortest document in the block
+    data: np.ndarray # the encoded blocks, as bytes
+    version: str # fingerprint of the corpus, as for SearchIndex
+
+    @classmethod
+    def from_counts(cls, counts: sparse.csr_matrix, doc_ids: np.ndarray, terms: np.ndarray, idf: np.ndarray, version: str) -> "PostingsIndex":
+        """Postings of `counts` (row = document, col = term), all terms encoded at once."""
+        by_term = sparse.csc_matrix(counts)
+        by_term.sort_indices()
+        rows = by_term.indices.astype(np.int64)
+        postings_counts = by_term.data.astype(np.int64)
+        df = np.diff(by_term.indptr).astype(np.int64)
+        term_of_posting = np.repeat(np.arange(len(df)), df)
+        rank_in_term = np.arange(len(rows)) - by_term.indptr[:-1][term_of_posting]
+
+        # Blocks, in term order
+        blocks_per_term = -(-df // BLOCK_SIZE)
+        term_blocks = np.zeros(len(df) + 1, dtype=np.int64)
+        np.cumsum(blocks_per_term, out=term_blocks[1:])
+        block_of_posting = term_blocks[:-1][term_of_posting] + rank_in_term // BLOCK_SIZE
+        term_of_block = np.repeat(np.arange(len(df)), blocks_per_term)
+        rank_of_block = np.arange(term_blocks[-1]) - term_blocks[:-1][term_of_block]
+        block_first = by_term.indptr[:-1][term_of_block] + rank_of_block * BLOCK_SIZE # first posting of every block
+        block_sizes = np.minimum(df[term_of_block] - rank_of_block * BLOCK_SIZE, BLOCK_SIZE)
+
+        # Gap to the previous row of the same term (the first row of a term is stored as row + 1)
+        gaps = np.diff(rows, prepend=-1)
+        gaps[rank_in_term == 0] = rows[rank_in_term == 0] + 1
+
+        # Every block is [gaps..., counts...]
+        rank_in_block = np.arange(len(rows)) - block_first[block_of_posting]
+        values = np.empty(2 * len(rows), dtype=np.int64)
+        values[2 * block_first[block_of_posting] + rank_in_block] = gaps
+        values[2 * block_first[block_of_posting] + block_sizes[block_of_posting] + rank_in_block] = postings_counts
+        data, value_offsets = encode_varbyte(values)
+
+        # Squares summed one after the other in index order, as sklearn's normalize does,
+        # so that the weights are bit-identical (np.sum would add them pairwise)
+        weighted = sparse.csr_matrix(counts, dtype=np.float64)
+        weighted.data = weighted.data * np.asarray(idf)[weighted.indices]
+        squares = weighted.data ** 2
+        norms = np.zeros(weighted.shape[0])
+        for row in np.flatnonzero(np.diff(weighted.indptr)).tolist():
+            norms[row] = np.sqrt(np.cumsum(squares[weighted.indptr[row]:weighted.indptr[row + 1]])[-1])
+        lengths = np.asarray(counts.sum(axis=1)).ravel()
+
+        return cls(
+            doc_ids=np.asarray(doc_ids, dtype=str),
+            terms=np.asarray(terms, dtype=str),
+            vocabulary={term: term_id for term_id, term in enumerate(np.asarray(terms).tolist())},
+            idf=np.asarray(idf, dtype=np.float64),
+            norms=norms,
+            lengths=lengths.astype(np.uint32),
+            df=df.astype(np.uint32),
+            term_blocks=term_blocks,
+            block_last_rows=rows[block_first + block_sizes - 1].astype(np.uint32),
+            block_offsets=np.r_[value_offsets[2 * block_first], len(data)].astype(np.int64),
+            block_max_counts=np.maximum.reduceat(postings_counts, block_first).astype(np.uint32) if len(rows) else np.empty(0, dtype=np.uint32),
+            block_max_weights=np.maximum.reduceat(postings_counts / norms[rows], block_first) if len(rows) else np.empty(0),
+            block_min_lengths=np.minimum.reduceat(lengths[rows], block_first).astype(np.uint32) if len(rows) else np.empty(0, dtype=np.uint32),
+            data=data,
+            version=version,
+        )
+
+    def save(self, postings_dir: str):
+        save_arrays(postings_dir, {
+            "doc_ids": self.doc_ids,
+            "terms": self.terms,
+            "idf": self.idf,
+            "norms": self.norms,
+            "lengths": self.lengths,
+            "df": self.df,
+            "term_blocks": self.term_blocks,
+            "block_last_rows": self.block_last_rows,
+            "block_offsets": self.block_offsets,
+            "block_max_counts": self.block_max_counts,
+            "block_max_weights": self.block_max_weights,
+            "block_min_lengths": self.block_min_lengths,
+            "data": self.data,
+        }, {"format": POSTINGS_FORMAT, "fingerprint": self.version, "block_size": BLOCK_SIZE})
+
+    @classmethod
+    def load(cls, postings_dir: str) -> Optional["PostingsIndex"]:
+        saved = load_arrays(postings_dir, POSTINGS_FORMAT)
+        if saved is None or saved[0].get("block_size") != BLOCK_SIZE:
+            return None
+        manifest, map_array = saved
+
+        def load_array(name: str) -> np.ndarray:
+            # A plain ndarray view of the map: indexing an np.memmap costs more than decoding a small term
+            return np.asarray(map_array(name))
+
+        terms = load_array("terms")
+        return cls(
+            doc_ids=load_array("doc_ids"),
+            terms=terms,
+            vocabulary={term: term_id for term_id, term in enumerate(terms.tolist())},
+            idf=load_array("idf"),
+            norms=load_array("norms"),
+            lengths=load_array("lengths"),
+            df=load_array("df"),
+            term_blocks=load_array("term_blocks"),
+            block_last_rows=load_array("block_last_rows"),
+            block_offsets=load_array("block_offsets"),
+            block_max_counts=load_array("block_max_counts"),
+            block_max_weights=load_array("block_max_weights"),
+            block_min_lengths=load_array("block_min_lengths"),
+            data=load_array("data"),
+            version=manifest["fingerprint"],
+        )
+
+    @cached_property
+    def vocabulary_index(self) -> VocabularyIndex:
+        return VocabularyIndex(self.terms)
+
+    @cached_property
+    def average_length(self) -> float:
+        return float(self.lengths.mean()) if len(self.lengths) else 0.0
+
+    def __contains__(self, term: str) -> bool:
+        return term in self.vocabulary
+
+    def __len__(self) -> int:
+        return len(self.doc_ids)
+
+    def postings(self, term_id: int, min_row: int = 0) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        (rows, counts) of the documents containing `term_id`, by increasing row,
+        from `min_row` on: blocks that end before `min_row` are skipped undecoded.
+        """
+        first_block, end_block = int(self.term_blocks[term_id]), int(self.term_blocks[term_id + 1])
+        if min_row > 0:
+            first_block += int(np.searchsorted(self.block_last_rows[first_block:end_block], min_row))
+        rows, counts = self.decode_blocks(term_id, first_block, end_block)
+        if min_row > 0:
+            keep = rows >= min_row
+            rows, counts = rows[keep], counts[keep]
+        return rows, counts
+
+    def decode_blocks(self, term_id: int, first_block: int, end_block: int) -> Tuple[np.ndarray, np.ndarray]:
+        """(rows, counts) of the blocks [first_block, end_block) of `term_id`."""
+        if first_block == end_block:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+        values = decode_varbyte(self.data[self.block_offsets[first_block]:self.block_offsets[end_block]]).astype(np.int64)
+        base = int(self.block_last_rows[first_block - 1]) if first_block > self.term_blocks[term_id] else -1
+
+        if end_block - first_block == 1:
+            size = len(values) // 2
+            rows, counts = base + np.cumsum(values[:size]), values[size:]
+        else:
+            # Sizes of the blocks: all full but the term's last one
+            sizes = np.full(end_block - first_block, BLOCK_SIZE, dtype=np.int64)
+            if end_block == self.term_blocks[term_id + 1]:
+                sizes[-1] = int(self.df[term_id]) - (end_block - int(self.term_blocks[term_id]) - 1) * BLOCK_SIZE
+            pair_starts = np.repeat(2 * (np.cumsum(sizes) - sizes), 2 * sizes)
+            is_gap = np.arange(len(values)) - pair_starts < np.repeat(sizes, 2 * sizes)
+            rows, counts = base + np.cumsum(values[is_gap]), values[~is_gap]
+        return rows, counts
+
+    def blocks_of(self, term_id: int, rows: np.ndarray) -> np.ndarray:
+        """The block of `term_id` that would hold each of the sorted `rows`, or -1 past its last block."""
+        first_block, end_block = int(self.term_blocks[term_id]), int(self.term_blocks[term_id + 1])
+        blocks = first_block + np.searchsorted(self.block_last_rows[first_block:end_block], rows)
+        return np.where(blocks < end_block, blocks, -1)
+
+    def lookup(self, term_id: int, rows: np.ndarray) -> np.ndarray:
+        """
+        Counts of `term_id` in each of the sorted `rows` (0 if absent), decoding
+        only the blocks that may hold one of them.
+        """
+        blocks = self.blocks_of(term_id, rows)
+        needed = np.unique(blocks[blocks >= 0])
+        result = np.zeros(len(rows), dtype=np.int64)
+        if not len(needed):
+            return result
+
+        # Decode runs of consecutive blocks together
+        run_starts = needed[np.r_[True, np.diff(needed) > 1]]
+        run_ends = needed[np.r_[np.diff(needed) > 1, True]] + 1
+        decoded = [self.decode_blocks(term_id, int(start), int(end)) for start, end in zip(run_starts.tolist(), run_ends.tolist())]
+        term_rows = np.concatenate([term_rows for term_rows, _ in decoded])
+        term_counts = np.concatenate([term_counts for _, term_counts in decoded])
+
+        positions = np.minimum(np.searchsorted(term_rows, rows), len(term_rows) - 1)
+        found = term_rows[positions] == rows
+        result[found] = term_counts[positions[found]]
+        return result
+
+    def weights(self, term_id: int) -> Tuple[np.ndarray, np.ndarray]:
+        """(rows, TF-IDF) of the documents containing `term_id`, by increasing row."""
+        rows, counts = self.postings(term_id)
+        return rows, counts * self.idf[term_id] / self.norms[rows]
+
+    def term_columns(self, term_ids: List[int]) -> sparse.csc_matrix:
+        """TF-IDF of every document (row) for each of `term_ids` (col), as SearchIndex.term_columns."""
+        indptr = np.zeros(len(term_ids) + 1, dtype=np.int64)
+        rows: List[np.ndarray] = []
+        values: List[np.ndarray] = []
+        for i, term_id in enumerate(term_ids):
+            term_rows, term_values = self.weights(term_id)
+            rows.append(term_rows)
+            values.append(term_values)
+            indptr[i + 1] = indptr[i] + len(term_rows)
+        if not term_ids:
+            return sparse.csc_matrix((len(self), 0))
+        return sparse.csc_matrix((np.concatenate(values), np.concatenate(rows), indptr), shape=(len(self), len(term_ids)))
@@ -0,0 +1,194 @@
+"""
+Opt-in profiling of search requests: where the time (and memory) of a slow query
+went, captured in production and served to staff.
+
+IDEA:
+- With PROFILING off, `profiled(view)` is the view itself: no wrapper, no cost.
+- With it on, a PROFILE_SAMPLE_RATE fraction of requests are profiled with
+  cProfile, and so is every request carrying the PROFILE_HEADER header
+  (`X-Profile: memory` also takes tracemalloc snapshots, as does
+  PROFILE_MEMORY for sampled requests).
+- One request is profiled at a time (cProfile and tracemalloc are process-wide):
+  a request due for profiling while another one is runs unprofiled.
+- The PROFILE_KEEP slowest profiles are kept, in a min-heap on their duration, so a
+  new profile only replaces the fastest one kept.
+- A profile is served as pstats text, as collapsed stacks (one
+  `caller;callee;... microseconds` line per stack, for flame graph tools), as a
+  marshalled pstats dump (pstats.Stats / snakeviz), or as its top allocations.
+  cProfile only records caller => callee edges, so the time of a function called
+  from several stacks is split between them in proportion to their calls' time.
+"""
+import cProfile
+import heapq
+import io
+import itertools
+import marshal
+import pstats
+import random
+import threading
+import time
+import tracemalloc
+from dataclasses import dataclass, field
+from functools import wraps
+from typing import Dict, List, Optional, Set, Tuple
+
+PROFILING = False
+PROFILE_SAMPLE_RATE = 0.01 # of requests, when PROFILING is on
+PROFILE_HEADER = "X-Profile" # any value profiles the request; "memory" also traces allocations
+PROFILE_MEMORY = False # trace allocations of sampled requests too
+PROFILE_KEEP = 20 # slowest profiles kept
+PROFILE_STATS_LINES = 60 # functions listed in pstats output
+MEMORY_FRAMES = 10 # traceback depth of traced allocations
+MEMORY_TOP = 30 # allocation sites listed
+COLLAPSED_MAX_DEPTH = 64
+
+FunctionKey = Tuple[str, int, str] # (file, line, function), as in pstats
+
+
+@dataclass(order=True)
+class Profile:
+    seconds: float
+    id: int
+    label: str = field(compare=False) # method, path and the start of the body
+    started: float = field(compare=False) # unix time
+    stats: Dict = field(compare=False, repr=False) # pstats.Stats.stats
+    memory_peak: Optional[int] = field(default=None, compare=False) # bytes
+    memory_top: List[str] = field(default_factory=list, compare=False) # allocation sites, largest first
+
+    def summary(self) -> dict:
+        return {"id": self.id, "label": self.label, "seconds": round(self.seconds, 6), "started": self.started, "memory_peak": self.memory_peak}
+
+    def pstats(self, sort: str = "cumulative") -> str:
+        out = io.StringIO()
+        stats = pstats.Stats(stream=out)
+        stats.stats = self.stats
+        stats.get_top_level_stats()
+        stats.sort_stats(sort).print_stats(PROFILE_STATS_LINES)
+        return out.getvalue()
+
+    def dump(self) -> bytes:
+        return marshal.dumps(self.stats)
+
+    def collapsed(self) -> str:
+        return "\n".join(f"{stack} {microseconds}" for stack, microseconds in collapsed_stacks(self.stats).items()) + "\n"
+
+
+def function_name(key: FunctionKey) -> str:
+    filename, line, name = key
+    if filename == "~": # built-in
+        return name
+    return f"{name} ({filename.rsplit('/', 1)[-1]}:{line})"
+
+
+def collapsed_stacks(stats: Dict) -> Dict[str, int]:
+    """Stack => self time in microseconds, rebuilt from the caller => callee edges of `stats`."""
+    callees: Dict[FunctionKey, List[Tuple[FunctionKey, float]]] = {}
+    for function, (_cc, _nc, _tt, _ct, callers) in stats.items():
+        for caller, (_ccc, _cnc, _ctt, edge_ct) in callers.items():
+            callees.setdefault(caller, []).append((function, edge_ct))
+    roots = [function for function, (*_, callers) in stats.items() if not callers]
+
+    stacks: Dict[str, int] = {}
+
+    def visit(function: FunctionKey, time_in: float, path: List[str], on_path: Set[FunctionKey]):
+        _cc, _nc, self_time, total_time, _callers = stats[function]
+        share = min(1.0, time_in / total_time) if total_time > 0 else 0.0
+        path = path + [function_name(function)]
+        microseconds = int(self_time * share * 1e6)
+        if microseconds:
+            stack = ";".join(path)
+            stacks[stack] = stacks.get(stack, 0) + microseconds
+        if len(path) >= COLLAPSED_MAX_DEPTH:
+            return
+        for callee, edge_time in callees.get(function, []):
+            if callee not in on_path and edge_time * share > 0:
+                visit(callee, edge_time * share, path, on_path | {callee})
+
+    for root in roots:
+        visit(root, stats[root][3], [], {root})
+    return stacks
+
+
+class ProfileStore:
+    """The PROFILE_KEEP slowest profiles."""
+
+    def __init__(self, keep: int = PROFILE_KEEP):
+        self.keep = keep
+        self._heap: List[Profile] = []
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def next_id(self) -> int:
+        return next(self._ids)
+
+    def add(self, profile: Profile):
+        with self._lock:
+            if len(self._heap) < self.keep:
+                heapq.heappush(self._heap, profile)
+            elif profile > self._heap[0]:
+                heapq.heapreplace(self._heap, profile)
+
+    def list(self) -> List[Profile]:
+        with self._lock:
+            return sorted(self._heap, reverse=True)
+
+    def get(self, profile_id: int) -> Optional[Profile]:
+        with self._lock:
+            return next((profile for profile in self._heap if profile.id == profile_id), None)
+
+    def clear(self):
+        with self._lock:
+            self._heap.clear()
+
+
+PROFILES = ProfileStore()
+_profiling_lock = threading.Lock() # one profiled request at a time
+
+
+def wants_profile(request) -> Tuple[bool, bool]:
+    """(profile, trace memory) for `request`."""
+    header = request.headers.get(PROFILE_HEADER)
+    if header is not None:
+        return True, header.strip().lower() == "memory"
+    if random.random() < PROFILE_SAMPLE_RATE:
+        return True, PROFILE_MEMORY
+    return False, False
+
+
+def profiled(view):
+    """`view`, profiled as set by the constants above; `view` itself when PROFILING is off."""
+    if not PROFILING:
+        return view
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        profile, memory = wants_profile(request)
+        if not profile or not _profiling_lock.acquire(blocking=False):
+            return view(request, *args, **kwargs)
+        try:
+            label = f"{request.method} {request.path} {request.body[:200].decode('utf-8', errors='replace')}"
+            memory = memory and not tracemalloc.is_tracing() # someone else's tracing is left alone
+            if memory:
+                tracemalloc.start(MEMORY_FRAMES)
+            profiler = cProfile.Profile()
+            started = time.time()
+            start = time.perf_counter()
+            profiler.enable()
+            try:
+                response = view(request, *args, **kwargs) # a JsonResponse, already serialized
+            finally:
+                profiler.disable()
+                seconds = time.perf_counter() - start
+                memory_peak, memory_top = None, []
+                if memory:
+                    memory_peak = tracemalloc.get_traced_memory()[1]
+                    top = tracemalloc.take_snapshot().statistics("traceback")[:MEMORY_TOP]
+                    memory_top = [f"{stat.size} B in {stat.count} blocks\n" + "\n".join(stat.traceback.format(most_recent_first=True)) for stat in top]
+                    tracemalloc.stop()
+            stats = pstats.Stats(profiler).stats
+            PROFILES.add(Profile(seconds, PROFILES.next_id(), label, started, stats, memory_peak, memory_top))
+            return response
+        finally:
+            _profiling_lock.release()
+
+    return wrapper
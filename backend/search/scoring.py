@@ -0,0 +1,135 @@
+"""
+Top-k documents for a set of query terms by a summed per-term score (BM25, or
+TF-IDF as in the SearchIndex), over the compressed postings, with block-max
+MaxScore pruning.
+
+IDEA:
+- Every block of postings has an upper bound on the score of its postings, from
+  its largest count (and shortest document, for BM25). A term's bound is the
+  largest of its blocks'.
+- Terms are scored one at a time, highest bound first, into a small set of
+  candidate documents. After each term, the k-th best candidate score (θ) can
+  only grow, so it is a lower bound of the final k-th best score.
+- Once the bounds of the remaining terms add up to less than θ, a document that
+  is not a candidate yet cannot make the top k: the remaining terms are only
+  looked up for the candidates (MaxScore), decoding only the blocks holding one.
+- Before each lookup, candidates whose score plus the bound of the block they
+  would fall in plus the bounds of the later terms is below θ are dropped
+  (block-max). Documents are never dropped unless they score strictly below θ,
+  so the top k is exactly that of scoring everything.
+- Only arrays of the postings touched are allocated, never one per document of
+  the corpus, so latency follows the postings decoded rather than corpus size.
+"""
+import math
+from dataclasses import dataclass
+from typing import List, Tuple
+
+import numpy as np
+
+from .postings import PostingsIndex
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Bounds are inflated by this much so that rounding never makes them too tight
+BOUND_SLACK = 1e-9
+
+
+class TfidfScorer:
+    """count × idf / norm: the SearchIndex weights, summed over the query terms."""
+
+    def scores(self, index: PostingsIndex, term_id: int, rows: np.ndarray, counts: np.ndarray) -> np.ndarray:
+        return counts * index.idf[term_id] / index.norms[rows]
+
+    def block_bounds(self, index: PostingsIndex, term_id: int) -> np.ndarray:
+        blocks = slice(int(index.term_blocks[term_id]), int(index.term_blocks[term_id + 1]))
+        return index.block_max_weights[blocks] * index.idf[term_id] * (1 + BOUND_SLACK)
+
+
+@dataclass
+class BM25Scorer:
+    """Okapi BM25, with the (always positive) idf of Lucene."""
+    k1: float = BM25_K1
+    b: float = BM25_B
+
+    def idf(self, index: PostingsIndex, term_id: int) -> float:
+        df = int(index.df[term_id])
+        return math.log(1 + (len(index) - df + 0.5) / (df + 0.5))
+
+    def bm25(self, index: PostingsIndex, idf: float, counts: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+        average_length = index.average_length
+        return idf * counts * (self.k1 + 1) / (counts + self.k1 * (1 - self.b + self.b * lengths / average_length))
+
+    def scores(self, index: PostingsIndex, term_id: int, rows: np.ndarray, counts: np.ndarray) -> np.ndarray:
+        return self.bm25(index, self.idf(index, term_id), counts, index.lengths[rows])
+
+    def block_bounds(self, index: PostingsIndex, term_id: int) -> np.ndarray:
+        # BM25 grows with the count and shrinks with the document's length
+        blocks = slice(int(index.term_blocks[term_id]), int(index.term_blocks[term_id + 1]))
+        return self.bm25(index, self.idf(index, term_id), index.block_max_counts[blocks], index.block_min_lengths[blocks]) * (1 + BOUND_SLACK)
+
+
+@dataclass
+class ScoringStats:
+    blocks_decoded: int = 0
+    terms_scanned: int = 0 # every posting scored
+    terms_looked_up: int = 0 # only the candidates' postings scored
+
+
+def kth_largest(scores: np.ndarray, k: int) -> float:
+    if len(scores) < k:
+        return -math.inf
+    return float(np.partition(scores, len(scores) - k)[len(scores) - k])
+
+
+def merge_scores(rows: np.ndarray, scores: np.ndarray, new_rows: np.ndarray, new_scores: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Sum two sparse (sorted rows, scores) vectors."""
+    merged_rows, inverse = np.unique(np.concatenate((rows, new_rows)), return_inverse=True)
+    merged_scores = np.zeros(len(merged_rows))
+    np.add.at(merged_scores, inverse[:len(rows)], scores)
+    np.add.at(merged_scores, inverse[len(rows):], new_scores)
+    return merged_rows, merged_scores
+
+
+def top_k(index: PostingsIndex, term_ids: List[int], scorer, k: int, prune: bool = True, stats: ScoringStats = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    (rows, scores) of the `k` documents with the highest summed score for
+    `term_ids`, best first, ties broken by row. Documents matching no term are
+    never returned. With `prune` off, every posting of every term is scored.
+    """
+    stats = stats if stats is not None else ScoringStats()
+    term_ids = np.unique(np.asarray(term_ids, dtype=np.int64)).tolist()
+    block_bounds = {term_id: scorer.block_bounds(index, term_id) for term_id in term_ids}
+    term_bounds = {term_id: float(bounds.max()) if len(bounds) else 0.0 for term_id, bounds in block_bounds.items()}
+    term_ids.sort(key=lambda term_id: -term_bounds[term_id])
+    # remaining[i]: bound of the terms from the i-th on
+    remaining = np.r_[np.cumsum([term_bounds[term_id] for term_id in term_ids][::-1])[::-1], 0.0]
+
+    rows = np.empty(0, dtype=np.int64)
+    scores = np.empty(0)
+    threshold = -math.inf
+    for i, term_id in enumerate(term_ids):
+        if prune and remaining[i] < threshold:
+            # No new document can make the top k: only score the candidates
+            bounds = np.zeros(len(rows))
+            blocks = index.blocks_of(term_id, rows)
+            bounds[blocks >= 0] = block_bounds[term_id][blocks[blocks >= 0] - int(index.term_blocks[term_id])]
+            keep = scores + bounds + remaining[i + 1] >= threshold
+            rows, scores, blocks = rows[keep], scores[keep], blocks[keep]
+            counts = index.lookup(term_id, rows)
+            found = counts > 0
+            scores[found] += scorer.scores(index, term_id, rows[found], counts[found])
+            stats.terms_looked_up += 1
+            stats.blocks_decoded += len(np.unique(blocks[blocks >= 0]))
+        else:
+            term_rows, term_counts = index.postings(term_id)
+            rows, scores = merge_scores(rows, scores, term_rows, scorer.scores(index, term_id, term_rows, term_counts))
+            stats.terms_scanned += 1
+            stats.blocks_decoded += len(block_bounds[term_id])
+
+        if prune:
+            threshold = kth_largest(scores, k)
+            keep = scores + remaining[i + 1] >= threshold
+            rows, scores = rows[keep], scores[keep]
+
+    order = np.lexsort((rows, -scores))[:k]
+    return rows[order], scores[order]
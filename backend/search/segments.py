@@ -0,0 +1,237 @@
+"""
+Log-structured store of raw term counts, so that documents added to (or removed
+from) the documents directory can be indexed without refitting the whole corpus.
+
+IDEA:
+- Every ingestion tokenizes only the new or changed documents into a segment:
+  a sparse count matrix (row = document, col = term) with its own vocabulary.
+- The manifest maps every live document to the segment holding it. Removing or
+  replacing a document only updates the manifest; its old row becomes dead.
+- The TF-IDF index is compiled from the sum of all segments, so IDF statistics
+  are always those of the full corpus.
+- Small segments are merged in the background once there are too many of them,
+  dropping dead rows on the way (like an LSM tree compaction).
+"""
+import os
+import json
+import glob
+import shutil
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from scipy import sparse
+import numpy as np
+
+try:
+    import fcntl
+except ImportError: # Windows: only threads of the same process are kept apart
+    fcntl = None
+
+SEGMENTS_MANIFEST = "segments.json"
+SEGMENTS_LOCK = ".lock"
+
+# Merge the smallest segments together once there are more than this many
+MERGE_FACTOR = 4
+
+_thread_lock = threading.Lock()
+
+
+@dataclass
+class Segment:
+    name: str
+    doc_ids: np.ndarray # row => document id
+    terms: np.ndarray # col => term, sorted
+    counts: sparse.csr_matrix # row = document, col = term, raw occurrence counts
+
+    def save(self, segment_dir: str):
+        # Left over if a merge was interrupted before its manifest was written
+        shutil.rmtree(segment_dir, ignore_errors=True)
+        os.makedirs(segment_dir)
+        np.save(os.path.join(segment_dir, "doc_ids.npy"), self.doc_ids)
+        np.save(os.path.join(segment_dir, "terms.npy"), self.terms)
+        np.save(os.path.join(segment_dir, "data.npy"), self.counts.data)
+        np.save(os.path.join(segment_dir, "indices.npy"), self.counts.indices)
+        np.save(os.path.join(segment_dir, "indptr.npy"), self.counts.indptr)
+
+    @classmethod
+    def load(cls, name: str, segment_dir: str) -> "Segment":
+        def load_array(array_name: str) -> np.ndarray:
+            return np.load(os.path.join(segment_dir, f"{array_name}.npy"), mmap_mode="r")
+
+        doc_ids, terms = load_array("doc_ids"), load_array("terms")
+        counts = sparse.csr_matrix((load_array("data"), load_array("indices"), load_array("indptr")), shape=(len(doc_ids), len(terms)), copy=False)
+        return cls(name, doc_ids, terms, counts)
+
+
+@dataclass
+class IngestReport:
+    added: List[str] # document ids tokenized into a new segment (new or changed)
+    removed: List[str] # document ids no longer in the documents directory
+    segment: Optional[str] # name of the new segment, if any
+
+    def __str__(self) -> str:
+        return f"{len(self.added)} added, {len(self.removed)} removed" + (f", new segment {self.segment}" if self.segment else "")
+
+
+def merge_segments(segments: List[Segment], live: Dict[str, str]) -> Tuple[sparse.csr_matrix, np.ndarray, np.ndarray]:
+    """
+    Stack the live rows of `segments` over the union of their vocabularies.
+    `live` maps each live document id to the name of the segment holding it.
+    Returns (counts, doc_ids, terms), with terms sorted.
+    """
+    if not segments:
+        return sparse.csr_matrix((0, 0), dtype=np.int32), np.empty(0, dtype=str), np.empty(0, dtype=str)
+
+    terms = segments[0].terms
+    for segment in segments[1:]:
+        terms = np.union1d(terms, segment.terms)
+
+    blocks: List[sparse.csr_matrix] = []
+    doc_ids: List[np.ndarray] = []
+    for segment in segments:
+        rows = np.flatnonzero([live.get(doc_id) == segment.name for doc_id in segment.doc_ids.tolist()])
+        if not len(rows):
+            continue
+        counts = segment.counts[rows]
+        # Renumber the segment's columns into the merged vocabulary
+        columns = np.searchsorted(terms, segment.terms)
+        blocks.append(sparse.csr_matrix((counts.data, columns[counts.indices], counts.indptr), shape=(len(rows), len(terms))))
+        doc_ids.append(segment.doc_ids[rows])
+
+    if not blocks:
+        return sparse.csr_matrix((0, len(terms)), dtype=np.int32), np.empty(0, dtype=str), terms
+    counts = sparse.vstack(blocks, format="csr")
+    counts.sort_indices()
+    return counts, np.concatenate(doc_ids), terms
+
+
+class SegmentStore:
+    """
+    Segments and manifest under `root`:
+
+        root/segments.json   {"segments": [name, ...], "next_segment": int,
+                              "documents": {doc_id: {"segment", "size", "mtime_ns"}}}
+        root/<name>/*.npy    one directory per segment
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+
+    @contextmanager
+    def locked(self):
+        """Exclusive access to the store, across threads and (where supported) processes."""
+        os.makedirs(self.root, exist_ok=True)
+        with _thread_lock, open(os.path.join(self.root, SEGMENTS_LOCK), "w") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            yield
+
+    def read_manifest(self) -> dict:
+        try:
+            with open(os.path.join(self.root, SEGMENTS_MANIFEST), encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {"segments": [], "next_segment": 0, "documents": {}}
+
+    def write_manifest(self, manifest: dict):
+        path = os.path.join(self.root, SEGMENTS_MANIFEST)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+        os.replace(path + ".tmp", path)
+
+    def segments(self, manifest: dict) -> List[Segment]:
+        return [Segment.load(name, os.path.join(self.root, name)) for name in manifest["segments"]]
+
+    def ingest(self, documents_dir: str) -> IngestReport:
+        """
+        Tokenize the documents that are new or changed since the last ingestion
+        into a new segment, and forget the ones that were deleted.
+        """
+        with self.locked():
+            manifest = self.read_manifest()
+            documents: Dict[str, dict] = manifest["documents"]
+
+            on_disk: Dict[str, Tuple[str, os.stat_result]] = {}
+            for path in glob.glob(f"{documents_dir}/*.txt"):
+                on_disk[Path(path).stem] = (path, os.stat(path))
+
+            removed = [doc_id for doc_id in documents if doc_id not in on_disk]
+            added = [
+                doc_id for doc_id, (_path, stat) in on_disk.items()
+                if doc_id not in documents
+                or documents[doc_id]["size"] != stat.st_size
+                or documents[doc_id]["mtime_ns"] != stat.st_mtime_ns
+            ]
+            for doc_id in removed:
+                del documents[doc_id]
+
+            segment_name = None
+            if added:
+                print(f"Tokenizing {len(added)} documents...")
+                from sklearn.feature_extraction.text import CountVectorizer # slow to import: only when tokenizing
+
+                vectorizer = CountVectorizer(input='filename', stop_words='english', dtype=np.int32)
+                counts = vectorizer.fit_transform([on_disk[doc_id][0] for doc_id in added])
+
+                segment_name = f"{manifest['next_segment']:06d}"
+                manifest["next_segment"] += 1
+                segment = Segment(segment_name, np.asarray(added, dtype=str), np.asarray(vectorizer.get_feature_names_out(), dtype=str), counts)
+                segment.save(os.path.join(self.root, segment_name))
+                manifest["segments"].append(segment_name)
+
+                for doc_id in added:
+                    stat = on_disk[doc_id][1]
+                    documents[doc_id] = {"segment": segment_name, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+            if added or removed:
+                self.write_manifest(manifest)
+            return IngestReport(added, removed, segment_name)
+
+    def counts(self) -> Tuple[sparse.csr_matrix, np.ndarray, np.ndarray]:
+        """Raw counts of every live document: (counts, doc_ids, terms)."""
+        with self.locked():
+            manifest = self.read_manifest()
+            return merge_segments(self.segments(manifest), {doc_id: doc["segment"] for doc_id, doc in manifest["documents"].items()})
+
+    def merge(self, merge_factor: int = MERGE_FACTOR) -> Optional[str]:
+        """
+        If there are more than `merge_factor` segments, merge the smallest ones
+        into one so that `merge_factor` remain. Returns the new segment's name.
+        """
+        with self.locked():
+            manifest = self.read_manifest()
+            if len(manifest["segments"]) <= merge_factor:
+                return None
+
+            live = {doc_id: doc["segment"] for doc_id, doc in manifest["documents"].items()}
+            sizes = {name: 0 for name in manifest["segments"]}
+            for name in live.values():
+                sizes[name] += 1
+            smallest = sorted(manifest["segments"], key=lambda name: sizes[name])[:len(sizes) - merge_factor + 1]
+            # Keep segments in ingestion order so that document order stays stable
+            smallest = [name for name in manifest["segments"] if name in smallest]
+
+            print(f"Merging segments {smallest}...")
+            counts, doc_ids, terms = merge_segments([Segment.load(name, os.path.join(self.root, name)) for name in smallest], live)
+            merged_name = f"{manifest['next_segment']:06d}"
+            manifest["next_segment"] += 1
+            Segment(merged_name, doc_ids, terms, counts).save(os.path.join(self.root, merged_name))
+
+            position = manifest["segments"].index(smallest[0])
+            remaining = [name for name in manifest["segments"] if name not in smallest]
+            manifest["segments"] = remaining[:position] + [merged_name] + remaining[position:]
+            for doc_id in doc_ids.tolist():
+                manifest["documents"][doc_id]["segment"] = merged_name
+            self.write_manifest(manifest)
+
+            for name in smallest:
+                shutil.rmtree(os.path.join(self.root, name), ignore_errors=True)
+            return merged_name
+
+    def merge_in_background(self) -> threading.Thread:
+        thread = threading.Thread(target=self.merge, name="segment-merge", daemon=True)
+        thread.start()
+        return thread
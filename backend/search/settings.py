@@ -38,7 +38,8 @@ INSTALLED_APPS = [
     'django.contrib.messages',
     'django.contrib.staticfiles',
     'rest_framework',
-    'corsheaders'
+    'corsheaders',
+    'search',
 ]
 
 MIDDLEWARE = [
@@ -54,6 +55,8 @@ MIDDLEWARE = [
 ]
 
 CORS_ALLOW_ALL_ORIGINS = True
+# Read by the document reader, see get_document_text
+CORS_EXPOSE_HEADERS = ['Content-Range', 'ETag', 'X-Document-Size', 'X-Next-Offset']
 
 ROOT_URLCONF = 'search.urls'
 
@@ -0,0 +1,101 @@
+"""
+Highlighted snippets of a search hit, from the byte offsets of the positional
+index: only a few small windows of the document are read, never the whole text.
+
+IDEA:
+- Decode the offsets of the first SNIPPET_OFFSETS occurrences of up to
+  SNIPPET_TERMS of the query terms in the document.
+- Every occurrence is a candidate window of SNIPPET_BYTES around it. Windows
+  holding the most distinct query terms win, then the earliest; up to
+  SNIPPETS_PER_HIT non-overlapping ones are read, each with one seek.
+- Windows are cut to whole words (whitespace is never inside a UTF-8 character,
+  so they also decode cleanly), and the query terms in them are highlighted by
+  tokenizing the window alone.
+- The work per hit is bounded by these constants whatever the size of the book,
+  and it stops reading windows once SNIPPET_BUDGET_SECONDS have passed (after
+  the first one).
+"""
+import re
+import time
+from typing import Dict, List, Set
+
+import numpy as np
+
+from .positions import TOKEN_RE, PositionalIndex
+
+SNIPPETS_PER_HIT = 3
+SNIPPET_BYTES = 200
+SNIPPET_TERMS = 8 # query terms looked up per hit
+SNIPPET_OFFSETS = 64 # occurrences decoded per term
+SNIPPET_BUDGET_SECONDS = 0.002 # per hit
+
+WHITESPACE_RE = re.compile(rb"\s")
+WHITESPACE = (b" ", b"\n", b"\r", b"\t")
+
+Snippet = Dict # {"offset": byte offset of `text` in the document, "text": str, "highlights": [[start, end], ...] (characters of `text`)}
+
+
+def choose_windows(offsets: np.ndarray, terms: np.ndarray) -> List[int]:
+    """Start of the (at most SNIPPETS_PER_HIT) best windows over the sorted `offsets` of the query `terms`."""
+    lead = SNIPPET_BYTES // 4 # context before the first term of a window
+    ends = np.searchsorted(offsets, offsets + SNIPPET_BYTES - lead)
+    scores = np.array([len(set(terms[i:end].tolist())) for i, end in enumerate(ends.tolist())])
+    starts: List[int] = []
+    for i in np.lexsort((offsets, -scores)).tolist():
+        start = max(0, int(offsets[i]) - lead)
+        if all(abs(start - chosen) >= SNIPPET_BYTES for chosen in starts):
+            starts.append(start)
+            if len(starts) == SNIPPETS_PER_HIT:
+                break
+    return sorted(starts)
+
+
+def read_snippet(f, start: int, size: int, terms: Set[str]) -> Snippet:
+    f.seek(start)
+    data = f.read(min(SNIPPET_BYTES, size - start))
+    end = len(data)
+    if start + end < size:
+        # Back to the last whole word
+        last_space = max(data.rfind(space) for space in WHITESPACE)
+        end = last_space if last_space >= 0 else end
+    begin = 0
+    if start > 0:
+        first_space = WHITESPACE_RE.search(data)
+        begin = first_space.end() if first_space and first_space.end() <= end else 0
+    text = data[begin:end].decode("utf-8", errors="replace")
+    highlights = [[match.start(), match.end()] for match in TOKEN_RE.finditer(text) if match.group().lower() in terms]
+    return {"offset": start + begin, "text": text, "highlights": highlights}
+
+
+def snippets(positional_index: PositionalIndex, path: str, row: int, term_ids: List[int], highlighted: Set[str]) -> List[Snippet]:
+    """
+    Snippets of the document at `path` (`row` of the index) around its occurrences
+    of `term_ids` (the first SNIPPET_TERMS found are used, so put the best first),
+    in document order, with the words in `highlighted` highlighted.
+    """
+    deadline = time.perf_counter() + SNIPPET_BUDGET_SECONDS
+    row_array = np.array([row])
+    offsets: List[np.ndarray] = []
+    found_terms: List[np.ndarray] = []
+    for term_id in term_ids:
+        pair = int(positional_index.pairs(term_id, row_array)[0])
+        if pair < 0:
+            continue
+        term_offsets = positional_index.offsets_of(pair, SNIPPET_OFFSETS)
+        offsets.append(term_offsets)
+        found_terms.append(np.full(len(term_offsets), term_id))
+        if len(offsets) == SNIPPET_TERMS:
+            break
+    if not offsets:
+        return []
+
+    all_offsets = np.concatenate(offsets)
+    order = np.argsort(all_offsets, kind="stable")
+    result: List[Snippet] = []
+    with open(path, "rb") as f:
+        size = f.seek(0, 2)
+        for start in choose_windows(all_offsets[order], np.concatenate(found_terms)[order]):
+            if result and time.perf_counter() > deadline:
+                break
+            result.append(read_snippet(f, start, size, highlighted))
+    return result
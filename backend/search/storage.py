@@ -0,0 +1,60 @@
+"""
+Saving and memory-mapping the index artifacts: one .npy file per array, plus a
+JSON manifest, in a directory that is replaced as a whole.
+"""
+import os
+import json
+import time
+import shutil
+from typing import Callable, Dict, Optional, Tuple
+
+import numpy as np
+
+MANIFEST = "manifest.json"
+
+ArrayLoader = Callable[[str], np.ndarray]
+
+
+def save_arrays(directory: str, arrays: Dict[str, np.ndarray], manifest: dict):
+    """
+    Write `arrays` and `manifest` (plus its creation time) to `directory`.
+
+    Everything is written next to the old directory and swapped in with a rename,
+    so a process that has the old files mapped keeps a consistent view.
+    """
+    tmp_dir = directory.rstrip("/") + f".tmp-{os.getpid()}"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    for name, array in arrays.items():
+        np.save(os.path.join(tmp_dir, f"{name}.npy"), array)
+    with open(os.path.join(tmp_dir, MANIFEST), "w", encoding="utf-8") as f:
+        json.dump({**manifest, "created": time.strftime('%Y-%m-%d %H:%M:%S')}, f, indent=2)
+
+    old_dir = directory.rstrip("/") + f".old-{os.getpid()}"
+    if os.path.exists(directory):
+        os.replace(directory, old_dir)
+    os.replace(tmp_dir, directory)
+    shutil.rmtree(old_dir, ignore_errors=True)
+
+
+def load_arrays(directory: str, format: int) -> Optional[Tuple[dict, ArrayLoader]]:
+    """
+    The manifest of `directory` and a function mapping its arrays into memory,
+    or None if there is nothing saved there in this `format`.
+
+    Arrays are opened with mmap_mode="r": nothing is read until it is touched,
+    and every process mapping the same files shares their pages.
+    """
+    try:
+        with open(os.path.join(directory, MANIFEST), encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None
+    if manifest.get("format") != format:
+        return None
+
+    def load_array(name: str) -> np.ndarray:
+        return np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r")
+
+    return manifest, load_array
@@ -14,50 +14,317 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+import os
+import json
 import time
-from tracemalloc import start
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
 from django.contrib import admin
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.models import User
+from django.http import FileResponse, Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import condition, require_GET, require_POST
 from django.urls import include, path
 from rest_framework import routers, serializers, viewsets
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 
-from .business_logic import execute_search, SearchType, SearchRanking, fetch_document, get_recommendations_for_query
+# The views import business_logic (numpy, scipy) when first called: management
+# commands load this URLconf for their checks, and need none of it
+from .documents import RangeNotSatisfiable, align_to_characters, etag, iter_file, parse_offset, parse_range
+from .metrics import render, render_counters
+from .profiling import PROFILES, profiled
 
 
-@api_view(["POST"])
-def search(request):
+# Searches run in this pool, so that an async worker keeps serving requests meanwhile
+SEARCH_THREADS = 4 # per worker process
+SEARCH_EXECUTOR = ThreadPoolExecutor(max_workers=SEARCH_THREADS, thread_name_prefix="search")
+
+
+async def in_executor(fn, *args):
+    return await asyncio.get_running_loop().run_in_executor(SEARCH_EXECUTOR, fn, *args)
+
+
+def json_body(request):
+    """The JSON object posted, or None if the body is not one."""
+    try:
+        data = json.loads(request.body or b"{}")
+    except ValueError:
+        return None
+    return data if isinstance(data, dict) else None
+
+
+@csrf_exempt
+@require_POST
+async def search(request):
     """
     Perform a search query.
 
     Spec:
-    - Takes JSON: {"query": string, "type": "basic" | "regex"}, extra params optional and ignored if unknown
+    - Takes JSON: {"query": string, "type": "basic" | "regex" | "fulltext_regex" | "phrase"}, extra params optional and ignored if unknown
+    - A regex query that does not compile (as bytes too, for "fulltext_regex") answers 400
+    - "snippets": true adds highlighted snippets to every hit: [{"offset", "text", "highlights"}]
+    - "limit" and/or "cursor" (the "next_cursor" of the previous page) return one page,
+      {"results", "next_cursor", "total"}, instead of the list of all results
     """
-    start_time = time.time()
-    query = request.data["query"]
-    search_type = request.data.get("type", "basic")
-    ranking = request.data.get("ranking", "occurrences")
-    result = execute_search(query, SearchType(search_type), SearchRanking(ranking))
+    start_time = time.perf_counter()
+    data = json_body(request)
+    if data is None:
+        return JsonResponse({"error": "Expected a JSON object"}, status=400)
+    return await in_executor(search_response, request, data, start_time)
+
+
+@profiled
+def search_response(request, data, start_time):
+    """The response of `search`, in a SEARCH_EXECUTOR thread."""
+    from .business_logic import MAX_RESULTS, REQUEST_SECONDS, STAGE_SECONDS, SearchRanking, SearchType, check_query, execute_search, search_page
+
+    query = data["query"]
+    search_type = data.get("type", "basic")
+    ranking = data.get("ranking", "occurrences")
+    snippets = bool(data.get("snippets", False))
+    try:
+        check_query(query, SearchType(search_type))
+    except ValueError as e: # InvalidQuery, or an unknown type
+        return JsonResponse({"error": str(e)}, status=400)
+    if "limit" in data or "cursor" in data:
+        try:
+            result = search_page(query, SearchType(search_type), SearchRanking(ranking), int(data.get("limit", MAX_RESULTS)), data.get("cursor"), snippets)
+        except ValueError as e: # InvalidCursor, or a limit out of range
+            return JsonResponse({"error": str(e)}, status=400)
+    else:
+        result = execute_search(query, SearchType(search_type), SearchRanking(ranking), snippets)
     # print("execute_search result:", result)
-    print("Search took", time.time() - start_time, "seconds")
-    return Response(result)
 
-@api_view(["POST"])
-def recommendations(request):
+    with STAGE_SECONDS.time("serialize"):
+        response = JsonResponse(result, safe=False)
+    REQUEST_SECONDS.observe(time.perf_counter() - start_time, search_type, ranking)
+    return response
+
+
+@csrf_exempt
+@require_POST
+async def search_batch(request):
+    """
+    Perform many searches in one request.
+
+    Spec:
+    - Takes JSON: [{"query": string, "type": ..., "ranking": ...}, ...], at most BATCH_MAX_SEARCHES,
+      "type" and "ranking" as in /api/search (and with the same defaults)
+    - Returns: the results of every search, in order, each as /api/search returns them
+    - Basic searches are scored together, in one sparse matrix product (see execute_batch)
+    """
+    start_time = time.perf_counter()
+    try:
+        data = json.loads(request.body or b"null")
+    except ValueError:
+        data = None
+    if not isinstance(data, list):
+        return JsonResponse({"error": "Expected a JSON list of searches"}, status=400)
+    return await in_executor(search_batch_response, request, data, start_time)
+
+
+@profiled
+def search_batch_response(request, data, start_time):
+    """The response of `search_batch`, in a SEARCH_EXECUTOR thread."""
+    from .business_logic import BATCH_MAX_SEARCHES, BATCH_REQUEST_SECONDS, STAGE_SECONDS, SearchRanking, SearchType, check_query, execute_batch
+
+    if len(data) > BATCH_MAX_SEARCHES:
+        return JsonResponse({"error": f"At most {BATCH_MAX_SEARCHES} searches per batch"}, status=400)
+    searches = []
+    for i, item in enumerate(data):
+        if not isinstance(item, dict) or not isinstance(item.get("query"), str):
+            return JsonResponse({"error": f'Search {i}: expected {{"query": string, "type", "ranking"}}'}, status=400)
+        try:
+            search_type = SearchType(item.get("type", "basic"))
+            check_query(item["query"], search_type)
+            searches.append((item["query"], search_type, SearchRanking(item.get("ranking", "occurrences"))))
+        except ValueError as e: # InvalidQuery, or an unknown type or ranking
+            return JsonResponse({"error": f"Search {i}: {e}"}, status=400)
+    results = execute_batch(searches)
+
+    with STAGE_SECONDS.time("serialize"):
+        response = JsonResponse(results, safe=False)
+    BATCH_REQUEST_SECONDS.observe(time.perf_counter() - start_time)
+    return response
+
+
+@csrf_exempt
+@require_POST
+async def recommendations(request):
     """
     Recommend documents based on query similarity (Jaccard on token sets).
     Takes JSON: {"query": string}
     Returns: list of recommended documents
     """
-    query = request.data.get("query", "")
-    recs = get_recommendations_for_query(query)
-    return Response(recs)
+    data = json_body(request)
+    if data is None:
+        return JsonResponse({"error": "Expected a JSON object"}, status=400)
+    from .business_logic import get_recommendations_for_query
+
+    recs = await in_executor(get_recommendations_for_query, data.get("query", ""))
+    return JsonResponse(recs, safe=False)
+
+
+@require_GET
+async def similar(_request, doc_id):
+    """
+    Documents most similar to the given one ("more like this"), from the precomputed similarity graph.
+    Returns: list of documents, most similar first
+    """
+    from .business_logic import get_similar_documents
+
+    return JsonResponse(await in_executor(get_similar_documents, doc_id), safe=False)
+
 
 @api_view(["GET"])
-def get_document_text(_request, doc_id):
-    content = fetch_document(doc_id)
-    return Response(content)
+def cache_stats(_request):
+    """
+    Counters of the search result cache, for tuning its size and TTL.
+    Returns: {"backend", "entries", "hits", "misses", "evictions", "expirations", "invalidations"}
+    """
+    from .business_logic import RESULT_CACHE
+
+    return Response(RESULT_CACHE.stats())
+
+@require_GET
+def metrics(_request):
+    """
+    Latency histograms of the search path (per stage, per search and per request)
+    and the result cache counters of this worker, in the Prometheus text format.
+    """
+    from .business_logic import BATCH_REQUEST_SECONDS, BATCH_SECONDS, REQUEST_SECONDS, RESULT_CACHE, SEARCH_SECONDS, STAGE_SECONDS
+    from .vocabulary import EXPANSION_SECONDS
+
+    extra = render_counters("search_result_cache", RESULT_CACHE.stats(), "Search result cache counter (see GET /api/cache/stats).")
+    return HttpResponse(render([STAGE_SECONDS, SEARCH_SECONDS, REQUEST_SECONDS, BATCH_SECONDS, BATCH_REQUEST_SECONDS, EXPANSION_SECONDS], extra), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@require_GET
+def ready(_request):
+    """
+    Readiness of this worker, for load balancers and orchestrators: 200 once the
+    index and everything searches need are loaded (see start_warm_up), 503 until
+    then, or if loading failed.
+    Returns: {"ready", "stage", "error", "seconds"}
+    """
+    from .business_logic import readiness
+
+    status = readiness()
+    return JsonResponse(status, status=200 if status["ready"] else 503)
+
+
+@staff_member_required
+@require_GET
+def profiles(_request):
+    """
+    The slowest profiled searches (see profiling.py), slowest first.
+    Returns: [{"id", "label", "seconds", "started", "memory_peak"}]
+    """
+    return JsonResponse([profile.summary() for profile in PROFILES.list()], safe=False)
+
+
+@staff_member_required
+@require_GET
+def profile_detail(request, profile_id):
+    """
+    One profile, as `?format=`:
+    - pstats (default): the functions taking the most time, `&sort=` any pstats key (cumulative by default)
+    - collapsed: one "caller;callee;... microseconds" line per stack, for flame graph tools
+    - raw: marshalled pstats data, for pstats.Stats or snakeviz
+    - memory: peak traced memory and top allocation sites, if the profile traced memory
+    """
+    profile = PROFILES.get(profile_id)
+    if profile is None:
+        raise Http404(f"No profile {profile_id}")
+    output = request.GET.get("format", "pstats")
+    if output == "pstats":
+        return HttpResponse(profile.pstats(request.GET.get("sort", "cumulative")), content_type="text/plain; charset=utf-8")
+    if output == "collapsed":
+        return HttpResponse(profile.collapsed(), content_type="text/plain; charset=utf-8")
+    if output == "raw":
+        response = HttpResponse(profile.dump(), content_type="application/octet-stream")
+        response["Content-Disposition"] = f'attachment; filename="profile-{profile.id}.pstats"'
+        return response
+    if output == "memory":
+        return JsonResponse({"memory_peak": profile.memory_peak, "top": profile.memory_top})
+    return HttpResponse(f"Unknown format {output}", status=400, content_type="text/plain; charset=utf-8")
+
+
+def document_stat(doc_id):
+    from .business_logic import document_path
+
+    try:
+        return os.stat(document_path(doc_id))
+    except FileNotFoundError:
+        return None
+
+
+def document_etag(_request, doc_id):
+    stat = document_stat(doc_id)
+    return etag(stat) if stat else None
+
+
+def document_last_modified(_request, doc_id):
+    stat = document_stat(doc_id)
+    return datetime.fromtimestamp(stat.st_mtime, tz=timezone.utc) if stat else None
+
+
+@require_GET
+@condition(etag_func=document_etag, last_modified_func=document_last_modified)
+def get_document_text(request, doc_id):
+    """
+    Text of a document (text/plain, utf-8), streamed from its file, whole or in part:
+    - `Range: bytes=start-end` header: 206 with Content-Range, 416 past the end
+    - `?offset=&length=` or `?page=` (bytes, widened to whole characters): 200 with
+      X-Document-Size and X-Next-Offset (= X-Document-Size at the end)
+    ETag / Last-Modified are set, so If-None-Match / If-Modified-Since get a 304.
+    """
+    from .business_logic import document_path
+
+    stat = document_stat(doc_id)
+    if stat is None:
+        raise Http404(f"No document {doc_id}")
+    path = document_path(doc_id)
+    content_type = "text/plain; charset=utf-8"
+
+    range_header = request.headers.get("Range")
+    if_range = request.headers.get("If-Range")
+    if range_header and (if_range is None or if_range == etag(stat)):
+        try:
+            part = parse_range(range_header, stat.st_size)
+        except RangeNotSatisfiable:
+            response = HttpResponse(status=416, content_type=content_type)
+            response["Content-Range"] = f"bytes */{stat.st_size}"
+            return response
+        if part is not None:
+            response = StreamingHttpResponse(iter_file(path, part), status=206, content_type=content_type)
+            response["Content-Range"] = part.content_range()
+            response["Content-Length"] = str(part.length)
+            return with_document_headers(response)
+
+    if any(param in request.GET for param in ("offset", "length", "page")):
+        try:
+            part = parse_offset(request.GET.get("offset"), request.GET.get("length"), request.GET.get("page"), stat.st_size)
+        except ValueError as e:
+            return HttpResponse(f"Invalid offset: {e}", status=400, content_type=content_type)
+        part = align_to_characters(path, part)
+        response = StreamingHttpResponse(iter_file(path, part), content_type=content_type)
+        response["Content-Length"] = str(part.length)
+        response["X-Document-Size"] = str(part.size)
+        response["X-Next-Offset"] = str(part.end)
+        return with_document_headers(response)
+
+    return with_document_headers(FileResponse(open(path, "rb"), content_type=content_type))
+
+
+def with_document_headers(response):
+    response["Accept-Ranges"] = "bytes"
+    # Cached, but revalidated: unchanged documents cost a 304
+    response["Cache-Control"] = "no-cache"
+    return response
 
 
 # Serializers define the API representation.
@@ -80,7 +347,14 @@ router.register(r'users', UserViewSet)
 urlpatterns = [
     path('admin/', admin.site.urls),
     path("api/search", search),
+    path("api/search/batch", search_batch),
     path("api/recommend", recommendations),
+    path("api/similar/<int:doc_id>", similar),
+    path("api/cache/stats", cache_stats),
+    path("api/metrics", metrics),
+    path("api/health/ready", ready),
+    path("api/admin/profiles", profiles),
+    path("api/admin/profiles/<int:profile_id>", profile_detail),
     path("api/document_text/<int:doc_id>", get_document_text),
     path('', include(router.urls)),
 ]
@@ -0,0 +1,165 @@
+"""
+Regex expansion over the index vocabulary without trying every term.
+
+IDEA:
+- The vocabulary is a sorted array, so all terms sharing a prefix form one
+  contiguous slice that two binary searches find (a trie walk, flattened).
+- re.match anchors at the start of the term, so a literal prefix of the regex
+  (`comput` in `comput.*`) restricts the candidates to such a slice.
+- Other literals the regex requires (`tion` in `.*tion`) are looked up in a
+  trigram index: term ids containing every trigram of the literal.
+- Only the remaining candidates are run through the regex engine, and the term
+  ids matching each pattern are kept in a bounded LRU.
+- Patterns with nothing to prune on (`.*`, `[a-z]+`) still scan everything,
+  but under a time budget and a cap on the number of matching terms. A scan cut
+  short is reported as truncated and not cached: its result depends on how busy
+  the process was, so the next search tries again.
+- Every expansion is timed in EXPANSION_SECONDS, by outcome, which also counts
+  the truncated ones (GET /api/metrics).
+"""
+import math
+import re
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+try:
+    from re import _constants as sre_constants, _parser as sre_parse
+except ImportError: # Python < 3.11
+    import sre_constants, sre_parse
+
+from .cache import InProcessCache
+from .metrics import Histogram
+
+REGEX_CACHE_SIZE = 1024
+# Guards for patterns that cannot be pruned
+MAX_REGEX_TERMS = 10_000
+REGEX_SCAN_SECONDS = 0.25
+
+TRIGRAM = 3
+
+EXPANSION_SECONDS = Histogram("regex_expansion_seconds", "Time to expand a regex over the vocabulary, by outcome (complete, cached, term_cap, time_budget).", ["outcome"])
+
+
+def regex_literals(regex: str) -> Tuple[str, List[str]]:
+    """
+    Literal strings that every match of `regex` contains: (prefix, required),
+    where `prefix` starts the match (possibly "") and `required` lists the other
+    runs of consecutive literal characters in the top-level sequence. Anything
+    that is not obviously required is ignored.
+    """
+    parsed = sre_parse.parse(regex)
+    if parsed.state.flags & sre_constants.SRE_FLAG_IGNORECASE:
+        return "", []
+
+    runs: List[str] = []
+    run: List[str] = []
+    prefix: Optional[str] = None
+
+    def close_run():
+        nonlocal prefix
+        if prefix is None:
+            prefix = "".join(run)
+        if run:
+            runs.append("".join(run))
+        run.clear()
+
+    def walk(items):
+        for op, av in items:
+            if op is sre_constants.LITERAL:
+                run.append(chr(av))
+            elif op is sre_constants.AT:
+                continue # zero-width, does not separate characters
+            elif op is sre_constants.SUBPATTERN and not av[1] and not av[2]:
+                walk(av[3].data) # a group without flags matches exactly once
+            else:
+                close_run()
+
+    walk(parsed.data)
+    close_run()
+    if prefix:
+        runs.pop(0)
+    return prefix or "", runs
+
+
+class VocabularyIndex:
+    """Finds the ids of the terms of a sorted vocabulary matching a regex (with re.match)."""
+
+    def __init__(self, terms: np.ndarray):
+        self.terms = terms
+        self._trigrams: Optional[Dict[str, np.ndarray]] = None
+        self._matches = InProcessCache(max_entries=REGEX_CACHE_SIZE, ttl=math.inf) # complete scans only
+
+    def prefix_range(self, prefix: str) -> Tuple[int, int]:
+        """[start, end) of the terms starting with `prefix`."""
+        if not prefix:
+            return 0, len(self.terms)
+        start = int(np.searchsorted(self.terms, prefix, side="left"))
+        end = int(np.searchsorted(self.terms, prefix[:-1] + chr(ord(prefix[-1]) + 1), side="left"))
+        return start, end
+
+    def trigrams(self) -> Dict[str, np.ndarray]:
+        """trigram => sorted ids of the terms containing it, built on first use."""
+        if self._trigrams is None:
+            postings: Dict[str, List[int]] = defaultdict(list)
+            for term_id, term in enumerate(self.terms.tolist()):
+                for trigram in {term[i:i + TRIGRAM] for i in range(len(term) - TRIGRAM + 1)}:
+                    postings[trigram].append(term_id)
+            self._trigrams = {trigram: np.array(ids, dtype=np.int32) for trigram, ids in postings.items()}
+        return self._trigrams
+
+    def candidates(self, regex: str) -> np.ndarray:
+        """Sorted ids of the terms that may match `regex`: a superset of the matches."""
+        prefix, required = regex_literals(regex)
+        start, end = self.prefix_range(prefix)
+        candidates: Optional[np.ndarray] = None
+
+        for literal in required:
+            if len(literal) < TRIGRAM:
+                continue
+            trigrams = self.trigrams()
+            for i in range(len(literal) - TRIGRAM + 1):
+                ids = trigrams.get(literal[i:i + TRIGRAM], np.empty(0, dtype=np.int32))
+                ids = ids[(ids >= start) & (ids < end)]
+                candidates = ids if candidates is None else np.intersect1d(candidates, ids, assume_unique=True)
+                if not len(candidates):
+                    return candidates
+
+        return np.arange(start, end) if candidates is None else candidates
+
+    def match(self, regex: str) -> Tuple[np.ndarray, bool]:
+        """
+        (ids of the terms matching `regex`, truncated): truncated if a guard
+        stopped the scan, in which case the ids are only the first matches found.
+        """
+        start = time.perf_counter()
+        matches = self._matches.get(regex)
+        if matches is not None:
+            EXPANSION_SECONDS.observe(time.perf_counter() - start, "cached")
+            return matches, False
+
+        r = re.compile(regex)
+        candidates = self.candidates(regex)
+        terms = self.terms[candidates].tolist()
+        deadline = start + REGEX_SCAN_SECONDS
+
+        found: List[int] = []
+        outcome = "complete"
+        for i, term in enumerate(terms):
+            if r.match(term):
+                found.append(int(candidates[i]))
+                if len(found) >= MAX_REGEX_TERMS and i + 1 < len(terms):
+                    outcome = "term_cap"
+                    break
+            if i % 1024 == 1023 and time.perf_counter() > deadline:
+                outcome = "time_budget"
+                break
+
+        matches = np.array(found, dtype=np.int64)
+        matches.setflags(write=False) # shared through the cache
+        if outcome == "complete":
+            self._matches.set(regex, matches)
+        EXPANSION_SECONDS.observe(time.perf_counter() - start, outcome)
+        return matches, outcome != "complete"
@@ -14,3 +14,10 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'search.settings')
 
 application = get_wsgi_application()
+
+# Load the index in the background while the server starts accepting requests:
+# GET /api/health/ready answers 200 once it is loaded. Imported only once Django is set
+# up, like any application code
+from search.business_logic import start_warm_up
+
+start_warm_up()
@@ -0,0 +1,66 @@
+"""
+fixture_server.py
+Local stand-in for www.gutenberg.org, to run manual_scraper.py against fixture books:
+
+    python fixture_server.py --books ./documents --port 8001 [--latency-ms 50]
+    python manual_scraper.py --base-url http://localhost:8001 --docs /tmp/docs --meta /tmp/meta.json ...
+
+Serves, for every {id}.txt of --books:
+- /files/{id}/{id}-0.txt    the text, between Gutenberg START/END markers
+- /ebooks/{id}              an HTML page titled "Fixture Book {id}"
+Everything else is a 404, like the URL variants the scraper tries for missing books.
+"""
+
+import re
+import time
+import argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1" # keep-alive, so the scraper's sessions reuse connections
+    disable_nagle_algorithm = True # headers and body are separate writes
+    books_dir: Path
+    latency: float = 0.0
+
+    def do_GET(self):
+        time.sleep(self.latency)
+        text_match = re.fullmatch(r"/files/(\d+)/(\d+)-0\.txt", self.path)
+        page_match = re.fullmatch(r"/ebooks/(\d+)", self.path)
+        book_id = (text_match or page_match).group(1) if (text_match or page_match) else None
+        book_path = self.books_dir / f"{book_id}.txt" if book_id else None
+
+        if not book_path or not book_path.exists() or (text_match and text_match.group(1) != text_match.group(2)):
+            self.respond(404, b"Not Found", "text/plain")
+        elif text_match:
+            text = book_path.read_text(encoding="utf-8")
+            body = f"Header\n*** START OF THE PROJECT GUTENBERG EBOOK {book_id} ***\n{text}\n*** END OF THE PROJECT GUTENBERG EBOOK {book_id} ***\nFooter\n"
+            self.respond(200, body.encode("utf-8"), "text/plain; charset=utf-8")
+        else:
+            self.respond(200, f"<html><head><title>Fixture Book {book_id}</title></head></html>".encode("utf-8"), "text/html")
+
+    def respond(self, status: int, body: bytes, content_type: str):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+if __name__ == "__main__":
+    current_dir = Path(__file__).resolve().parent
+    parser = argparse.ArgumentParser(description="Serve fixture books like www.gutenberg.org.")
+    parser.add_argument("--books", type=Path, default=current_dir / "documents")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="delay added to every response")
+    args = parser.parse_args()
+
+    FixtureHandler.books_dir = args.books
+    FixtureHandler.latency = args.latency_ms / 1000
+    server = ThreadingHTTPServer(("localhost", args.port), FixtureHandler)
+    print(f"📡 Serving {len(list(args.books.glob('*.txt')))} fixture books on http://localhost:{args.port}")
+    server.serve_forever()
@@ -6,56 +6,267 @@ Requires:
 - documents_meta.json (technically not needed as id can be fetched using the id.txt path name of the books in documents folder)
 - ./documents/{id}.txt
 Outputs:
-- search_index.json
+- search_index/ (binary postings, see below)
+- search_index.json (optional, --json, for debugging)
+
+IDEA (map-reduce, so that memory stays bounded and the build scales with cores):
+- Map: the files are split into batches of about BATCH_BYTES of text. Each batch is
+  tokenized in a worker process, which writes its postings to disk as one run sorted by term.
+- Reduce: the runs are k-way merged (heapq) term by term into the postings file, at most
+  MAX_OPEN_RUNS at a time. Batches cover increasing document numbers, so ties on a term
+  are broken by batch to keep every posting list sorted by document.
+- Only one batch per worker and one record per run are in memory at any time.
+
+Output layout (all integers little-endian):
+- docs.json       document number => document id
+- postings.bin    per term, df × (document number: uint32, frequency: uint32)
+- terms.bin       per term, sorted: term length (uint16), term (utf-8), offset in postings.bin (uint64), df (uint32)
 """
 
+import os
 import json
+import heapq
+import shutil
+import struct
+import argparse
+import tempfile
 import re
+from bisect import bisect_left
 from pathlib import Path
-from collections import defaultdict, Counter
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from typing import BinaryIO, Dict, Iterator, List, Tuple
+
+BATCH_BYTES = 64 * 1024 * 1024 # text tokenized per task
+MAX_OPEN_RUNS = 64 # runs merged at once; more are merged in several passes
+
+POSTING = struct.Struct("<II") # document number, frequency
+TERM_LENGTH = struct.Struct("<H")
+TERM_ENTRY = struct.Struct("<QI") # offset in postings.bin, df
+
+TOKEN_RE = re.compile(r"[a-zA-Z]+")
+
+
+def tokenize(text: str) -> List[str]:
+    """Extract lowercase alphabetic tokens."""
+    return TOKEN_RE.findall(text.lower())
+
+
+def write_record(f: BinaryIO, term: bytes, postings: bytes, df: int):
+    """One run record: the term, its df and its postings (as written to postings.bin)."""
+    f.write(TERM_LENGTH.pack(len(term)))
+    f.write(term)
+    f.write(TERM_ENTRY.pack(0, df)) # same layout as the dictionary, offset unused
+    f.write(postings)
+
+
+def read_records(path: Path) -> Iterator[Tuple[bytes, int, bytes]]:
+    """(term, df, postings) of every record of the run at `path`, in order."""
+    with open(path, "rb") as f:
+        while True:
+            header = f.read(TERM_LENGTH.size)
+            if not header:
+                return
+            (length,) = TERM_LENGTH.unpack(header)
+            term = f.read(length)
+            _offset, df = TERM_ENTRY.unpack(f.read(TERM_ENTRY.size))
+            yield term, df, f.read(df * POSTING.size)
+
+
+def index_batch(batch: List[Tuple[int, str]], run_path: Path) -> Tuple[int, List[str]]:
+    """
+    Map step: tokenize the (document number, path) of `batch` and write their postings
+    to `run_path`, sorted by term. Returns (number of postings, messages).
+    """
+    postings: Dict[bytes, List[Tuple[int, int]]] = {}
+    messages = []
+    for doc_number, path in batch:
+        doc_id = Path(path).stem
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                counts = Counter(tokenize(f.read()))
+        except Exception as e:
+            messages.append(f"⚠️ Skipped {doc_id}: {e}")
+            continue
+        for word, freq in counts.items():
+            postings.setdefault(word.encode("utf-8"), []).append((doc_number, freq))
+        messages.append(f"✅ Indexed {doc_id} ({len(counts)} unique terms)")
+
+    with open(run_path, "wb") as f:
+        for term in sorted(postings):
+            term_postings = postings[term]
+            write_record(f, term, b"".join(POSTING.pack(*posting) for posting in term_postings), len(term_postings))
+    return sum(len(term_postings) for term_postings in postings.values()), messages
+
+
+def merge_runs(run_paths: List[Path]) -> Iterator[Tuple[bytes, int, List[bytes]]]:
+    """
+    Reduce step: (term, df, postings chunks) for every term of the runs, in term order.
+    `run_paths` must be in document order for the postings to come out sorted.
+    """
+    merged = heapq.merge(
+        *(((term, run, df, postings) for term, df, postings in read_records(path)) for run, path in enumerate(run_paths))
+    )
+    current, df, chunks = None, 0, []
+    for term, _run, term_df, postings in merged:
+        if term != current:
+            if current is not None:
+                yield current, df, chunks
+            current, df, chunks = term, 0, []
+        df += term_df
+        chunks.append(postings)
+    if current is not None:
+        yield current, df, chunks
+
 
 class FastIndexBuilder:
-    def __init__(self, docs_dir: Path, output_path: Path):
+    def __init__(self, docs_dir: Path, output_path: Path, workers: int = os.cpu_count() or 1, batch_bytes: int = BATCH_BYTES):
         self.docs_dir = docs_dir
-        self.output_path = output_path
-        self.inverted_index = defaultdict(dict)
+        self.output_path = output_path # directory
+        self.workers = workers
+        self.batch_bytes = batch_bytes
+        self.doc_ids: List[str] = []
+        self.n_terms = 0
 
-    def tokenize(self, text: str):
-        """Extract lowercase alphabetic tokens."""
-        return re.findall(r"[a-zA-Z]+", text.lower())
+    def batches(self, text_files: List[Path]) -> List[List[Tuple[int, str]]]:
+        """
+        Consecutive files, about `batch_bytes` of text per batch, or less so that
+        every worker gets a few batches of a small corpus.
+        """
+        sizes = [path.stat().st_size for path in text_files]
+        batch_bytes = min(self.batch_bytes, sum(sizes) // (4 * self.workers) + 1)
+        batches: List[List[Tuple[int, str]]] = [[]]
+        size = 0
+        for doc_number, path in enumerate(text_files):
+            if batches[-1] and size >= batch_bytes:
+                batches.append([])
+                size = 0
+            batches[-1].append((doc_number, str(path)))
+            size += sizes[doc_number]
+        return batches if batches[0] else []
 
     def build_index(self):
-        """Iterate over all .txt files and build the inverted index."""
-        text_files = list(self.docs_dir.glob("*.txt"))
+        """Tokenize every .txt file in parallel and merge their postings into the output directory."""
+        text_files = sorted(self.docs_dir.glob("*.txt"))
         print(f"📚 Found {len(text_files)} text files")
+        self.doc_ids = [path.stem for path in text_files]
+        batches = self.batches(text_files)
+
+        self.output_path.mkdir(parents=True, exist_ok=True)
+        runs_dir = Path(tempfile.mkdtemp(prefix="runs-", dir=self.output_path))
+        try:
+            run_paths = [runs_dir / f"{i:06d}.run" for i in range(len(batches))]
+            n_postings = 0
+            with ProcessPoolExecutor(max_workers=self.workers) as pool:
+                for run_postings, messages in pool.map(index_batch, batches, run_paths):
+                    n_postings += run_postings
+                    for message in messages:
+                        print(message)
+            print(f"🔀 Merging {len(run_paths)} runs ({n_postings} postings)")
 
-        for file_path in text_files:
-            doc_id = file_path.stem  # e.g., "1" from "1.txt"
-            try:
-                with open(file_path, "r", encoding="utf-8") as f:
-                    text = f.read()
-                counts = Counter(self.tokenize(text))
-                for word, freq in counts.items():
-                    self.inverted_index[word][doc_id] = freq
-                print(f"✅ Indexed {doc_id} ({len(counts)} unique terms)")
-            except Exception as e:
-                print(f"⚠️ Skipped {doc_id}: {e}")
+            # Merge passes until few enough runs are left to open at once
+            generation = 0
+            while len(run_paths) > MAX_OPEN_RUNS:
+                generation += 1
+                merged_paths = []
+                for i in range(0, len(run_paths), MAX_OPEN_RUNS):
+                    merged_path = runs_dir / f"{generation}-{i // MAX_OPEN_RUNS:06d}.run"
+                    with open(merged_path, "wb") as f:
+                        for term, df, chunks in merge_runs(run_paths[i:i + MAX_OPEN_RUNS]):
+                            write_record(f, term, b"".join(chunks), df)
+                    for path in run_paths[i:i + MAX_OPEN_RUNS]:
+                        path.unlink()
+                    merged_paths.append(merged_path)
+                run_paths = merged_paths
 
-        print(f"✅ Built inverted index with {len(self.inverted_index)} unique words.")
+            self.write_postings(run_paths)
+        finally:
+            shutil.rmtree(runs_dir, ignore_errors=True)
+
+        print(f"✅ Built inverted index with {self.n_terms} unique words.")
+
+    def write_postings(self, run_paths: List[Path]):
+        self.n_terms = 0
+        with open(self.output_path / "postings.bin", "wb") as postings_file, open(self.output_path / "terms.bin", "wb") as terms_file:
+            offset = 0
+            for term, df, chunks in merge_runs(run_paths):
+                for chunk in chunks:
+                    postings_file.write(chunk)
+                terms_file.write(TERM_LENGTH.pack(len(term)))
+                terms_file.write(term)
+                terms_file.write(TERM_ENTRY.pack(offset, df))
+                offset += df * POSTING.size
+                self.n_terms += 1
+        with open(self.output_path / "docs.json", "w", encoding="utf-8") as f:
+            json.dump(self.doc_ids, f)
 
     def save_index(self):
-        """Write index to JSON."""
-        with open(self.output_path, "w", encoding="utf-8") as f:
-            json.dump(self.inverted_index, f, ensure_ascii=False, indent=2)
+        """Postings are written by build_index already."""
         print(f"💾 Saved inverted index to {self.output_path}")
 
+    def save_json(self, json_path: Path):
+        """Write the index as JSON ({word: {doc_id: freq}}), one term at a time."""
+        index = PostingsReader(self.output_path)
+        with open(json_path, "w", encoding="utf-8") as f:
+            f.write("{")
+            for i, term in enumerate(index.terms):
+                f.write(("," if i else "") + f"\n  {json.dumps(term, ensure_ascii=False)}: {json.dumps(index[term])}")
+            f.write("\n}\n")
+        print(f"💾 Saved debug JSON index to {json_path}")
+
+
+class PostingsReader:
+    """Term lookups in an index written by FastIndexBuilder; postings are read on demand."""
+
+    def __init__(self, index_dir: Path):
+        self.index_dir = index_dir
+        with open(index_dir / "docs.json", encoding="utf-8") as f:
+            self.doc_ids: List[str] = json.load(f)
+        self.terms: List[str] = []
+        self.entries: List[Tuple[int, int]] = []
+        with open(index_dir / "terms.bin", "rb") as f:
+            data = f.read()
+        position = 0
+        while position < len(data):
+            (length,) = TERM_LENGTH.unpack_from(data, position)
+            position += TERM_LENGTH.size
+            self.terms.append(data[position:position + length].decode("utf-8"))
+            position += length
+            self.entries.append(TERM_ENTRY.unpack_from(data, position))
+            position += TERM_ENTRY.size
+
+    def __contains__(self, term: str) -> bool:
+        i = bisect_left(self.terms, term)
+        return i < len(self.terms) and self.terms[i] == term
+
+    def __getitem__(self, term: str) -> Dict[str, int]:
+        """doc_id => frequency of `term`"""
+        i = bisect_left(self.terms, term)
+        if i == len(self.terms) or self.terms[i] != term:
+            raise KeyError(term)
+        offset, df = self.entries[i]
+        with open(self.index_dir / "postings.bin", "rb") as f:
+            f.seek(offset)
+            data = f.read(df * POSTING.size)
+        return {self.doc_ids[doc_number]: freq for doc_number, freq in POSTING.iter_unpack(data)}
+
+    def __len__(self) -> int:
+        return len(self.terms)
+
 
 if __name__ == "__main__":
     current_dir = Path(__file__).resolve().parent
-    docs_dir = current_dir / "documents"
-    output_path = current_dir / "search_index.json"
+    parser = argparse.ArgumentParser(description="Build the inverted index of the downloaded books.")
+    parser.add_argument("--docs", type=Path, default=current_dir / "documents")
+    parser.add_argument("--output", type=Path, default=current_dir / "search_index")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--batch-mb", type=int, default=BATCH_BYTES // (1024 * 1024), help="text tokenized per task")
+    parser.add_argument("--json", type=Path, nargs="?", const=current_dir / "search_index.json", help="also write the index as JSON (debug)")
+    args = parser.parse_args()
 
-    builder = FastIndexBuilder(docs_dir, output_path)
+    builder = FastIndexBuilder(args.docs, args.output, workers=args.workers, batch_bytes=args.batch_mb * 1024 * 1024)
     builder.build_index()
     builder.save_index()
+    if args.json:
+        builder.save_json(args.json)
     print("✨ Done.")
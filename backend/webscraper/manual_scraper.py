@@ -1,16 +1,40 @@
 """
 fetch_gutenberg_book.py
-Fetch a single Project Gutenberg book and store:
+Fetch Project Gutenberg books and store:
 - Full text in ./documents/{id}.txt
-- Metadata in ./documents_meta.json
+- Metadata in ./documents_meta.jsonl (one JSON object per line, appended in batches)
+
+IDEA:
+- Books are fetched by a pool of worker threads (--workers), each with its own
+  requests.Session, so connections are kept alive and reused between books.
+- Requests to the same host are spaced by a token bucket (--rate per second),
+  whatever the number of workers.
+- Metadata is appended to a JSONL log in batches, instead of rewriting the whole
+  documents_meta.json for every book. The backend reads both files; --compact
+  folds the log into documents_meta.json.
+- A checkpoint (scrape_checkpoint.json) records the books done or failed, saved
+  after every metadata batch, so an interrupted run resumes where it stopped.
+- --base-url points the scraper at another server, e.g. fixture_server.py.
 """
 
 import requests
 import re
 import json
+import time
+import os
+import argparse
+import threading
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
 from pathlib import Path
+from typing import Dict, List, Optional
+from urllib.parse import urlparse
 import string
 
+GUTENBERG_URL = "https://www.gutenberg.org"
+WORKERS = 8
+RATE = 10.0 # requests per second per host
+METADATA_BATCH = 50 # books per metadata write
+
 # -------------------------------
 # Utilities
 # -------------------------------
@@ -50,11 +74,49 @@ def is_valid_plaintext(text: str) -> bool:
     return printable_ratio > 0.9 and alpha_ratio > 0.2
 
 
-def fetch_gutenberg_book(url: str) -> dict:
+class RateLimiter:
+    """Token bucket per host: at most `rate` requests per second, in bursts of up to `burst`."""
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = burst
+        self._buckets: Dict[str, List[float]] = {} # host => [tokens, last refill]
+        self._lock = threading.Lock()
+
+    def wait(self, url: str):
+        if self.rate <= 0:
+            return
+        host = urlparse(url).netloc
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                tokens, last = self._buckets.get(host, [self.burst, now])
+                tokens = min(self.burst, tokens + (now - last) * self.rate)
+                if tokens >= 1:
+                    self._buckets[host] = [tokens - 1, now]
+                    return
+                self._buckets[host] = [tokens, now]
+                delay = (1 - tokens) / self.rate
+            time.sleep(delay)
+
+
+_local = threading.local()
+
+
+def session() -> requests.Session:
+    """This thread's session, keeping its connections alive between books."""
+    if not hasattr(_local, "session"):
+        _local.session = requests.Session()
+    return _local.session
+
+
+def fetch_gutenberg_book(url: str, base_url: str = GUTENBERG_URL, http: Optional[requests.Session] = None, limiter: Optional[RateLimiter] = None) -> dict:
     """Download one book’s text and metadata from a Gutenberg URL."""
+    http = http or session()
+    limiter = limiter or RateLimiter(0)
     book_id = extract_id_from_url(url)
-    base = f"https://www.gutenberg.org/files/{book_id}/{book_id}"
-    alt_base = f"https://www.gutenberg.org/cache/epub/{book_id}/pg{book_id}"
+    base = f"{base_url}/files/{book_id}/{book_id}"
+    alt_base = f"{base_url}/cache/epub/{book_id}/pg{book_id}"
 
     variants = [
         f"{base}-0.txt", f"{base}.txt", f"{base}.txt.utf-8",
@@ -64,7 +126,8 @@ def fetch_gutenberg_book(url: str) -> dict:
     text = None
     for link in variants:
         try:
-            resp = requests.get(link, timeout=10)
+            limiter.wait(link)
+            resp = http.get(link, timeout=10)
             if resp.ok and len(resp.text) > 2000:
                 text = resp.text
                 print(f"✅ Found text at {link}")
@@ -82,12 +145,13 @@ def fetch_gutenberg_book(url: str) -> dict:
         raise RuntimeError(f"Book {book_id} seems non-text or binary — skipping.")
 
     # Fetch metadata page for title
-    meta_url = f"https://www.gutenberg.org/ebooks/{book_id}"
-    meta_resp = requests.get(meta_url, timeout=10)
+    meta_url = f"{base_url}/ebooks/{book_id}"
+    limiter.wait(meta_url)
+    meta_resp = http.get(meta_url, timeout=10)
     title_match = re.search(r"<title>(.*?)</title>", meta_resp.text, re.IGNORECASE | re.DOTALL)
     title = title_match.group(1).strip() if title_match else f"Book {book_id}"
 
-    cover_url = f"https://www.gutenberg.org/cache/epub/{book_id}/pg{book_id}.cover.medium.jpg"
+    cover_url = f"{base_url}/cache/epub/{book_id}/pg{book_id}.cover.medium.jpg"
     clean_text = clean_gutenberg_text(text)
 
     return {
@@ -98,32 +162,56 @@ def fetch_gutenberg_book(url: str) -> dict:
     }
 
 
+def metadata_record(book_data: dict) -> dict:
+    return {
+        "id": book_data["id"],
+        "title": book_data["title"],
+        "cover": book_data["cover"],
+        "text_path": f"documents/{book_data['id']}.txt"
+    }
+
+
+def append_metadata(records: List[dict], log_path: Path):
+    """Append metadata records to the JSONL log, one line each, in a single write."""
+    if not records:
+        return
+    with log_path.open("a", encoding="utf-8") as f:
+        f.write("".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records))
+        f.flush()
+        os.fsync(f.fileno())
+    print(f"📝 Appended {len(records)} books to {log_path.name}")
+
 
-def append_metadata(book_data: dict, meta_path: Path):
-    """Append metadata to documents_meta.json, creating if missing."""
-    data = []
+def read_metadata(meta_path: Path, log_path: Path) -> List[dict]:
+    """Metadata of documents_meta.json, then of the JSONL log; later records of an id replace earlier ones."""
+    records: Dict[str, dict] = {}
     if meta_path.exists():
         try:
             with meta_path.open("r", encoding="utf-8") as f:
-                data = json.load(f)
+                for record in json.load(f):
+                    records[record["id"]] = record
         except json.JSONDecodeError:
-            pass
-
-    # avoid duplicates
-    if any(b["id"] == book_data["id"] for b in data):
-        print(f"⚠️ Book {book_data['id']} already exists in {meta_path.name}")
-        return
+            print(f"⚠️ Could not read {meta_path.name}")
+    if log_path.exists():
+        with log_path.open("r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue # torn last line of an interrupted write
+                records[record["id"]] = record
+    return list(records.values())
 
-    data.append({
-        "id": book_data["id"],
-        "title": book_data["title"],
-        "cover": book_data["cover"],
-        "text_path": f"documents/{book_data['id']}.txt"
-    })
 
-    with meta_path.open("w", encoding="utf-8") as f:
+def compact_metadata(meta_path: Path, log_path: Path):
+    """Fold the JSONL log into documents_meta.json, and empty the log."""
+    data = sorted(read_metadata(meta_path, log_path), key=lambda record: int(record["id"]))
+    tmp_path = meta_path.with_suffix(".json.tmp")
+    with tmp_path.open("w", encoding="utf-8") as f:
         json.dump(data, f, ensure_ascii=False, indent=2)
-    print(f"📝 Updated metadata file: {meta_path.name}")
+    os.replace(tmp_path, meta_path)
+    log_path.unlink(missing_ok=True)
+    print(f"🗜️ Compacted {len(data)} books into {meta_path.name}")
 
 
 def save_text(book_data: dict, docs_dir: Path):
@@ -135,40 +223,112 @@ def save_text(book_data: dict, docs_dir: Path):
     print(f"📖 Saved text to {text_path}")
 
 
-# -------------------------------
-# Main script
-# -------------------------------
-if __name__ == "__main__":
-    current_dir = Path(__file__).resolve().parent
-    docs_dir = current_dir / "documents"
-    meta_path = current_dir / "documents_meta.json"
-    failed_path = current_dir / "failed_ids.txt"
+class Checkpoint:
+    """Books done and failed so far, saved atomically as JSON."""
 
+    def __init__(self, path: Path):
+        self.path = path
+        self.done: set = set()
+        self.failed: Dict[str, str] = {} # id => error
+        if path.exists():
+            with path.open("r", encoding="utf-8") as f:
+                saved = json.load(f)
+            self.done = set(saved.get("done", []))
+            self.failed = saved.get("failed", {})
 
-    # Load existing IDs
-    existing_ids = set()
-    if meta_path.exists():
-        try:
-            with meta_path.open("r", encoding="utf-8") as f:
-                data = json.load(f)
-                existing_ids = {int(b["id"]) for b in data}
-            print(f"📂 Loaded {len(existing_ids)} existing IDs from metadata.")
-        except Exception:
-            print("⚠️ Could not read metadata; starting fresh.")
+    def save(self):
+        tmp_path = self.path.with_suffix(".tmp")
+        with tmp_path.open("w", encoding="utf-8") as f:
+            json.dump({"done": sorted(self.done, key=int), "failed": self.failed}, f)
+        os.replace(tmp_path, self.path)
 
-    for book_id in range(1, 2001):  # change range for your next batch
-        if book_id in existing_ids:
-            print(f"⏭️ Skipping already collected book {book_id}")
-            continue
 
-        url = f"https://www.gutenberg.org/ebooks/{book_id}"
+def scrape(book_ids: List[int], docs_dir: Path, meta_path: Path, log_path: Path, checkpoint: Checkpoint, base_url: str = GUTENBERG_URL, workers: int = WORKERS, rate: float = RATE, retry_failed: bool = False) -> dict:
+    """Fetch `book_ids` concurrently, skipping those already collected. Returns throughput stats."""
+    existing_ids = {record["id"] for record in read_metadata(meta_path, log_path)} | checkpoint.done
+    if not retry_failed:
+        existing_ids |= set(checkpoint.failed)
+    todo = [str(book_id) for book_id in book_ids if str(book_id) not in existing_ids]
+    print(f"📂 {len(book_ids) - len(todo)} books already collected or failed, {len(todo)} to fetch.")
+
+    limiter = RateLimiter(rate, burst=workers)
+    pending_records: List[dict] = []
+    pending_ids: List[str] = []
+    fetched = failed = 0
+    start = time.perf_counter()
+
+    def fetch(book_id: str) -> dict:
+        book = fetch_gutenberg_book(f"{base_url}/ebooks/{book_id}", base_url, session(), limiter)
+        save_text(book, docs_dir)
+        return metadata_record(book)
+
+    def flush():
+        append_metadata(pending_records, log_path)
+        checkpoint.done.update(pending_ids)
+        checkpoint.save()
+        pending_records.clear()
+        pending_ids.clear()
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures: Dict[Future, str] = {}
+        remaining = iter(todo)
         try:
-            book = fetch_gutenberg_book(url)
-            save_text(book, docs_dir)
-            append_metadata(book, meta_path)
-            print(f"✨ Done {book_id}.")
-        except Exception as e:
-            with failed_path.open("a", encoding="utf-8") as f:
-                f.write(f"{book_id}\n")
-            print(f"❌ Skipping {book_id}: {e}")
+            while True:
+                # Bounded number of books in flight
+                for book_id in remaining:
+                    futures[pool.submit(fetch, book_id)] = book_id
+                    if len(futures) >= 2 * workers:
+                        break
+                if not futures:
+                    break
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    book_id = futures.pop(future)
+                    try:
+                        pending_records.append(future.result())
+                        pending_ids.append(book_id)
+                        checkpoint.failed.pop(book_id, None)
+                        fetched += 1
+                        print(f"✨ Done {book_id}.")
+                    except Exception as e:
+                        checkpoint.failed[book_id] = str(e)
+                        failed += 1
+                        print(f"❌ Skipping {book_id}: {e}")
+                if len(pending_records) >= METADATA_BATCH:
+                    flush()
+        finally:
+            for future in futures:
+                future.cancel()
+            flush()
+
+    elapsed = time.perf_counter() - start
+    stats = {"fetched": fetched, "failed": failed, "seconds": elapsed, "books_per_second": fetched / elapsed if elapsed else 0.0}
+    print(f"📊 {fetched} books fetched, {failed} failed in {elapsed:.1f}s: {stats['books_per_second']:.2f} books/s")
+    return stats
+
+
+# -------------------------------
+# Main script
+# -------------------------------
+if __name__ == "__main__":
+    current_dir = Path(__file__).resolve().parent
+    parser = argparse.ArgumentParser(description="Fetch Project Gutenberg books into ./documents.")
+    parser.add_argument("--start", type=int, default=1)
+    parser.add_argument("--end", type=int, default=2000, help="last book id (inclusive)")
+    parser.add_argument("--base-url", default=GUTENBERG_URL, help="e.g. http://localhost:8001 for fixture_server.py")
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    parser.add_argument("--rate", type=float, default=RATE, help="requests per second per host (0: unlimited)")
+    parser.add_argument("--docs", type=Path, default=current_dir / "documents")
+    parser.add_argument("--meta", type=Path, default=current_dir / "documents_meta.json")
+    parser.add_argument("--checkpoint", type=Path, default=current_dir / "scrape_checkpoint.json")
+    parser.add_argument("--retry-failed", action="store_true")
+    parser.add_argument("--compact", action="store_true", help="fold documents_meta.jsonl into documents_meta.json when done")
+    args = parser.parse_args()
 
+    log_path = args.meta.with_suffix(".jsonl")
+    scrape(
+        list(range(args.start, args.end + 1)), args.docs, args.meta, log_path, Checkpoint(args.checkpoint),
+        base_url=args.base_url.rstrip("/"), workers=args.workers, rate=args.rate, retry_failed=args.retry_failed,
+    )
+    if args.compact:
+        compact_metadata(args.meta, log_path)
@@ -9,8 +9,16 @@ const useMock = false // set to false when backend is ready
 
 
 
-// Keyword or regex search, depending on mode
-export async function search(search_term: string, method: string, ranking: string) {
+// The backend's search types (SearchType in business_logic.py), sent as they are.
+// Any other mode (e.g. an old `m=keyword` link) searches by keyword.
+const SEARCH_TYPES = ['basic', 'regex', 'phrase', 'fulltext_regex']
+
+function searchType(method: string): string {
+  return SEARCH_TYPES.includes(method) ? method : 'basic'
+}
+
+// Keyword, regex, phrase or full-text regex search, depending on mode
+export async function search(search_term: string, method: string, ranking: string, snippets = false) {
   console.log('📡 API call started with:', { search_term, method, ranking })
 
   if (useMock) {
@@ -21,11 +29,12 @@ export async function search(search_term: string, method: string, ranking: strin
   }
 
   try {
-    const search_type = method === 'regex' ? 'regex' : 'basic'
+    const search_type = searchType(method)
     const response = await axios.post(`${API_BASE}/search`, {
       query: search_term,
       type: search_type,
-      ranking: ranking
+      ranking: ranking,
+      snippets: snippets
     })
 
     console.log('✅ Received response from backend:', response.data)
@@ -37,8 +46,31 @@ export async function search(search_term: string, method: string, ranking: strin
   }
 }
 
-// Retrieve full document text by id
-export async function getDocumentText(id: number) {
-  const response = await axios.get(`${API_BASE}/document_text/${id}`)
+// One page of search results: { results, next_cursor, total }.
+// Pass the next_cursor of a page to get the next one (null on the last page).
+export async function searchPage(search_term: string, method: string, ranking: string, limit = 20, cursor: string | null = null, snippets = false) {
+  const search_type = searchType(method)
+  const response = await axios.post(`${API_BASE}/search`, {
+    query: search_term,
+    type: search_type,
+    ranking: ranking,
+    snippets: snippets,
+    limit: limit,
+    ...(cursor ? { cursor } : {})
+  })
   return response.data
 }
+
+// Retrieve a page of a document's text by id, from byte `offset` (the first page by default).
+// Read the next page from `next` until it reaches `size`.
+export async function getDocumentText(id: number, offset = 0, length?: number) {
+  const response = await axios.get(`${API_BASE}/document_text/${id}`, {
+    params: { offset, length },
+    responseType: 'text'
+  })
+  return {
+    text: response.data as string,
+    next: Number(response.headers['x-next-offset']),
+    size: Number(response.headers['x-document-size'])
+  }
+}